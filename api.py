@@ -0,0 +1,359 @@
+import argparse
+import asyncio
+import base64
+import binascii
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from email.utils import formatdate, parsedate_to_datetime
+
+from aiohttp import web
+
+import dal
+from cache import cache_stats, table_version
+from db import POOL_CONFIG, PoolTimeout, pool_stats
+
+# JSON API только для чтения рядом с main.py: каталог (поиск, фильтр по категории,
+# сортировка по рейтингу), категории, заказы покупателя и сводка администратора.
+# Запросы те же, что у страниц (dal.py); функции dal синхронные и выполняются
+# в пуле потоков размером с пул соединений, чтобы обработчики не ждали свободного
+# соединения в потоке событий.
+#
+# Условные запросы: ETag и Last-Modified ответа строятся из версий таблиц, от
+# которых он зависит (cache.table_version, migrations/013_change_versions.sql).
+# Версии приходят уведомлениями и хранятся в памяти, поэтому ответ 304 на
+# If-None-Match / If-Modified-Since не обращается к БД. Ответы сжимаются gzip,
+# если клиент его принимает. Листание — по непрозрачному курсору next_cursor.
+#
+# Запуск: python api.py [--host 0.0.0.0] [--port 8080]
+API_HOST = os.environ.get("API_HOST", "0.0.0.0")
+API_PORT = int(os.environ.get("API_PORT", "8080"))
+# Сколько секунд клиент или промежуточный кэш может отдавать каталог без проверки
+API_MAX_AGE = int(os.environ.get("API_MAX_AGE", "5"))
+# Сколько секунд помнить проверенные логин и пароль: crypt() в БД на каждый запрос дорог.
+# Запись действует, пока не изменилась таблица Users (migrations/016_users_notify.sql)
+API_AUTH_TTL = float(os.environ.get("API_AUTH_TTL", "60"))
+API_AUTH_CACHE_SIZE = 1000
+DEFAULT_PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+# Входит в ETag: при изменении формата ответов прежние ETag перестают совпадать
+FORMAT_VERSION = "1"
+# Ответы меньше этого размера не сжимаются
+GZIP_MIN_BYTES = 1024
+
+ADMIN_ROLE = 1
+
+
+class ApiError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} не сериализуется в JSON")
+
+
+def json_bytes(value):
+    return json.dumps(value, default=_json_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def error_response(status, message, headers=None):
+    return web.Response(status=status, body=json_bytes({"error": message}), content_type="application/json",
+                        headers=headers)
+
+
+@web.middleware
+async def errors_middleware(request, handler):
+    try:
+        return await handler(request)
+    except ApiError as e:
+        return error_response(e.status, e.message, e.headers)
+    except PoolTimeout as e:
+        return error_response(503, str(e), {"Retry-After": "1"})
+
+
+# Вызов синхронной функции доступа к данным в пуле потоков
+async def run_db(function, *args):
+    return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+
+# Курсор страницы для клиента: значение курсора dal в JSON, закодированное base64
+def encode_cursor(value):
+    if value is None:
+        return None
+    return base64.urlsafe_b64encode(json_bytes(value)).decode("ascii").rstrip("=")
+
+
+def decode_cursor(text):
+    if not text:
+        return None
+    try:
+        return json.loads(base64.urlsafe_b64decode(text + "=" * (-len(text) % 4)))
+    except (binascii.Error, ValueError):
+        raise ApiError(400, "Неверный курсор")
+
+
+def int_param(query, name, default=None, minimum=None, maximum=None):
+    value = query.get(name)
+    if value in (None, ""):
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        raise ApiError(400, f"Параметр {name} должен быть целым числом")
+    if (minimum is not None and number < minimum) or (maximum is not None and number > maximum):
+        raise ApiError(400, f"Параметр {name} вне допустимого диапазона")
+    return number
+
+
+def date_param(query, name):
+    value = query.get(name)
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ApiError(400, f"Параметр {name} должен быть датой ГГГГ-ММ-ДД")
+
+
+def page_size(query):
+    return int_param(query, "limit", DEFAULT_PAGE_SIZE, 1, MAX_PAGE_SIZE)
+
+
+# Совпадает ли запрос клиента с текущей версией. If-None-Match важнее
+# If-Modified-Since; ETag слабые, поэтому сравниваются без префикса W/.
+def not_modified(request, etag, last_modified):
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or any(tag.removeprefix("W/") == etag.removeprefix("W/") for tag in tags)
+    if_modified_since = request.headers.get("If-Modified-Since")
+    if if_modified_since is None or last_modified is None:
+        return False
+    try:
+        return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+
+
+# Ответ, зависящий от таблиц tables и параметров params — тех значений, с которыми
+# он на самом деле загружается (после разбора запроса и подстановки умолчаний).
+# ETag строится из версий таблиц, пути и params. Версия берётся до загрузки данных:
+# если таблица изменится во время загрузки, следующий запрос получит новые данные.
+# Last-Modified не ставится, пока идёт секунда последнего изменения: в ней
+# могут случиться ещё изменения с тем же значением заголовка.
+# private — ответ для одного пользователя: промежуточные кэши его не хранят.
+# modified_since=False — ответ меняется и без изменения таблиц (например, период
+# по умолчанию сдвигается с датой), и If-Modified-Since к нему неприменим.
+async def versioned_response(request, tables, load, params=None, private=False, modified_since=True):
+    headers = {
+        "Cache-Control": "private, no-cache" if private else f"public, max-age={API_MAX_AGE}",
+        "Vary": "Accept-Encoding, Authorization" if private else "Accept-Encoding",
+    }
+    version = table_version(tables)
+    if version is not None:
+        versions, changed_at = version
+        digest = hashlib.md5(f"{FORMAT_VERSION}:{versions}:".encode("ascii") +
+                             json_bytes([request.path, params])).hexdigest()[:16]
+        headers["ETag"] = etag = f'W/"{digest}"'
+        last_modified = None
+        if modified_since and int(changed_at) < int(time.time()):
+            headers["Last-Modified"] = last_modified = formatdate(int(changed_at), usegmt=True)
+        if not_modified(request, etag, last_modified):
+            return web.Response(status=304, headers=headers)
+
+    body = json_bytes(await run_db(load))
+    response = web.Response(body=body, content_type="application/json", headers=headers)
+    if len(body) >= GZIP_MIN_BYTES:
+        response.enable_compression()
+    return response
+
+
+# Проверенные пары логин/пароль: {хэш пары: (пользователь, срок, версия Users)}.
+# Смена пароля, роли или удаление пользователя меняют версию Users, и запись
+# перестаёт действовать. Пока слушателя уведомлений нет, версии нет и кэш не
+# используется: без уведомлений смена пароля не была бы видна.
+_auth_cache = OrderedDict()
+_auth_lock = threading.Lock()
+
+
+def _check_credentials(username, password):
+    key = hashlib.sha256(f"{username}\0{password}".encode("utf-8")).digest()
+    now = time.monotonic()
+    # Версия до запроса к БД: изменение во время проверки не попадёт в кэш под новой версией
+    version = table_version(("users",))
+    if version is not None:
+        version = version[0]
+        with _auth_lock:
+            entry = _auth_cache.get(key)
+            if entry is not None and entry[1] > now and entry[2] == version:
+                return entry[0]
+    user = dal.authenticate(username, password)
+    if user is None:
+        return None
+    user = dict(user)
+    if version is None:
+        return user
+    with _auth_lock:
+        _auth_cache[key] = (user, now + API_AUTH_TTL, version)
+        _auth_cache.move_to_end(key)
+        while len(_auth_cache) > API_AUTH_CACHE_SIZE:
+            _auth_cache.popitem(last=False)
+    return user
+
+
+# Пользователь по заголовку Authorization: Basic (логин и пароль те же, что на странице входа)
+async def authenticated_user(request):
+    challenge = {"WWW-Authenticate": 'Basic realm="api", charset="UTF-8"'}
+    scheme, _, credentials = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "basic" or not credentials:
+        raise ApiError(401, "Нужна авторизация", challenge)
+    try:
+        username, _, password = base64.b64decode(credentials).decode("utf-8").partition(":")
+    except (binascii.Error, UnicodeDecodeError):
+        raise ApiError(401, "Неверный заголовок авторизации", challenge)
+    user = await run_db(_check_credentials, username, password)
+    if user is None:
+        raise ApiError(401, "Неверный логин или пароль", challenge)
+    return user
+
+
+def rows(items):
+    return [dict(item) for item in items]
+
+
+async def categories(request):
+    return await versioned_response(request, ["categories"], lambda: {"items": rows(dal.fetch_categories())})
+
+
+# Каталог: q — поиск, category — категория, sort=id|rating, min_rating, limit, cursor
+async def products(request):
+    query = request.query
+    search_query = query.get("q", "").strip() or None
+    category_id = int_param(query, "category")
+    sort = query.get("sort", "id")
+    if sort not in ("id", "rating"):
+        raise ApiError(400, "Параметр sort: id или rating")
+    try:
+        min_rating = Decimal(query["min_rating"]) if query.get("min_rating") else None
+    except InvalidOperation:
+        raise ApiError(400, "Параметр min_rating должен быть числом")
+    limit = page_size(query)
+    cursor = decode_cursor(query.get("cursor"))
+    try:
+        if cursor is not None and search_query:
+            cursor = int(cursor)
+        elif cursor is not None and sort == "rating":
+            cursor = Decimal(cursor[0]), int(cursor[1])
+        elif cursor is not None:
+            cursor = int(cursor)
+    except (TypeError, ValueError, IndexError, KeyError, InvalidOperation):
+        raise ApiError(400, "Курсор не подходит к параметрам запроса")
+
+    def load():
+        items, has_next = dal.fetch_products_page(search_query, category_id, cursor, limit, sort, min_rating)
+        next_cursor = dal.next_products_cursor(search_query, cursor, items, sort) if has_next else None
+        return {"items": rows(items), "next_cursor": encode_cursor(next_cursor)}
+
+    params = [search_query, category_id, sort, min_rating, limit, cursor]
+    return await versioned_response(request, ["categories", "products", "productratings"], load, params)
+
+
+# Заказы пользователя от новых к старым: status, from, to, limit, cursor.
+# Администратор видит все заказы и может отобрать их по user_id.
+async def orders(request):
+    user = await authenticated_user(request)
+    query = request.query
+    status = query.get("status") or None
+    if status is not None and status not in dal.ORDER_STATUSES:
+        raise ApiError(400, f"Параметр status: {', '.join(dal.ORDER_STATUSES)}")
+    filters = {
+        "user_id": int_param(query, "user_id") if user["roleid"] == ADMIN_ROLE else user["userid"],
+        "status": status,
+        "date_from": date_param(query, "from"),
+        "date_to": date_param(query, "to"),
+    }
+    limit = page_size(query)
+    cursor = decode_cursor(query.get("cursor"))
+    try:
+        after = (datetime.fromisoformat(cursor[0]), int(cursor[1])) if cursor is not None else None
+    except (TypeError, ValueError, IndexError, KeyError):
+        raise ApiError(400, "Неверный курсор")
+
+    def load():
+        items, has_next = dal.fetch_orders_page(filters, after, limit)
+        next_cursor = (items[-1]["orderdate"], items[-1]["orderid"]) if has_next else None
+        return {"items": rows(items), "next_cursor": encode_cursor(next_cursor)}
+
+    # Позиции заказов несут названия товаров
+    return await versioned_response(request, ["orders", "products"], load, [filters, limit, after], private=True)
+
+
+# Сводка по доставленным заказам за период (from, to включительно): итог
+# и колонки по покупателям, как на странице «Анализ заказов»
+async def order_summary(request):
+    user = await authenticated_user(request)
+    if user["roleid"] != ADMIN_ROLE:
+        raise ApiError(403, "Доступно только администратору")
+    today = date.today()
+    start_date = date_param(request.query, "from")
+    end_date = date_param(request.query, "to")
+    default_period = start_date is None or end_date is None
+    start_date = start_date or today
+    end_date = end_date or today
+    if start_date > end_date:
+        raise ApiError(400, "Дата начала позже даты окончания")
+
+    def load():
+        columns, totals = dal.fetch_order_summary(start_date, end_date)
+        return {"from": start_date, "to": end_date, "totals": totals, "users": columns}
+
+    return await versioned_response(request, ["dailysalesrollup"], load, [start_date, end_date], private=True,
+                                    modified_since=not default_period)
+
+
+# Состояние экземпляра для балансировщика и нагрузочного замера
+async def health(request):
+    body = json_bytes({"pool": pool_stats(), "cache": cache_stats()})
+    return web.Response(body=body, content_type="application/json", headers={"Cache-Control": "no-store"})
+
+
+async def _setup_executor(app):
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(POOL_CONFIG["maxconn"], thread_name_prefix="api-db"))
+
+
+def create_app():
+    app = web.Application(middlewares=[errors_middleware])
+    app.on_startup.append(_setup_executor)
+    app.router.add_get("/api/categories", categories)
+    app.router.add_get("/api/products", products)
+    app.router.add_get("/api/orders", orders)
+    app.router.add_get("/api/admin/order-summary", order_summary)
+    app.router.add_get("/api/health", health)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON API каталога и заказов")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    args = parser.parse_args()
+    web.run_app(create_app(), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
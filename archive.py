@@ -0,0 +1,160 @@
+import gzip
+import json
+import os
+import shutil
+from datetime import date, datetime
+
+from cache import NOTIFY_CHANNEL
+from db import get_connection
+
+# Архив старых месяцев заказов. Orders и OrderDetails разбиты на секции по месяцам
+# (migrations/012_partition_orders.sql): месяц выгружается в сжатые CSV-файлы,
+# его секции отсоединяются и удаляются. Это не оставляет мёртвых строк, как DELETE,
+# и не вызывает триггеры сводки продаж — история в DailySalesRollup сохраняется,
+# а месяц записывается в ArchivedOrderMonths, чтобы пересчёт сводки его не трогал.
+# Файлы месяца лежат в ORDER_ARCHIVE_DIR/ГГГГ_ММ/ вместе с manifest.json.
+ORDER_ARCHIVE_DIR = os.environ.get("ORDER_ARCHIVE_DIR", "order_archive")
+# Сколько ждать блокировку Orders при отсоединении секций: ожидающий DETACH
+# задерживает все запросы к заказам, поэтому лучше отказаться и повторить позже
+ARCHIVE_LOCK_TIMEOUT = os.environ.get("ORDER_ARCHIVE_LOCK_TIMEOUT", "5s")
+# Позиции выгружаются и удаляются раньше заказов, восстанавливаются после
+TABLES = ("orderdetails", "orders")
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def month_suffix(month):
+    return month.strftime("%Y_%m")
+
+
+def parse_month(value):
+    return datetime.strptime(value, "%Y-%m").date()
+
+
+# Отсоединение секций и COPY прямо в секцию не вызывают триггеры Orders, поэтому
+# об изменении заказов (для кэшей и ETag API) сообщается явно в той же транзакции
+def _notify_orders_changed(cur):
+    cur.execute("SELECT pg_notify(%s, json_build_object('table', 'orders', 'xid', txid_current())::TEXT)",
+                (NOTIFY_CHANNEL,))
+
+
+# Имена секций и колонок берутся из дат и каталога БД, поэтому подставляются в запросы как есть
+def _partition(table, month):
+    return f"{table}_{month_suffix(month)}"
+
+
+def _month_dir(directory, month):
+    return os.path.join(directory, month_suffix(month))
+
+
+# Месяцы, у которых есть секция заказов, по возрастанию
+def partition_months(cur):
+    cur.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'orders'::regclass AND c.relname ~ '^orders_[0-9]{4}_[0-9]{2}$'
+        ORDER BY c.relname
+    """)
+    return [datetime.strptime(name[len("orders_"):], "%Y_%m").date() for name, in cur.fetchall()]
+
+
+def _table_columns(cur, table):
+    cur.execute("""
+        SELECT attname FROM pg_attribute
+        WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped
+        ORDER BY attnum
+    """, (table,))
+    return [name for name, in cur.fetchall()]
+
+
+# Выгрузка и удаление секций одного месяца в одной транзакции. Секции блокируются
+# в режиме SHARE: чтение не мешает, а запись в них ждёт, пока месяц не будет
+# выгружен. Если что-то не удалось, файлы удаляются и секции остаются на месте.
+def archive_month(month, directory=ORDER_ARCHIVE_DIR):
+    target = _month_dir(directory, month)
+    if os.path.exists(os.path.join(target, "manifest.json")):
+        raise ArchiveError(f"Архив за {month:%Y-%m} уже есть: {target}")
+    os.makedirs(target, exist_ok=True)
+    manifest = {"month": f"{month:%Y-%m}", "created_at": datetime.now().isoformat(timespec="seconds"),
+                "tables": {}}
+    try:
+        with get_connection() as conn, conn.cursor() as cur:
+            partitions = [_partition(table, month) for table in TABLES]
+            cur.execute(f"LOCK TABLE {', '.join(partitions)} IN SHARE MODE")
+            for table, partition in zip(TABLES, partitions):
+                columns = _table_columns(cur, table)
+                file_name = f"{table}.csv.gz"
+                with gzip.open(os.path.join(target, file_name), "wb", compresslevel=6) as output:
+                    cur.copy_expert(f"COPY (SELECT {', '.join(columns)} FROM {partition}) "
+                                    f"TO STDOUT WITH (FORMAT csv, HEADER)", output)
+                manifest["tables"][table] = {"file": file_name, "rows": cur.rowcount, "columns": columns}
+            with open(os.path.join(target, "manifest.json"), "w", encoding="utf-8") as output:
+                json.dump(manifest, output, ensure_ascii=False, indent=2)
+
+            cur.execute("INSERT INTO ArchivedOrderMonths (Month, OrdersCount, LinesCount) VALUES (%s, %s, %s)",
+                        (month, manifest["tables"]["orders"]["rows"], manifest["tables"]["orderdetails"]["rows"]))
+            cur.execute("SET LOCAL lock_timeout = %s", (ARCHIVE_LOCK_TIMEOUT,))
+            # Отсоединённая секция позиций сохраняет внешний ключ на Orders,
+            # поэтому она удаляется до отсоединения секции заказов
+            for table, partition in zip(TABLES, partitions):
+                cur.execute(f"ALTER TABLE {table} DETACH PARTITION {partition}")
+                cur.execute(f"DROP TABLE {partition}")
+            _notify_orders_changed(cur)
+            conn.commit()
+    except BaseException:
+        shutil.rmtree(target, ignore_errors=True)
+        raise
+    return {table: info["rows"] for table, info in manifest["tables"].items()}
+
+
+# Архивирование всех месяцев раньше before (первое число месяца). Текущий месяц
+# архивировать нельзя: в него ещё пишутся заказы. Каждый месяц — отдельная транзакция,
+# так что уже архивированные месяцы не откатываются из-за ошибки в следующем.
+def archive_before(before, directory=ORDER_ARCHIVE_DIR, log=print):
+    before = before.replace(day=1)
+    if before > date.today().replace(day=1):
+        raise ArchiveError("Архивировать можно только месяцы раньше текущего")
+    with get_connection() as conn, conn.cursor() as cur:
+        months = [month for month in partition_months(cur) if month < before]
+    archived = []
+    for month in months:
+        rows = archive_month(month, directory)
+        log(f"{month:%Y-%m}: заказов {rows['orders']}, позиций {rows['orderdetails']}")
+        archived.append(month)
+    return archived
+
+
+# Возврат месяца из архива. Строки копируются прямо в секции, а не в Orders:
+# триггеры сводки висят на родительской таблице и не сработают, так что
+# сохранённая при архивировании история не удвоится. Файлы архива остаются.
+def restore_month(month, directory=ORDER_ARCHIVE_DIR):
+    target = _month_dir(directory, month)
+    try:
+        with open(os.path.join(target, "manifest.json"), encoding="utf-8") as source:
+            manifest = json.load(source)
+    except FileNotFoundError:
+        raise ArchiveError(f"Нет архива за {month:%Y-%m} в {directory}")
+
+    restored = {}
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT create_order_partition(%s)", (month,))
+        for table in reversed(TABLES):
+            info = manifest["tables"][table]
+            partition = _partition(table, month)
+            cur.execute(f"SELECT EXISTS (SELECT 1 FROM {partition})")
+            if cur.fetchone()[0]:
+                raise ArchiveError(f"Секция {partition} не пуста, месяц уже восстановлен")
+            with gzip.open(os.path.join(target, info["file"]), "rb") as source:
+                cur.copy_expert(f"COPY {partition} ({', '.join(info['columns'])}) "
+                                f"FROM STDIN WITH (FORMAT csv, HEADER)", source)
+            if cur.rowcount != info["rows"]:
+                raise ArchiveError(f"{info['file']}: загружено {cur.rowcount} строк, "
+                                   f"в архиве {info['rows']}")
+            restored[table] = cur.rowcount
+        cur.execute("DELETE FROM ArchivedOrderMonths WHERE Month = %s", (month,))
+        _notify_orders_changed(cur)
+        conn.commit()
+    return restored
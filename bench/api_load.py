@@ -0,0 +1,181 @@
+# Нагрузочный замер JSON API (api.py) на локальном экземпляре. Смесь запросов —
+# категории, страницы каталога по категориям, поиск, заказы покупателей (Basic-авторизация
+# пользователей из generate-data) и, если задан --admin, сводка администратора.
+# Смесь прогоняется дважды: обычными запросами и повторными с If-None-Match из
+# первого прогона, как делают браузер и HTTP-кэш. Для прогона выводятся запросы
+# в секунду, p50/p95 задержки, доля ответов 304 и число соединений, взятых из пула
+# API на один запрос (по /api/health).
+#
+# Запуск из корня проекта на базе, заполненной python manage.py generate-data:
+#     python bench/api_load.py [--concurrency 16] [--requests 2000] [--password password]
+#                              [--admin login:password] [--url http://127.0.0.1:8080]
+#
+# Без --url замер сам запускает python api.py на свободном порту и останавливает его в конце.
+import argparse
+import asyncio
+import base64
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SEARCH_QUERIES = ["гантели", "мяч", "коврик", "кроссовки", "рюкзак"]
+CUSTOMERS = 200
+
+
+def load_context():
+    from db import get_connection
+
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT categoryid FROM categories ORDER BY categoryid")
+        categories = [row[0] for row in cur.fetchall()]
+        cur.execute("""
+            SELECT u.username FROM users u
+            WHERE u.userid IN (SELECT userid FROM orders GROUP BY userid ORDER BY count(*) DESC LIMIT %s)
+        """, (CUSTOMERS,))
+        customers = [row[0] for row in cur.fetchall()]
+        cur.execute("SELECT MAX(orderdate)::date FROM orders")
+        last_day = cur.fetchone()[0]
+    if not (categories and customers and last_day):
+        raise SystemExit("В базе нет данных для замера: заполните её командой python manage.py generate-data")
+    return categories, customers, last_day
+
+
+# Смесь запросов: (путь, логин и пароль или None)
+def request_mix(count, password, admin):
+    categories, customers, last_day = load_context()
+    kinds = [
+        (10, lambda: ("/api/categories", None)),
+        (40, lambda: (f"/api/products?category={random.choice(categories)}", None)),
+        (15, lambda: (f"/api/products?sort=rating&category={random.choice(categories)}", None)),
+        (15, lambda: (f"/api/products?q={random.choice(SEARCH_QUERIES)}", None)),
+        (20, lambda: ("/api/orders?limit=20", (random.choice(customers), password))),
+    ]
+    if admin:
+        login, _, admin_password = admin.partition(":")
+        kinds.append((5, lambda: (f"/api/admin/order-summary?from={last_day.replace(day=1)}&to={last_day}",
+                                  (login, admin_password))))
+    weights = [weight for weight, _ in kinds]
+    random.seed(1)
+    return [random.choices(kinds, weights)[0][1]() for _ in range(count)]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_ready(session, url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise SystemExit(f"api.py завершился с кодом {process.returncode}")
+        try:
+            async with session.get(f"{url}/api/health") as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    raise SystemExit(f"API не ответил за {timeout} с: {url}")
+
+
+async def pool_checkouts(session, url):
+    async with session.get(f"{url}/api/health") as response:
+        stats = (await response.json())["pool"]
+    return stats["checkouts"] if stats else 0
+
+
+# Один прогон смеси с concurrency одновременными запросами. etags — ETag прошлого
+# прогона по пути и пользователю: с ними запросы становятся условными.
+async def run_pass(session, url, mix, concurrency, etags=None):
+    queue = list(mix)
+    timings = []
+    statuses = {}
+    seen = {}
+
+    async def worker():
+        while queue:
+            path, credentials = queue.pop()
+            headers = {"Accept-Encoding": "gzip"}
+            if etags is not None and (path, credentials) in etags:
+                headers["If-None-Match"] = etags[(path, credentials)]
+            if credentials:
+                token = base64.b64encode(":".join(credentials).encode("utf-8")).decode("ascii")
+                headers["Authorization"] = f"Basic {token}"
+            started = time.perf_counter()
+            async with session.get(url + path, headers=headers) as response:
+                await response.read()
+                timings.append((time.perf_counter() - started) * 1000)
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+                if "ETag" in response.headers:
+                    seen[(path, credentials)] = response.headers["ETag"]
+
+    checkouts_before = await pool_checkouts(session, url)
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    checkouts = await pool_checkouts(session, url) - checkouts_before
+    timings.sort()
+    return {
+        "rps": len(mix) / elapsed,
+        "p50": statistics.median(timings),
+        "p95": timings[int(len(timings) * 0.95) - 1],
+        "not_modified": statuses.get(304, 0) / len(mix),
+        "errors": sum(count for status, count in statuses.items() if status >= 400),
+        "checkouts": checkouts / len(mix),
+    }, seen
+
+
+async def run(args):
+    process = None
+    url = args.url
+    if url is None:
+        port = free_port()
+        url = f"http://127.0.0.1:{port}"
+        process = subprocess.Popen([sys.executable, os.path.join(ROOT, "api.py"), "--host", "127.0.0.1",
+                                    "--port", str(port)], cwd=ROOT)
+    try:
+        mix = request_mix(args.requests, args.password, args.admin)
+        connector = aiohttp.TCPConnector(limit=args.concurrency)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            await wait_ready(session, url, process)
+            # Прогрев: подключение API к уведомлениям, кэш каталога и авторизации
+            await run_pass(session, url, mix[:args.concurrency * 4], args.concurrency)
+
+            print(f"{'прогон':<16} {'запр/с':>8} {'p50, мс':>8} {'p95, мс':>8} {'304':>6} "
+                  f"{'ошибок':>7} {'соедин./запр.':>14}")
+            etags = None
+            for title in ("без ETag", "If-None-Match"):
+                result, seen = await run_pass(session, url, mix, args.concurrency, etags)
+                print(f"{title:<16} {result['rps']:>8.0f} {result['p50']:>8.2f} {result['p95']:>8.2f} "
+                      f"{result['not_modified']:>6.0%} {result['errors']:>7} {result['checkouts']:>14.2f}")
+                etags = seen
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный замер JSON API")
+    parser.add_argument("--url", help="Адрес запущенного API; без него api.py запускается локально")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--password", default="password", help="Пароль пользователей из generate-data")
+    parser.add_argument("--admin", help="Логин и пароль администратора (login:password) для сводки")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+# Нагрузочная проверка оформления заказа: N сессий одновременно покупают
+# один и тот же «горячий» товар. Проверяется, что товар не продан сверх остатка,
+# что число успешных заказов совпадает с остатком и что не было взаимоблокировок.
+#
+# Запуск из корня проекта (нужна миграция 003_checkout.sql):
+#     python bench/checkout_stress.py [--sessions 50] [--stock 20]
+#
+# Во втором раунде каждая сессия покупает два горячих товара, перечисляя их
+# в случайном порядке, — функция place_order должна блокировать их без deadlock.
+# Созданные товары, пользователь и заказы удаляются после проверки.
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+import psycopg2
+from psycopg2 import errors
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import DB_CONFIG  # noqa: E402
+
+
+def buy(barrier, user_id, items, results):
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        barrier.wait()
+        with conn.cursor() as cur:
+            cur.execute("SELECT order_id FROM place_order(%s, %s::jsonb)", (user_id, json.dumps(items)))
+        conn.commit()
+        results.append("ok")
+    except errors.DeadlockDetected:
+        conn.rollback()
+        results.append("deadlock")
+    except errors.CheckViolation:
+        conn.rollback()
+        results.append("short")
+    except Exception as e:
+        conn.rollback()
+        results.append(f"error: {e}")
+    finally:
+        conn.close()
+
+
+def run_round(sessions, user_id, items_for_session):
+    barrier = threading.Barrier(sessions)
+    results = []
+    threads = [
+        threading.Thread(target=buy, args=(barrier, user_id, items_for_session(i), results))
+        for i in range(sessions)
+    ]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, time.perf_counter() - started
+
+
+def check(cur, product_ids, stock, results, elapsed, title):
+    ok = results.count("ok")
+    print(f"{title}: успешно {ok}, отказов по остатку {results.count('short')}, "
+          f"deadlock {results.count('deadlock')}, за {elapsed:.2f} с")
+    failures = [r for r in results if r.startswith("error")]
+    for failure in failures[:5]:
+        print("  ", failure)
+
+    passed = not failures and "deadlock" not in results and ok == min(len(results), stock)
+    for product_id in product_ids:
+        cur.execute("SELECT stockquantity FROM products WHERE productid = %s", (product_id,))
+        left = cur.fetchone()[0]
+        cur.execute("SELECT COALESCE(SUM(quantity), 0) FROM orderdetails WHERE productid = %s", (product_id,))
+        sold = cur.fetchone()[0]
+        print(f"  товар {product_id}: продано {sold}, осталось {left}")
+        passed = passed and left >= 0 and sold + left == stock and sold == ok
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочная проверка оформления заказа")
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--stock", type=int, default=20)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO users (username, email, passwordhash, roleid)
+        VALUES ('stress_buyer', 'stress_buyer@example.com', '-', (SELECT MIN(roleid) FROM roles))
+        RETURNING userid
+    """)
+    user_id = cur.fetchone()[0]
+    cur.execute("""
+        INSERT INTO products (name, categoryid, price, stockquantity)
+        SELECT 'Горячий товар ' || g, (SELECT MIN(categoryid) FROM categories), 100, %s
+        FROM generate_series(1, 3) AS g
+        RETURNING productid
+    """, (args.stock,))
+    hot, pair_a, pair_b = sorted(row[0] for row in cur.fetchall())
+
+    try:
+        results, elapsed = run_round(args.sessions, user_id, lambda i: [{"productid": hot, "quantity": 1}])
+        passed = check(cur, [hot], args.stock, results, elapsed, "Один товар")
+
+        def pair(i):
+            items = [{"productid": pair_a, "quantity": 1}, {"productid": pair_b, "quantity": 1}]
+            random.shuffle(items)
+            return items
+
+        results, elapsed = run_round(args.sessions, user_id, pair)
+        passed = check(cur, [pair_a, pair_b], args.stock, results, elapsed, "Два товара") and passed
+    finally:
+        cur.execute("""
+            DELETE FROM orderdetails WHERE orderid IN (SELECT orderid FROM orders WHERE userid = %s)
+        """, (user_id,))
+        cur.execute("DELETE FROM orders WHERE userid = %s", (user_id,))
+        cur.execute("DELETE FROM products WHERE productid IN (%s, %s, %s)", (hot, pair_a, pair_b))
+        cur.execute("DELETE FROM users WHERE userid = %s", (user_id,))
+        conn.close()
+
+    print("OK" if passed else "ПРОВАЛ")
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
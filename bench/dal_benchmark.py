@@ -0,0 +1,131 @@
+# Замер слоя доступа к данным (dal.py): память на 100k строк результата и задержка
+# одного вызова частых запросов по сравнению с прежним способом (RealDictCursor,
+# запрос разбирается и планируется сервером при каждом вызове).
+#
+# Запуск из корня проекта на базе, заполненной python manage.py generate-data:
+#     python bench/dal_benchmark.py [--rows 100000] [--repeat 200] [--password password]
+#
+# Память — прирост объектов Python (tracemalloc) при выборке строк позиций заказов:
+# сам результат libpq одинаков для всех способов и не учитывается. Если в базе меньше
+# строк, чем --rows, результат пересчитывается на 100k строк.
+# Задержка — медиана вызова функции dal на одном соединении пула; кэш каталога выключен.
+import argparse
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("CATALOG_CACHE_SIZE", "0")
+
+from psycopg2.extras import RealDictCursor  # noqa: E402
+
+import dal  # noqa: E402
+from db import get_connection  # noqa: E402
+
+ROWS_QUERY = """
+    SELECT od.orderdetailid, od.orderid, od.productid, od.quantity, od.price, od.orderdate
+    FROM orderdetails od
+    LIMIT %s
+"""
+
+# Способ выборки строк: (курсор, функция чтения результата)
+FETCH_MODES = {
+    "RealDictCursor": (RealDictCursor, lambda cur: cur.fetchall()),
+    "Row": (dal.CompactCursor, lambda cur: cur.fetchall()),
+    "колонки": (None, dal.fetch_columns),
+}
+
+# Настройки dal: прежний способ, компактные строки, компактные строки с PREPARE
+SETUPS = {
+    "как раньше": (RealDictCursor, False),
+    "Row": (dal.CompactCursor, False),
+    "Row + PREPARE": (dal.CompactCursor, True),
+}
+
+
+def measure_memory(cur_factory, fetch, limit):
+    with get_connection(read_only=True) as conn, conn.cursor(cursor_factory=cur_factory) as cur:
+        cur.execute(ROWS_QUERY, (limit,))
+        started = time.perf_counter()
+        fetch(cur)
+        elapsed = time.perf_counter() - started
+        rows = cur.rowcount
+
+        cur.execute(ROWS_QUERY, (limit,))
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        result = fetch(cur)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    del result
+    return rows, current - before, peak - before, elapsed
+
+
+def load_values():
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT username FROM users ORDER BY userid DESC LIMIT 1")
+        username = cur.fetchone()
+        cur.execute("SELECT userid FROM orders GROUP BY userid ORDER BY count(*) DESC LIMIT 1")
+        customer = cur.fetchone()
+        cur.execute("SELECT categoryid FROM categories ORDER BY categoryid LIMIT 1")
+        category = cur.fetchone()
+        cur.execute("SELECT MAX(orderdate)::date FROM orders")
+        last_day = cur.fetchone()[0]
+    if not (username and customer and category and last_day):
+        raise SystemExit("В базе нет данных для замера: заполните её командой python manage.py generate-data")
+    return username[0], customer[0], category[0], last_day
+
+
+def timed(call, repeat):
+    # Первые вызовы готовят операторы и прогревают соединение
+    for _ in range(3):
+        call()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер памяти и задержки слоя доступа к данным")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--password", default="password", help="Пароль пользователей из generate-data")
+    args = parser.parse_args()
+
+    print(f"{'выборка':<16} {'строк':>8} {'МБ на 100k':>11} {'пик, МБ на 100k':>16} {'чтение, мс':>11}")
+    for title, (cur_factory, fetch) in FETCH_MODES.items():
+        rows, retained, peak, elapsed = measure_memory(cur_factory, fetch, args.rows)
+        scale = 100_000 / rows if rows else 0
+        print(f"{title:<16} {rows:>8} {retained * scale / 2 ** 20:>11.1f} {peak * scale / 2 ** 20:>16.1f} "
+              f"{elapsed * 1000:>11.1f}")
+
+    username, customer, category, last_day = load_values()
+    operations = {
+        "login": lambda: dal.authenticate(username, args.password),
+        "catalog_page": lambda: dal.load_products_page(None, category, None, 25),
+        "catalog_search": lambda: dal.load_products_page("гантели", None, 0, 25),
+        "orders_customer": lambda: dal.fetch_orders_page({"user_id": customer}, None, 20),
+        "cart": lambda: dal.fetch_cart(customer),
+        "order_summary": lambda: dal.fetch_order_summary(last_day.replace(day=1), last_day),
+    }
+
+    print()
+    print(f"{'операция, мс':<18}" + "".join(f"{title:>15}" for title in SETUPS))
+    try:
+        for name, call in operations.items():
+            medians = []
+            for row_cursor, prepared in SETUPS.values():
+                dal.ROW_CURSOR, dal.PREPARED_STATEMENTS = row_cursor, prepared
+                medians.append(timed(call, args.repeat))
+            print(f"{name:<18}" + "".join(f"{median:>15.3f}" for median in medians))
+    finally:
+        dal.ROW_CURSOR, dal.PREPARED_STATEMENTS = dal.CompactCursor, True
+
+
+if __name__ == "__main__":
+    main()
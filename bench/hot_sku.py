@@ -0,0 +1,188 @@
+# Пропускная способность оформления заказов на один «горячий» товар: прежняя схема
+# (остаток в строке Products, place_order блокирует её до конца транзакции) против
+# секций остатка (migrations/014_stock_buckets.sql). Каждый исполнитель — отдельное
+# соединение, которое в цикле оформляет заказ на одну единицу товара.
+# Для каждой схемы и числа исполнителей выводятся заказы в секунду и p50/p95 задержки.
+# --rtt-ms добавляет паузу между place_order и COMMIT — сетевую задержку до БД,
+# которой нет при замере на одной машине: всё это время строка товара заблокирована.
+#
+# Затем для каждой схемы проверяется распродажа: исполнители покупают товар, пока он
+# не кончится, и продано должно быть ровно столько, сколько было на складе.
+#
+# Запуск из корня проекта (нужна миграция 014_stock_buckets.sql):
+#     python bench/hot_sku.py [--concurrency 1,8,32] [--seconds 5] [--buckets 16] [--rtt-ms 0]
+#                             [--sellout-stock 500]
+#
+# Созданные товар, пользователь и заказы удаляются после замера.
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+import psycopg2
+from psycopg2 import errors
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import DB_CONFIG  # noqa: E402
+
+# Запас, которого хватит на весь замер пропускной способности
+THROUGHPUT_STOCK = 10_000_000
+
+
+# Исполнитель: заказывает товар, пока не истечёт deadline или товар не кончится
+def buyer(barrier, deadline, user_id, product_id, rtt, results):
+    conn = psycopg2.connect(**DB_CONFIG)
+    items = json.dumps([{"productid": product_id, "quantity": 1}])
+    timings = []
+    outcome = {"ok": 0, "short": 0, "deadlock": 0, "errors": []}
+    try:
+        barrier.wait()
+        with conn.cursor() as cur:
+            while time.perf_counter() < deadline[0]:
+                started = time.perf_counter()
+                try:
+                    cur.execute("SELECT order_id FROM place_order(%s, %s::jsonb)", (user_id, items))
+                    if rtt:
+                        time.sleep(rtt)
+                    conn.commit()
+                    outcome["ok"] += 1
+                except errors.CheckViolation:
+                    conn.rollback()
+                    outcome["short"] += 1
+                    break
+                except errors.DeadlockDetected:
+                    conn.rollback()
+                    outcome["deadlock"] += 1
+                except Exception as e:
+                    conn.rollback()
+                    outcome["errors"].append(str(e))
+                    break
+                timings.append((time.perf_counter() - started) * 1000)
+    finally:
+        conn.close()
+    results.append((timings, outcome))
+
+
+def run_buyers(concurrency, seconds, user_id, product_id, rtt=0):
+    barrier = threading.Barrier(concurrency + 1)
+    deadline = [float("inf")]
+    results = []
+    threads = [
+        threading.Thread(target=buyer, args=(barrier, deadline, user_id, product_id, rtt, results))
+        for _ in range(concurrency)
+    ]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    started = time.perf_counter()
+    deadline[0] = started + seconds
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    timings = sorted(ms for worker_timings, _ in results for ms in worker_timings)
+    totals = {"ok": 0, "short": 0, "deadlock": 0, "errors": []}
+    for _, outcome in results:
+        for key in totals:
+            totals[key] += outcome[key]
+    return timings, totals, elapsed
+
+
+# Схема хранения остатка: 0 — строка Products, иначе число секций
+def set_scheme(cur, product_id, buckets, stock):
+    cur.execute("SELECT set_product_stock_buckets(%s, 0)", (product_id,))
+    cur.execute("SELECT set_product_stock(%s, %s)", ([product_id], [stock]))
+    cur.execute("SELECT set_product_stock_buckets(%s, %s)", (product_id, buckets))
+
+
+def stock_left(cur, product_id):
+    cur.execute("""
+        SELECT COALESCE((SELECT SUM(quantity) FROM productstockbuckets WHERE productid = %s),
+                        (SELECT stockquantity FROM products WHERE productid = %s)),
+               (SELECT COUNT(*) FROM productstockbuckets WHERE productid = %s AND quantity < 0)
+    """, (product_id, product_id, product_id))
+    return cur.fetchone()
+
+
+def sold(cur, product_id):
+    cur.execute("SELECT COALESCE(SUM(quantity), 0) FROM orderdetails WHERE productid = %s", (product_id,))
+    return cur.fetchone()[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Оформление заказов на один популярный товар")
+    parser.add_argument("--concurrency", default="1,8,32",
+                        help="Числа одновременных покупателей через запятую")
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--buckets", type=int, default=16)
+    parser.add_argument("--rtt-ms", type=float, default=0, help="Задержка сети до БД перед COMMIT, мс")
+    parser.add_argument("--sellout-stock", type=int, default=500)
+    args = parser.parse_args()
+    levels = [int(level) for level in args.concurrency.split(",")]
+    schemes = {"строка Products": 0, f"{args.buckets} секций": args.buckets}
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO users (username, email, passwordhash, roleid)
+        VALUES ('hot_sku_buyer', 'hot_sku_buyer@example.com', '-', (SELECT MIN(roleid) FROM roles))
+        RETURNING userid
+    """)
+    user_id = cur.fetchone()[0]
+    cur.execute("""
+        INSERT INTO products (name, categoryid, price, stockquantity)
+        VALUES ('Горячий товар', (SELECT MIN(categoryid) FROM categories), 100, 0)
+        RETURNING productid
+    """)
+    product_id = cur.fetchone()[0]
+
+    passed = True
+    try:
+        print(f"{'схема':<18} {'покупателей':>11} {'заказов/с':>10} {'p50, мс':>8} {'p95, мс':>8} "
+              f"{'deadlock':>9} {'ошибок':>7}")
+        for title, buckets in schemes.items():
+            set_scheme(cur, product_id, buckets, THROUGHPUT_STOCK)
+            for concurrency in levels:
+                timings, totals, elapsed = run_buyers(concurrency, args.seconds, user_id, product_id,
+                                                     args.rtt_ms / 1000)
+                p95 = timings[max(int(len(timings) * 0.95) - 1, 0)] if timings else 0
+                print(f"{title:<18} {concurrency:>11} {totals['ok'] / elapsed:>10.0f} "
+                      f"{statistics.median(timings) if timings else 0:>8.2f} {p95:>8.2f} "
+                      f"{totals['deadlock']:>9} {len(totals['errors']):>7}")
+                for error in totals["errors"][:3]:
+                    print("  ", error)
+                passed = passed and not totals["errors"] and not totals["deadlock"]
+
+        print()
+        for title, buckets in schemes.items():
+            set_scheme(cur, product_id, buckets, args.sellout_stock)
+            sold_before = sold(cur, product_id)
+            timings, totals, elapsed = run_buyers(max(levels), float("inf"), user_id, product_id,
+                                                     args.rtt_ms / 1000)
+            sold_now = sold(cur, product_id) - sold_before
+            left, negative = stock_left(cur, product_id)
+            ok = (sold_now == totals["ok"] == args.sellout_stock and left == 0 and not negative
+                  and not totals["errors"] and not totals["deadlock"])
+            print(f"Распродажа, {title}: было {args.sellout_stock}, продано {sold_now}, осталось {left}, "
+                  f"отказов по остатку {totals['short']}, deadlock {totals['deadlock']}, за {elapsed:.2f} с — "
+                  f"{'OK' if ok else 'ПРОВАЛ'}")
+            passed = passed and ok
+    finally:
+        cur.execute("""
+            DELETE FROM orderdetails WHERE orderid IN (SELECT orderid FROM orders WHERE userid = %s)
+        """, (user_id,))
+        cur.execute("DELETE FROM orders WHERE userid = %s", (user_id,))
+        cur.execute("DELETE FROM products WHERE productid = %s", (product_id,))
+        cur.execute("DELETE FROM users WHERE userid = %s", (user_id,))
+        conn.close()
+
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+# Проверка планов горячих запросов приложения (dal.py). Запросы строятся теми же функциями,
+# что и в приложении, и разбираются EXPLAIN (FORMAT JSON) без выполнения.
+# Проверка не проходит (код выхода 1), если:
+# - в плане есть Seq Scan по таблице, в которой не меньше --min-rows строк;
+# - оценка стоимости выросла больше чем на --threshold относительно базовой
+#   (bench/plan_baseline.json). Секции, которые отбрасываются только при выполнении,
+#   планировщик оценивает все, и каждый новый месяц добавляет слагаемое в оценку:
+#   базовая стоимость запроса по секциям умножается на рост их числа в плане;
+# - запрос за период читает больше секций Orders, чем указано в PARTITION_LIMITS.
+#
+# Запуск из корня проекта на базе после python manage.py migrate и generate-data
+# (базовые оценки сняты на generate-data с параметрами по умолчанию, см. "dataset" в JSON):
+#     python bench/plan_check.py [--only orders_admin,login] [--skip catalog_search]
+#     python bench/plan_check.py --update-baseline    # записать текущие оценки как базовые
+import argparse
+import json
+import os
+import sys
+from datetime import timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("STREAMLIT_LOGGER_LEVEL", "error")
+
+BASELINE_PATH = os.path.join(ROOT, "bench", "plan_baseline.json")
+# Полный проход, который здесь ожидаем: сводке нужны имена тысяч пользователей периода,
+# и хэш-соединение с users дешевле, чем искать каждого по индексу
+ALLOWED_SEQ_SCANS = {"order_summary": {"users"}}
+# Сколько месячных секций таблицы может прочитать запрос за период
+# (migrations/012_partition_orders.sql): неделя задевает не больше двух месяцев
+PARTITION_LIMITS = {
+    "orders_by_period": {"orders": 2},
+    "order_lines_export": {"orders": 2, "orderdetails": 2},
+}
+
+
+# Значения параметров запросов, взятые из самой базы
+def sample_values(cur):
+    cur.execute("SELECT categoryid FROM products GROUP BY categoryid ORDER BY count(*) DESC LIMIT 1")
+    category_id = cur.fetchone()[0]
+    cur.execute("SELECT (MIN(productid) + MAX(productid)) / 2 FROM products")
+    middle_product_id = cur.fetchone()[0]
+    cur.execute("""
+        SELECT o.userid, u.username, o.orderdate, o.orderid
+        FROM orders o JOIN users u ON u.userid = o.userid
+        ORDER BY o.orderid DESC LIMIT 1
+    """)
+    user_id, username, order_date, order_id = cur.fetchone()
+    return {
+        "category_id": category_id,
+        "middle_product_id": middle_product_id,
+        "user_id": user_id,
+        "username": username,
+        "order_date": order_date,
+        "order_id": order_id,
+    }
+
+
+def hot_queries(values):
+    import dal
+    import export
+
+    day = values["order_date"].date()
+    return {
+        "login": (dal.LOGIN_QUERY, (values["username"], "password")),
+        "catalog_first_page": dal.products_page_query(None, None, 25),
+        "catalog_category_page": dal.products_page_query(values["category_id"], None, 25),
+        "catalog_deep_page": dal.products_page_query(values["category_id"], values["middle_product_id"], 25),
+        "catalog_by_rating": dal.products_page_query(None, None, 25, "rating"),
+        "catalog_category_by_rating": dal.products_page_query(values["category_id"], None, 25, "rating", 4),
+        "catalog_search": dal.product_search_query("гантели", None, 0, 25),
+        "catalog_category_search": dal.product_search_query("гантели", values["category_id"], 0, 25),
+        "orders_admin": dal.orders_page_query({}, None, 20),
+        "orders_admin_next": dal.orders_page_query({}, (values["order_date"], values["order_id"]), 20),
+        "orders_admin_count": dal.orders_count_query({}),
+        "orders_by_status": dal.orders_page_query({"status": "обрабатывается"}, None, 20),
+        "orders_by_period": dal.orders_page_query({"date_from": day - timedelta(days=7), "date_to": day}, None, 20),
+        "orders_by_username": dal.orders_page_query({"username": values["username"]}, None, 20),
+        "orders_customer": dal.orders_page_query({"user_id": values["user_id"]}, None, 20),
+        "orders_customer_count": dal.orders_count_query({"user_id": values["user_id"]}),
+        "order_summary": (dal.ORDER_SUMMARY_QUERY, (day - timedelta(days=7), day)),
+        "order_lines_export": export.dataset_query("order_lines", day - timedelta(days=7), day),
+    }
+
+
+def plan_nodes(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+def check_query(cur, query, params, table_rows, partitions, min_rows):
+    cur.execute("EXPLAIN (FORMAT JSON) " + query, params)
+    plan = cur.fetchone()[0][0]["Plan"]
+    nodes = list(plan_nodes(plan))
+    seq_scans = sorted({node["Relation Name"] for node in nodes
+                        if node["Node Type"] == "Seq Scan"
+                        and table_rows.get(node["Relation Name"], 0) >= min_rows})
+    # Секции, оставшиеся в плане после отсечения, по родительским таблицам
+    scanned = {}
+    for node in nodes:
+        parent = partitions.get(node.get("Relation Name"))
+        if parent:
+            scanned.setdefault(parent, set()).add(node["Relation Name"])
+    return plan["Total Cost"], seq_scans, {parent: len(names) for parent, names in scanned.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка планов горячих запросов")
+    parser.add_argument("--only", help="Проверить только эти запросы (через запятую)")
+    parser.add_argument("--skip", help="Пропустить эти запросы (через запятую)")
+    parser.add_argument("--min-rows", type=int, default=10_000, help="С какого размера таблица считается большой")
+    parser.add_argument("--threshold", type=float, default=0.5, help="Допустимый рост оценки стоимости, доля")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    from db import get_connection
+
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT relname, reltuples::bigint FROM pg_class
+            WHERE relkind IN ('r', 'p') AND relnamespace = 'public'::regnamespace
+        """)
+        table_rows = dict(cur.fetchall())
+        cur.execute("""
+            SELECT c.relname, p.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            JOIN pg_class p ON p.oid = i.inhparent
+        """)
+        partitions = dict(cur.fetchall())
+        # Оценка числа строк секционированной таблицы есть только после ANALYZE
+        # по ней самой — складываем по секциям
+        for parent in set(partitions.values()):
+            table_rows[parent] = sum(max(table_rows.get(partition, 0), 0)
+                                     for partition, owner in partitions.items() if owner == parent)
+        queries = hot_queries(sample_values(cur))
+        if args.only:
+            queries = {name: queries[name] for name in args.only.split(",")}
+        for name in (args.skip or "").split(","):
+            queries.pop(name, None)
+
+        costs = {}
+        planned_partitions = {}
+        failures = []
+        baseline = {}
+        baseline_partitions = {}
+        if os.path.exists(args.baseline) and not args.update_baseline:
+            with open(args.baseline, encoding="utf-8") as source:
+                saved = json.load(source)
+            baseline = saved["queries"]
+            baseline_partitions = saved.get("partitions", {})
+
+        print(f"{'запрос':<26} {'стоимость':>12} {'базовая':>12}  замечания")
+        for name, (query, params) in queries.items():
+            cost, seq_scans, scanned = check_query(cur, query, params, table_rows, partitions, args.min_rows)
+            seq_scans = [table for table in seq_scans if table not in ALLOWED_SEQ_SCANS.get(name, ())]
+            costs[name] = cost
+            if scanned:
+                planned_partitions[name] = sum(scanned.values())
+            notes = []
+            if seq_scans:
+                notes.append("Seq Scan: " + ", ".join(seq_scans))
+            for table, limit in PARTITION_LIMITS.get(name, {}).items():
+                if scanned.get(table, 0) > limit:
+                    notes.append(f"секций {table}: {scanned[table]} (не больше {limit})")
+            previous = baseline.get(name)
+            allowed = previous
+            if previous is not None and baseline_partitions.get(name):
+                allowed = previous * max(planned_partitions.get(name, 0) / baseline_partitions[name], 1)
+            if previous is not None and cost > allowed * (1 + args.threshold):
+                notes.append(f"стоимость выросла в {cost / allowed:.1f} раза")
+            if notes:
+                failures.append(name)
+            base = f"{previous:>12.1f}" if previous is not None else f"{'—':>12}"
+            print(f"{name:<26} {cost:>12.1f} {base}  {'; '.join(notes) or 'ок'}")
+
+    if args.update_baseline:
+        dataset = {table: table_rows.get(table) for table in ("users", "products", "orders", "orderdetails")}
+        with open(args.baseline, "w", encoding="utf-8") as output:
+            json.dump({"dataset": dataset, "queries": costs, "partitions": planned_partitions}, output,
+                      ensure_ascii=False, indent=2)
+            output.write("\n")
+        print(f"\nБазовые оценки записаны в {args.baseline}")
+    if failures:
+        print(f"\nНе прошли проверку: {', '.join(failures)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
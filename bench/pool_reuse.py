@@ -0,0 +1,82 @@
+# Проверка повторного использования соединений пулом (db.ConnectionPool) при
+# настройках по умолчанию (minconn=1): одновременно берутся --connections соединений,
+# возвращаются и берутся снова — серверные процессы (pg_backend_pid) должны быть те же.
+# Затем --rounds раз по --connections потоков одновременно выполняют запрос; всего за
+# все раунды должно быть открыто не больше --connections соединений.
+#
+# Запуск из корня проекта:
+#     python bench/pool_reuse.py [--connections 4] [--rounds 10]
+import argparse
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import DB_CONFIG, POOL_CONFIG, ConnectionPool  # noqa: E402
+
+
+def backend_pid(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_backend_pid()")
+        return cur.fetchone()[0]
+
+
+def checkout_all(db_pool, count):
+    conns = [db_pool.getconn() for _ in range(count)]
+    pids = {backend_pid(conn) for conn in conns}
+    for conn in conns:
+        db_pool.putconn(conn)
+    return pids
+
+
+def concurrent_round(db_pool, count, pids):
+    barrier = threading.Barrier(count)
+
+    def worker():
+        conn = db_pool.getconn()
+        try:
+            # Все потоки держат соединения одновременно
+            barrier.wait()
+            pids.add(backend_pid(conn))
+        finally:
+            db_pool.putconn(conn)
+
+    threads = [threading.Thread(target=worker) for _ in range(count)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Повторное использование соединений пулом")
+    parser.add_argument("--connections", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=10)
+    args = parser.parse_args()
+
+    config = dict(POOL_CONFIG, maxconn=max(POOL_CONFIG["maxconn"], args.connections))
+    db_pool = ConnectionPool(DB_CONFIG, **config)
+    try:
+        first = checkout_all(db_pool, args.connections)
+        second = checkout_all(db_pool, args.connections)
+        reused = first == second
+        print(f"{args.connections} соединений дважды подряд: {'те же' if reused else 'другие'} процессы "
+              f"({len(first | second)} разных)")
+
+        pids = set(second)
+        for _ in range(args.rounds):
+            concurrent_round(db_pool, args.connections, pids)
+        bounded = len(pids) <= args.connections
+        print(f"{args.rounds} раундов по {args.connections} одновременных запросов: "
+              f"{len(pids)} разных процессов (не больше {args.connections})")
+    finally:
+        db_pool.closeall()
+
+    passed = reused and bounded
+    print("OK" if passed else "ПРОВАЛ")
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
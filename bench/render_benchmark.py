@@ -0,0 +1,78 @@
+# Замер стоимости отрисовки каталога: время выполнения скрипта на сервере и
+# размер сообщений, которые уходят в браузер, на одно взаимодействие.
+#
+# Запуск из корня проекта на базе с каталогом нужного размера
+# (например, после python manage.py generate-data или импорта 5000 товаров):
+#     python bench/render_benchmark.py [--app main.py] [--role 3] [--repeat 10]
+#
+# Чтобы сравнить с прежней версией, укажите её main.py из отдельного рабочего
+# дерева: git worktree add /tmp/old <commit> && python bench/render_benchmark.py --app /tmp/old/main.py
+#
+# Скрипт выполняется через streamlit.testing (AppTest), который перезапускает
+# приложение целиком, поэтому «время скрипта» здесь — верхняя граница: в браузере
+# взаимодействие внутри фрагмента перезапускает только фрагмент.
+# Размер — суммарный размер protobuf-сообщений элементов страницы.
+import argparse
+import os
+import statistics
+import sys
+import time
+
+from streamlit.testing.v1 import AppTest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def payload_bytes(at):
+    total = 0
+    for block in (at.main, at.sidebar):
+        for node in block:
+            proto = getattr(node, "proto", None)
+            if proto is not None:
+                total += proto.ByteSize()
+    return total
+
+
+def measure(at, interaction, repeat):
+    timings = []
+    sizes = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        interaction(at)
+        timings.append((time.perf_counter() - started) * 1000)
+        sizes.append(payload_bytes(at))
+        if at.exception:
+            raise RuntimeError(at.exception[0].value)
+    return statistics.median(timings), statistics.median(sizes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер стоимости отрисовки каталога")
+    parser.add_argument("--app", default=os.path.join(ROOT, "main.py"))
+    parser.add_argument("--role", type=int, default=3, help="1 — администратор, иначе покупатель")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(args.app)))
+    at = AppTest.from_file(args.app, default_timeout=120)
+    at.session_state.logged_in = True
+    at.session_state.user = {"userid": 1, "username": "bench", "email": "bench@example.com", "roleid": args.role}
+    at.session_state.role = args.role
+    at.session_state.cart = {}
+    at.run()
+
+    def rerun(app):
+        app.run()
+
+    def click_first_button(app):
+        # «Добавить в корзину» в старой версии, «Вперёд →» / «Сохранить» — в новой
+        app.button[0].click().run()
+
+    print(f"{'взаимодействие':<28} {'скрипт, мс':>11} {'элементы, КБ':>13}")
+    for title, interaction in (("перезапуск страницы", rerun), ("нажатие первой кнопки", click_first_button)):
+        elapsed, size = measure(at, interaction, args.repeat)
+        print(f"{title:<28} {elapsed:>11.1f} {size / 1024:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+# Нагрузочный замер функций доступа к данным (main.py, dal.py) на локальной БД.
+# Каждая операция выполняется заданным числом параллельных исполнителей — потоков
+# (общий пул соединений, как в одном процессе Streamlit) или процессов (как несколько
+# контейнеров). Для операции выводятся p50/p95/p99 задержки, пропускная способность
+# и число обращений к БД (db.round_trips) на одну операцию.
+#
+# Запуск из корня проекта на отдельной базе (операции пишут в неё: заказы, пользователи, товары),
+# заполненной python manage.py generate-data:
+#     python bench/run.py [--ops login,catalog_page] [--mode thread,process] [--concurrency 8]
+#                         [--iterations 200] [--output results.json]
+#                         [--baseline previous.json --threshold 0.2]
+#
+# С --baseline прогон завершается с кодом 1, если p95 какой-либо операции выросла
+# больше чем на threshold (доля) и больше чем на --min-delta-ms, выросло число
+# обращений к БД на операцию или появились ошибки.
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Без кэша каталога в памяти процесса: замеряется путь до БД, а не попадание в кэш
+os.environ.setdefault("CATALOG_CACHE_SIZE", "0")
+os.environ.setdefault("STREAMLIT_LOGGER_LEVEL", "error")
+
+SAMPLE_SIZE = 1000
+
+
+# Идентификаторы, на которых выполняются операции; выбираются один раз до замера
+def load_context(password):
+    from db import get_connection
+
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT username FROM users ORDER BY userid DESC LIMIT %s", (SAMPLE_SIZE,))
+        usernames = [row[0] for row in cur.fetchall()]
+        cur.execute("SELECT userid FROM orders GROUP BY userid ORDER BY count(*) DESC LIMIT %s", (SAMPLE_SIZE,))
+        customers = [row[0] for row in cur.fetchall()]
+        cur.execute("SELECT productid FROM products WHERE stockquantity > 0 ORDER BY productid LIMIT %s",
+                    (SAMPLE_SIZE,))
+        products = [row[0] for row in cur.fetchall()]
+        cur.execute("SELECT categoryid FROM categories")
+        categories = [row[0] for row in cur.fetchall()]
+        cur.execute("SELECT MIN(productid), MAX(productid) FROM products")
+        product_range = cur.fetchone()
+        cur.execute("SELECT MAX(orderdate)::date FROM orders")
+        last_order_day = cur.fetchone()[0] or date.today()
+    if not (usernames and customers and products and categories):
+        raise SystemExit("В базе нет данных для замера: заполните её командой python manage.py generate-data")
+    return {
+        "password": password,
+        "usernames": usernames,
+        "customers": customers,
+        "products": products,
+        "categories": categories,
+        "product_range": product_range,
+        "last_order_day": last_order_day,
+    }
+
+
+def op_login(ctx, rng):
+    import main
+
+    username = rng.choice(ctx["usernames"])
+    if not main.login(username, ctx["password"]):
+        raise RuntimeError(f"вход {username} не удался")
+
+
+def op_register(ctx, rng):
+    import main
+
+    name = f"bench_{uuid.uuid4().hex[:16]}"
+    if not main.register(name, f"{name}@example.com", ctx["password"]):
+        raise RuntimeError("регистрация не удалась")
+
+
+# Оформление заказа; нехватка товара — штатный исход, а не ошибка
+def op_place_order(ctx, rng):
+    import dal
+
+    cart = {product_id: {"quantity": rng.randint(1, 2)}
+            for product_id in rng.sample(ctx["products"], rng.randint(1, 4))}
+    try:
+        dal.checkout(rng.choice(ctx["customers"]), cart)
+    except dal.InsufficientStock:
+        pass
+
+
+# Корзина в БД: добавление от 1 до 20 позиций, просмотр со сверкой и оформление.
+# Число обращений к БД не должно зависеть от размера корзины.
+def op_cart_checkout(ctx, rng):
+    import main
+
+    user_id = rng.choice(ctx["customers"])
+    main.add_to_cart(user_id, {product_id: 1 for product_id in rng.sample(ctx["products"], rng.randint(1, 20))})
+    main.fetch_cart(user_id)
+    try:
+        main.checkout_cart(user_id)
+    except main.InsufficientStock:
+        main.update_cart(user_id, {item["productid"]: 0 for item in main.fetch_cart(user_id)})
+
+
+def op_catalog_page(ctx, rng):
+    import main
+
+    low, high = ctx["product_range"]
+    category_id = rng.choice(ctx["categories"]) if rng.random() < 0.5 else None
+    main.fetch_products_page(None, category_id, rng.randint(low, high), 25)
+
+
+def op_catalog_by_rating(ctx, rng):
+    import main
+
+    category_id = rng.choice(ctx["categories"]) if rng.random() < 0.5 else None
+    main.fetch_products_page(None, category_id, None, 25, "rating", rng.choice([None, 4]))
+
+
+def op_catalog_search(ctx, rng):
+    import main
+
+    main.fetch_products_page(rng.choice(["гантели", "коврик", "мяч", "ufyntkb", "штанга разборная"]),
+                             None, None, 25)
+
+
+# Как на странице администратора: страница и число заказов одновременно
+def op_orders_admin(ctx, rng):
+    import main
+
+    results = main.prefetch(orders=lambda: main.fetch_orders_page({}, None, 20),
+                            count=lambda: main.fetch_orders_count({}))
+    for result in results.values():
+        result.get()
+
+
+def op_orders_customer(ctx, rng):
+    import main
+
+    main.fetch_orders_page({"user_id": rng.choice(ctx["customers"])}, None, 20)
+
+
+def op_order_summary(ctx, rng):
+    import main
+
+    end = ctx["last_order_day"]
+    main.fetch_order_summary(end - timedelta(days=rng.choice([7, 30, 365])), end)
+
+
+def op_bulk_add_products(ctx, rng):
+    from importer import import_products
+
+    lines = [json.dumps({"name": f"Товар {uuid.uuid4().hex[:12]}", "price": rng.randint(100, 10000),
+                         "stockquantity": rng.randint(0, 100), "categoryid": rng.choice(ctx["categories"])})
+             for _ in range(100)]
+    stream = io.BytesIO("\n".join(lines).encode("utf-8"))
+    imported, _ = import_products(stream, "jsonl", io.StringIO())
+    if imported != len(lines):
+        raise RuntimeError(f"добавлено {imported} из {len(lines)}")
+
+
+OPERATIONS = {
+    "login": op_login,
+    "register": op_register,
+    "place_order": op_place_order,
+    "cart_checkout": op_cart_checkout,
+    "catalog_page": op_catalog_page,
+    "catalog_by_rating": op_catalog_by_rating,
+    "catalog_search": op_catalog_search,
+    "orders_admin": op_orders_admin,
+    "orders_customer": op_orders_customer,
+    "order_summary": op_order_summary,
+    "bulk_add_products": op_bulk_add_products,
+}
+
+
+# Выполнение операции iterations раз в одном исполнителе (потоке или процессе)
+def run_worker(name, iterations, seed, ctx):
+    from db import round_trips
+
+    operation = OPERATIONS[name]
+    rng = random.Random(seed)
+    latencies = []
+    trips = []
+    errors = []
+    for _ in range(iterations):
+        before = round_trips()
+        started = time.perf_counter()
+        try:
+            operation(ctx, rng)
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+            continue
+        latencies.append((time.perf_counter() - started) * 1000)
+        trips.append(round_trips() - before)
+    return latencies, trips, errors
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def run_operation(executor, name, args, ctx):
+    per_worker = max(args.iterations // args.concurrency, 1)
+    # Прогрев: соединения пула и импорт модулей в каждом исполнителе
+    list(executor.map(run_worker, [name] * args.concurrency, [1] * args.concurrency,
+                      range(args.concurrency), [ctx] * args.concurrency))
+
+    started = time.perf_counter()
+    seeds = [args.seed * 1000 + worker for worker in range(args.concurrency)]
+    results = list(executor.map(run_worker, [name] * args.concurrency, [per_worker] * args.concurrency,
+                                seeds, [ctx] * args.concurrency))
+    elapsed = time.perf_counter() - started
+
+    latencies = [value for result in results for value in result[0]]
+    trips = [value for result in results for value in result[1]]
+    errors = [value for result in results for value in result[2]]
+    summary = {"operations": len(latencies), "errors": len(errors), "seconds": round(elapsed, 3),
+               "throughput": round(len(latencies) / elapsed, 2)}
+    if latencies:
+        summary.update({
+            "p50_ms": round(percentile(latencies, 0.50), 3),
+            "p95_ms": round(percentile(latencies, 0.95), 3),
+            "p99_ms": round(percentile(latencies, 0.99), 3),
+            "mean_ms": round(statistics.fmean(latencies), 3),
+            "round_trips": round(statistics.fmean(trips), 2),
+        })
+    if errors:
+        summary["first_error"] = errors[0]
+    return summary
+
+
+def make_executor(mode, concurrency):
+    if mode == "thread":
+        return ThreadPoolExecutor(concurrency)
+    # spawn, а не fork: у дочернего процесса должен быть свой пул соединений
+    return ProcessPoolExecutor(concurrency, mp_context=multiprocessing.get_context("spawn"))
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Сравнение с прошлым прогоном; возвращает список найденных ухудшений
+def compare(results, baseline, threshold, min_delta_ms):
+    regressions = []
+    for key, current in results.items():
+        previous = baseline.get("results", {}).get(key)
+        if not previous or "p95_ms" not in previous or "p95_ms" not in current:
+            continue
+        delta = current["p95_ms"] - previous["p95_ms"]
+        if delta > min_delta_ms and delta > previous["p95_ms"] * threshold:
+            regressions.append(f"{key}: p95 {previous['p95_ms']} → {current['p95_ms']} мс")
+        # Небольшой допуск: проверка живости соединений пула (SELECT 1) тоже считается обращением
+        if current["round_trips"] > previous["round_trips"] + 0.25:
+            regressions.append(f"{key}: обращений к БД {previous['round_trips']} → {current['round_trips']}")
+        if current["errors"] > previous.get("errors", 0):
+            regressions.append(f"{key}: ошибок {previous.get('errors', 0)} → {current['errors']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный замер функций доступа к данным")
+    parser.add_argument("--ops", default=",".join(OPERATIONS), help="Операции через запятую")
+    parser.add_argument("--mode", default="thread,process", help="thread, process или оба через запятую")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--iterations", type=int, default=200, help="Операций на замер (делятся между исполнителями)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--password", default="password", help="Пароль пользователей из generate-data")
+    parser.add_argument("--output", help="Куда записать результаты в JSON")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Допустимый рост p95, доля")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="Меньший рост p95 не считается ухудшением")
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.ops.split(",") if name.strip()]
+    unknown = [name for name in names if name not in OPERATIONS]
+    if unknown:
+        parser.error(f"Неизвестные операции: {', '.join(unknown)}")
+    modes = [mode.strip() for mode in args.mode.split(",")]
+    if any(mode not in ("thread", "process") for mode in modes):
+        parser.error("--mode: thread и/или process")
+
+    # Пул каждого процесса должен вмещать всех исполнителей-потоков
+    os.environ.setdefault("DB_POOL_MAX", str(max(args.concurrency, 10)))
+    ctx = load_context(args.password)
+
+    results = {}
+    print(f"{'операция':<28} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9} {'оп/с':>8} {'обращ.':>7} {'ошибки':>7}")
+    for mode in modes:
+        with make_executor(mode, args.concurrency) as executor:
+            for name in names:
+                key = f"{mode}:{name}"
+                summary = results[key] = run_operation(executor, name, args, ctx)
+                if "p50_ms" in summary:
+                    print(f"{key:<28} {summary['p50_ms']:>9.1f} {summary['p95_ms']:>9.1f} {summary['p99_ms']:>9.1f} "
+                          f"{summary['throughput']:>8.1f} {summary['round_trips']:>7.1f} {summary['errors']:>7}")
+                else:
+                    print(f"{key:<28} все операции завершились ошибкой: {summary.get('first_error')}")
+
+    report = {
+        "commit": git_commit(),
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "concurrency": args.concurrency,
+        "iterations": args.iterations,
+        "seed": args.seed,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(report, output, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as source:
+            baseline = json.load(source)
+        regressions = compare(results, baseline, args.threshold, args.min_delta_ms)
+        if regressions:
+            print(f"\nУхудшения относительно {baseline.get('commit') or args.baseline}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\nУхудшений относительно {baseline.get('commit') or args.baseline} нет.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# Замер задержки поиска товаров на 10k, 100k и 1M товаров.
+#
+# Запуск из корня проекта (нужны миграции до 002_product_search.sql):
+#     python bench/search_benchmark.py [--sizes 10000 100000 1000000] [--repeat 20]
+#
+# Данные создаются в отдельной схеме bench_search и удаляются после замера.
+# Для каждого размера сравниваются прежний запрос (LIKE '%q%' без индексов)
+# и индексированный поиск из dal.product_search_query.
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import get_connection  # noqa: E402
+from dal import product_search_query  # noqa: E402
+
+SCHEMA = "bench_search"
+QUERIES = ["гантели", "ufyntkb", "коврик для йоги", "штанга олимпийская", "эспандр", "беговая"]
+
+OLD_QUERY = """
+    SELECT * FROM products
+    WHERE (LOWER(name) LIKE %s or LOWER(name) LIKE fix_mistake_search(%s))
+"""
+
+FILL_PRODUCTS = """
+    INSERT INTO products (name, categoryid, price, stockquantity, description)
+    SELECT
+        (ARRAY['Гантели', 'Штанга', 'Коврик', 'Эспандер', 'Беговая дорожка', 'Гиря', 'Скакалка', 'Турник'])[1 + g %% 8]
+            || ' ' || (ARRAY['разборная', 'олимпийская', 'для йоги', 'профессиональная', 'домашняя', 'резиновая'])[1 + (g / 8) %% 6]
+            || ' ' || (g %% 997),
+        1 + g %% 5,
+        100 + g %% 50000,
+        g %% 100,
+        (ARRAY['Удобно для домашних тренировок', 'Подходит для зала', 'Нескользящее покрытие', 'Прочная сталь'])[1 + g %% 4]
+    FROM generate_series(%s, %s) AS g
+"""
+
+
+def timed(cur, query, params, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        cur.execute(query, params)
+        cur.fetchall()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер задержки поиска товаров")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--page-size", type=int, default=25)
+    args = parser.parse_args()
+
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        cur.execute(f"CREATE SCHEMA {SCHEMA}")
+        # Копия структуры products без индексов: сначала меряем прежний запрос
+        cur.execute(f"CREATE TABLE {SCHEMA}.products (LIKE public.products INCLUDING DEFAULTS INCLUDING GENERATED)")
+        cur.execute(f"SET search_path = {SCHEMA}, public")
+        conn.commit()
+
+        print(f"{'товаров':>10} {'запрос':<22} {'LIKE, мс':>10} {'индекс, мс':>11}")
+        loaded = 0
+        try:
+            for size in sorted(args.sizes):
+                cur.execute(FILL_PRODUCTS, (loaded + 1, size))
+                loaded = size
+                cur.execute("DROP INDEX IF EXISTS bench_name_trgm_idx, bench_search_vector_idx")
+                cur.execute("ANALYZE products")
+                conn.commit()
+
+                old = {q: timed(cur, OLD_QUERY, (f"%{q}%", f"%{q}%"), args.repeat) for q in QUERIES}
+
+                cur.execute("CREATE INDEX bench_name_trgm_idx ON products USING gin (categoryid, lower(name) gin_trgm_ops)")
+                cur.execute("CREATE INDEX bench_search_vector_idx ON products USING gin (categoryid, searchvector)")
+                cur.execute("ANALYZE products")
+                conn.commit()
+
+                for q in QUERIES:
+                    query, params = product_search_query(q, None, 0, args.page_size)
+                    new = timed(cur, query, params, args.repeat)
+                    print(f"{size:>10} {q:<22} {old[q]:>10.2f} {new:>11.2f}")
+        finally:
+            conn.rollback()
+            cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+            cur.execute("RESET search_path")
+            conn.commit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+import json
+import os
+import select
+import threading
+import time
+from collections import OrderedDict
+
+import psycopg2
+from psycopg2 import extensions
+
+from db import DB_CONFIG, REPLICA_HOSTS, advance_read_lsn
+
+# Кэш каталога в памяти процесса: категории, страницы товаров, результаты поиска.
+# Каждая запись помечена таблицами, из которых она собрана. Триггеры на этих
+# таблицах (migrations/006_catalog_notify.sql) шлют NOTIFY catalog_changed с именем
+# таблицы, и фоновый поток сбрасывает только записи, зависящие от неё, —
+# так все контейнеры приложения видят add_category, update_product и импорт сразу.
+CACHE_MAX_ENTRIES = int(os.environ.get("CATALOG_CACHE_SIZE", "1000"))
+NOTIFY_CHANNEL = "catalog_changed"
+LISTEN_RETRY_SECONDS = 5
+
+
+class LRUCache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry
+
+    # Поколение набора таблиц: меняется при любом сбросе, затрагивающем их
+    def generation(self, tables):
+        with self._lock:
+            return self._generation, tuple(self._generations.get(table, 0) for table in tables)
+
+    # Значение, загруженное до сброса, не кладётся: оно могло прочитать старые данные
+    def put(self, key, value, tables, generation=None):
+        with self._lock:
+            if generation is not None and generation != (
+                    self._generation, tuple(self._generations.get(table, 0) for table in tables)):
+                return
+            self._entries[key] = (value, frozenset(tables))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    # Сброс записей, зависящих от таблицы; None — сброс всего кэша
+    def invalidate(self, table=None):
+        with self._lock:
+            if table is None:
+                self._generation += 1
+                removed = len(self._entries)
+                self._entries.clear()
+            else:
+                self._generations[table] = self._generations.get(table, 0) + 1
+                stale = [key for key, (_, tables) in self._entries.items() if table in tables]
+                for key in stale:
+                    del self._entries[key]
+                removed = len(stale)
+            self._stats["invalidations"] += removed
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["max_entries"] = self.max_entries
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+catalog_cache = LRUCache(CACHE_MAX_ENTRIES)
+
+
+# Версии таблиц для условных запросов API (api.py): номер транзакции последнего
+# изменения таблицы из уведомления и время, когда процесс о нём узнал. После
+# подключения слушателя версия всех таблиц — граница снимка на момент LISTEN:
+# всё, что зафиксировано раньше, уже видно запросам. Граница — первый ещё не выданный
+# номер транзакции, его получит следующая транзакция, поэтому версия-граница пишется
+# с префиксом и не совпадает с версией после изменения. Пока слушателя нет, версий нет.
+class TableVersions:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._base = None
+        self._tables = {}
+        self._local = 0
+
+    def reset(self, xid):
+        with self._lock:
+            self._base = (f"s{xid}", time.time())
+            self._tables = {}
+
+    def stop(self):
+        with self._lock:
+            self._base = None
+
+    # Изменение таблицы (None — неизвестно какой: меняются версии всех таблиц).
+    # Уведомление без номера транзакции получает местный номер, отрицательный,
+    # чтобы не совпасть с номерами транзакций.
+    def changed(self, table, xid):
+        with self._lock:
+            if self._base is None:
+                return
+            if xid is None:
+                self._local -= 1
+                xid = self._local
+            if table is None:
+                self._base = (xid, time.time())
+                self._tables = {}
+            else:
+                self._tables[table] = (xid, time.time())
+
+    # (версия набора таблиц строкой, время последнего изменения) или None
+    def get(self, tables):
+        with self._lock:
+            if self._base is None:
+                return None
+            versions = [self._tables.get(table, self._base) for table in tables]
+        return "-".join(str(xid) for xid, _ in versions), max(changed for _, changed in versions)
+
+
+table_versions = TableVersions()
+
+
+# Фоновый слушатель NOTIFY на отдельном соединении (не из пула: оно занято навсегда).
+# Пока соединения нет, кэш не используется: без уведомлений он мог бы устареть.
+class InvalidationListener(threading.Thread):
+    def __init__(self, cache, versions):
+        super().__init__(name="catalog-cache-listener", daemon=True)
+        self.cache = cache
+        self.versions = versions
+        self.connected = threading.Event()
+
+    def run(self):
+        while True:
+            try:
+                self._listen()
+            except Exception:
+                pass
+            self.connected.clear()
+            self.versions.stop()
+            self.cache.invalidate()
+            time.sleep(LISTEN_RETRY_SECONDS)
+
+    def _listen(self):
+        conn = psycopg2.connect(**DB_CONFIG)
+        try:
+            conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                cur.execute("SELECT txid_snapshot_xmax(txid_current_snapshot())")
+                self.versions.reset(cur.fetchone()[0])
+            # Изменения, случившиеся до LISTEN, не пришли бы уведомлением
+            self.cache.invalidate()
+            self.connected.set()
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    # Проверка, что соединение живо, раз уведомлений давно не было
+                    with conn.cursor() as cur:
+                        cur.execute("SELECT 1")
+                    continue
+                conn.poll()
+                if conn.notifies and REPLICA_HOSTS:
+                    # Изменение уже зафиксировано: загрузки после сброса не должны читать
+                    # с реплики, которая его ещё не воспроизвела
+                    with conn.cursor() as cur:
+                        cur.execute("SELECT pg_current_wal_insert_lsn()::text")
+                        advance_read_lsn(cur.fetchone()[0])
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    table, xid = _parse_notify(notify.payload)
+                    self.cache.invalidate(table)
+                    self.versions.changed(table, xid)
+        finally:
+            conn.close()
+
+
+# (таблица, номер транзакции) из уведомления; таблица None — сбросить всё
+def _parse_notify(payload):
+    try:
+        message = json.loads(payload)
+        return message["table"], message.get("xid")
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return None, None
+
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def _ensure_listener():
+    global _listener
+    if _listener is None:
+        with _listener_lock:
+            if _listener is None:
+                _listener = InvalidationListener(catalog_cache, table_versions)
+                _listener.start()
+    return _listener.connected.is_set()
+
+
+# Значение из кэша или результат loader(); tables — таблицы, от которых оно зависит
+def cached(key, tables, loader):
+    if not _ensure_listener():
+        return loader()
+    entry = catalog_cache.get(key)
+    if entry is not None:
+        return entry[0]
+    generation = catalog_cache.generation(tables)
+    value = loader()
+    catalog_cache.put(key, value, tables, generation)
+    return value
+
+
+# Версия набора таблиц для ETag: (строка версий, время изменения) или None,
+# если уведомления сейчас не принимаются и версиям нельзя доверять
+def table_version(tables):
+    if not _ensure_listener():
+        return None
+    return table_versions.get(tables)
+
+
+# Немедленный сброс после собственной записи, не дожидаясь NOTIFY
+def invalidate(*tables):
+    for table in tables:
+        catalog_cache.invalidate(table)
+
+
+def cache_stats():
+    stats = catalog_cache.stats()
+    stats["listening"] = _listener is not None and _listener.connected.is_set()
+    return stats
@@ -0,0 +1,726 @@
+import hashlib
+import json
+import os
+import re
+import weakref
+from functools import lru_cache
+
+from psycopg2 import errors, extensions
+from psycopg2.extras import execute_values
+
+from cache import cached, invalidate
+from db import get_connection
+
+# Доступ к данным приложения: все запросы страниц собраны здесь, main.py только
+# показывает результаты. Строки возвращаются компактными кортежами (Row) вместо
+# словарей RealDictCursor, аналитические выборки — колонками (fetch_columns).
+# Частые запросы выполняются как подготовленные операторы сервера: разбор
+# и планирование запроса происходят один раз на соединение, а не на каждый вызов.
+# Замер памяти и задержки — bench/dal_benchmark.py.
+
+# Подготовленные операторы можно выключить, например за PgBouncer в режиме
+# пула транзакций, где соседние запросы попадают на разные соединения сервера
+PREPARED_STATEMENTS = os.environ.get("DB_PREPARED_STATEMENTS", "1") != "0"
+# Сколько подготовленных операторов держать на соединении: запросы с фильтрами
+# дают разные тексты, и при превышении все операторы соединения сбрасываются
+PREPARED_MAX = int(os.environ.get("DB_PREPARED_MAX", "200"))
+
+
+# Строка результата: кортеж значений без словаря на каждую строку. Имена колонок
+# хранятся в классе, общем для всех строк с тем же набором колонок. Доступ
+# по имени (row["name"], row.name) и по номеру, keys() и dict(row) работают
+# как у строк RealDictCursor, поэтому код страниц менять не нужно.
+class Row(tuple):
+    __slots__ = ()
+    _fields = ()
+    _index = {}
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return tuple.__getitem__(self, self._index[key])
+        return tuple.__getitem__(self, key)
+
+    def __getattr__(self, name):
+        try:
+            return tuple.__getitem__(self, self._index[name])
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def get(self, key, default=None):
+        index = self._index.get(key)
+        return default if index is None else tuple.__getitem__(self, index)
+
+    def keys(self):
+        return self._fields
+
+    def items(self):
+        return zip(self._fields, self)
+
+    def _asdict(self):
+        return dict(zip(self._fields, self))
+
+
+@lru_cache(maxsize=256)
+def row_class(fields):
+    return type("Row", (Row,), {"__slots__": (), "_fields": fields,
+                                "_index": {name: i for i, name in enumerate(fields)}})
+
+
+# Курсор, возвращающий строки Row. Подходит как cursor_factory для соединений
+# из пула: db.CountingConnection оборачивает его в считающий курсор.
+class CompactCursor(extensions.cursor):
+    def _row_class(self):
+        return row_class(tuple(column.name for column in self.description))
+
+    def fetchone(self):
+        row = super().fetchone()
+        return row if row is None else self._row_class()(row)
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        return list(map(self._row_class(), rows)) if rows else rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        return list(map(self._row_class(), rows)) if rows else rows
+
+    # Итерация курсора psycopg2 идёт мимо fetchone, поэтому строки оборачиваются здесь
+    def __iter__(self):
+        rows = super().__iter__()
+        try:
+            first = next(rows)
+        except StopIteration:
+            return
+        cls = self._row_class()
+        yield cls(first)
+        while True:
+            try:
+                yield cls(next(rows))
+            except StopIteration:
+                return
+
+
+# Курсор строк страниц; bench/dal_benchmark.py подменяет его на RealDictCursor для сравнения
+ROW_CURSOR = CompactCursor
+
+
+# Результат колонками {имя: [значения]} для аналитики и таблиц: вместо объекта
+# на строку — список на колонку. Строки читаются пачками, чтобы не держать
+# в памяти одновременно все кортежи и все колонки.
+def fetch_columns(cur, batch_size=10000):
+    names = [column.name for column in cur.description]
+    columns = [[] for _ in names]
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            break
+        for column, values in zip(columns, zip(*rows)):
+            column.extend(values)
+    return dict(zip(names, columns))
+
+
+_PLACEHOLDER = re.compile(r"%\((\w+)\)s|%s|%%")
+
+
+# Текст запроса с параметрами %s / %(name)s в форме для PREPARE ($1, $2, ...).
+# Имя оператора включает хэш текста: запросы, собранные с разными фильтрами,
+# готовятся отдельно. Возвращает (имя, PREPARE, EXECUTE, имена параметров).
+@lru_cache(maxsize=1024)
+def _prepared_form(name, query):
+    numbers = {}
+    keys = []
+
+    def replace(match):
+        if match.group(0) == "%%":
+            return "%"
+        key = match.group(1)
+        if key is None:
+            keys.append(None)
+            return f"${len(keys)}"
+        if key not in numbers:
+            keys.append(key)
+            numbers[key] = len(keys)
+        return f"${numbers[key]}"
+
+    text = _PLACEHOLDER.sub(replace, query)
+    statement = f"{name}_{hashlib.md5(query.encode('utf-8')).hexdigest()[:8]}"
+    arguments = f" ({', '.join(['%s'] * len(keys))})" if keys else ""
+    named = tuple(keys) if keys and keys[0] is not None else None
+    return statement, f"PREPARE {statement} AS {text}", f"EXECUTE {statement}{arguments}", named
+
+
+# Подготовленные операторы каждого соединения. Оператор живёт до закрытия
+# соединения и переживает откат транзакции, поэтому достаточно помнить имена.
+_prepared = weakref.WeakKeyDictionary()
+
+
+# Выполнение запроса как подготовленного оператора name. При первом вызове
+# на соединении запрос готовится (PREPARE), дальше выполняется только EXECUTE.
+def execute(cur, name, query, params=()):
+    if not PREPARED_STATEMENTS:
+        cur.execute(query, params)
+        return
+    statement, prepare, execute_sql, named = _prepared_form(name, query)
+    prepared = _prepared.setdefault(cur.connection, set())
+    if statement not in prepared:
+        if len(prepared) >= PREPARED_MAX:
+            cur.execute("DEALLOCATE ALL")
+            prepared.clear()
+        cur.execute(prepare)
+        prepared.add(statement)
+    cur.execute(execute_sql, [params[key] for key in named] if named else params or None)
+
+
+# Пользователи
+
+# Колонки перечислены явно: подготовленный оператор с SELECT * перестал бы
+# выполняться после добавления колонки в users, а хэш пароля в сессии не нужен
+LOGIN_QUERY = """
+    SELECT userid, username, email, roleid, registrationdate, isactive FROM users
+    WHERE username = %s AND passwordhash = crypt(%s, passwordhash)
+"""
+
+
+def authenticate(username, password):
+    with get_connection() as conn, conn.cursor(cursor_factory=ROW_CURSOR) as cur:
+        execute(cur, "login", LOGIN_QUERY, (username, password))
+        return cur.fetchone()
+
+
+def create_user(username, email, password, role):
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO users (username, email, passwordhash, roleid, registrationdate, isactive)
+            VALUES (%s, %s, crypt(%s, gen_salt('bf')), %s, NOW(), TRUE)
+        """, (username, email, password, role))
+        conn.commit()
+
+
+def update_user(user_id, username, email):
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            UPDATE users
+            SET username = %s, email = %s
+            WHERE userid = %s
+        """, (username, email, user_id))
+        conn.commit()
+
+
+# Каталог
+
+# Колонки каталога. ImageURL выбирается, только если это короткая ссылка:
+# ещё не перенесённые в хранилище data URI не читаются (octet_length не распаковывает TOAST).
+# Рейтинг берётся из агрегатов ProductRatings (migrations/011_product_ratings.sql).
+PRODUCT_LIST_COLUMNS = """p.productid, p.name, p.description, p.price, p.stockquantity, p.categoryid,
+    CASE WHEN octet_length(p.imageurl) <= 512 THEN p.imageurl END AS imageurl,
+    r.avgrating, r.ratingcount"""
+
+
+# Запрос страницы каталога с постраничной навигацией по ключу (keyset):
+# вместо OFFSET берём товары с productid больше последнего на предыдущей странице,
+# поэтому стоимость страницы не зависит от её номера и размера каталога.
+# Выбирается на одну строку больше, чтобы узнать, есть ли следующая страница.
+# При сортировке по рейтингу ключ — (avgrating, productid), отбор и порядок
+# обслуживает индекс ProductRatings (CategoryID, AvgRating, ProductID).
+def products_page_query(category_id, after, limit, sort="id", min_rating=None):
+    if sort == "rating":
+        query = (f"SELECT {PRODUCT_LIST_COLUMNS} FROM productratings r "
+                 "JOIN products p ON p.productid = r.productid WHERE 1=1")
+    else:
+        query = (f"SELECT {PRODUCT_LIST_COLUMNS} FROM products p "
+                 "LEFT JOIN productratings r ON r.productid = p.productid WHERE 1=1")
+    params = []
+
+    if category_id:
+        query += " AND r.categoryid = %s" if sort == "rating" else " AND p.categoryid = %s"
+        params.append(category_id)
+
+    if min_rating:
+        query += " AND r.avgrating >= %s"
+        params.append(min_rating)
+
+    if after is not None:
+        if sort == "rating":
+            query += " AND (r.avgrating, r.productid) < (%s, %s)"
+            params.extend(after)
+        else:
+            query += " AND p.productid > %s"
+            params.append(after)
+
+    if sort == "rating":
+        query += " ORDER BY r.avgrating DESC, r.productid DESC LIMIT %s"
+    else:
+        query += " ORDER BY p.productid LIMIT %s"
+    params.append(limit + 1)
+    return query, tuple(params)
+
+
+# Поиск товаров с ранжированием по релевантности (см. migrations/002_product_search.sql).
+# Совпадение ищется по триграммам названия (устойчиво к опечаткам), по названию
+# в исправленной раскладке (fix_mistake_search) и полнотекстово по названию и описанию;
+# все три условия обслуживаются GIN-индексами вместе с фильтром по категории.
+# Результаты упорядочены по релевантности (или по рейтингу), поэтому курсор страницы здесь — смещение.
+def product_search_query(search_query, category_id, offset, limit, sort="id", min_rating=None):
+    query = f"""
+        SELECT {PRODUCT_LIST_COLUMNS},
+            GREATEST(word_similarity(lower(%(q)s), lower(p.name)),
+                     word_similarity(fix_mistake_search(%(q)s), lower(p.name)))
+            + ts_rank(p.searchvector, plainto_tsquery('russian', %(q)s)) AS rank
+        FROM products p
+        LEFT JOIN productratings r ON r.productid = p.productid
+        WHERE (lower(%(q)s) <%% lower(p.name)
+               OR fix_mistake_search(%(q)s) <%% lower(p.name)
+               OR p.searchvector @@ plainto_tsquery('russian', %(q)s))
+    """
+    params = {"q": search_query, "limit": limit + 1, "offset": offset or 0}
+
+    if category_id:
+        query += " AND p.categoryid = %(category_id)s"
+        params["category_id"] = category_id
+
+    if min_rating:
+        query += " AND r.avgrating >= %(min_rating)s"
+        params["min_rating"] = min_rating
+
+    if sort == "rating":
+        query += " ORDER BY r.avgrating DESC NULLS LAST, rank DESC, p.productid LIMIT %(limit)s OFFSET %(offset)s"
+    else:
+        query += " ORDER BY rank DESC, p.productid LIMIT %(limit)s OFFSET %(offset)s"
+    return query, params
+
+
+# Страница каталога без кэша: (товары, есть ли следующая страница)
+def load_products_page(search_query, category_id, cursor, limit, sort="id", min_rating=None):
+    if search_query:
+        name = "catalog_search"
+        query, params = product_search_query(search_query, category_id, cursor, limit, sort, min_rating)
+    else:
+        name = "catalog_page"
+        query, params = products_page_query(category_id, cursor, limit, sort, min_rating)
+    with get_connection(read_only=True) as conn, conn.cursor(cursor_factory=ROW_CURSOR) as cur:
+        execute(cur, name, query, params)
+        products = cur.fetchall()
+    return products[:limit], len(products) > limit
+
+
+def fetch_products_page(search_query, category_id, cursor, limit, sort="id", min_rating=None):
+    return cached(("products", search_query, category_id, cursor, limit, sort, min_rating),
+                  ["products", "productratings"],
+                  lambda: load_products_page(search_query, category_id, cursor, limit, sort, min_rating))
+
+
+def fetch_categories():
+    def load():
+        with get_connection(read_only=True) as conn, conn.cursor(cursor_factory=ROW_CURSOR) as cur:
+            cur.execute("SELECT categoryid, categoryname FROM categories ORDER BY categoryid")
+            return cur.fetchall()
+
+    return cached(("categories",), ["categories"], load)
+
+
+# Курсор следующей страницы: смещение для поиска, последний productid для просмотра
+# (с рейтингом — при сортировке по рейтингу)
+def next_products_cursor(search_query, cursor, products, sort="id"):
+    if not products:
+        return None
+    if search_query:
+        return (cursor or 0) + len(products)
+    if sort == "rating":
+        return products[-1]["avgrating"], products[-1]["productid"]
+    return products[-1]["productid"]
+
+
+def insert_category(category_name):
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("INSERT INTO categories (CategoryName) VALUES (%s)", (category_name,))
+        conn.commit()
+    invalidate("categories")
+
+
+def insert_product(name, description, price, stock, category_id, image_ref):
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO products (name, description, price, stockquantity, categoryid, imageurl)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """, (name, description, price, stock, category_id, image_ref))
+        conn.commit()
+    invalidate("products")
+
+
+# Сохранение правок администратора одной транзакцией: все изменённые товары
+# обновляются одним UPDATE ... FROM (VALUES ...), удалённые — одним DELETE.
+# Остаток пишется только для товаров, где его изменили (stock_changes — пары
+# (productid, остаток)), через set_product_stock: у товаров с секциями остатка
+# (migrations/014_stock_buckets.sql) показанное в таблице число может отставать.
+def update_products(changes, deleted_ids, stock_changes=()):
+    with get_connection() as conn, conn.cursor() as cur:
+        if changes:
+            execute_values(cur, """
+                UPDATE products AS p
+                SET name = v.name, price = v.price::numeric
+                FROM (VALUES %s) AS v(productid, name, price)
+                WHERE p.productid = v.productid
+            """, changes)
+        if stock_changes:
+            product_ids, quantities = zip(*stock_changes)
+            cur.execute("SELECT set_product_stock(%s, %s)", (list(product_ids), list(quantities)))
+        if deleted_ids:
+            cur.execute("DELETE FROM products WHERE productid = ANY(%s)", (deleted_ids,))
+        conn.commit()
+    invalidate("products")
+
+
+# Включение секций остатка для «горячего» товара (buckets > 1) или возврат
+# остатка в одну строку Products (0). Возвращает общий остаток товара.
+def set_stock_buckets(product_id, buckets):
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT set_product_stock_buckets(%s, %s)", (product_id, buckets))
+        stock = cur.fetchone()[0]
+        conn.commit()
+    invalidate("products")
+    return stock
+
+
+# Отзывы
+
+def fetch_product_rating(product_id):
+    with get_connection(read_only=True) as conn, conn.cursor(cursor_factory=ROW_CURSOR) as cur:
+        execute(cur, "product_rating", """
+            SELECT reviewcount, ratingcount, avgrating, histogram, lastreviewat
+            FROM productratings
+            WHERE productid = %s
+        """, (product_id,))
+        return cur.fetchone()
+
+
+# Страница отзывов о товаре от новых к старым, навигация по ключу (reviewdate, reviewid)
+def fetch_reviews_page(product_id, after, limit):
+    query = """
+        SELECT r.reviewid, r.rating, r.comment, r.reviewdate, u.username
+        FROM reviews r
+        JOIN users u ON u.userid = r.userid
+        WHERE r.productid = %s
+    """
+    params = [product_id]
+    if after is not None:
+        query += " AND (r.reviewdate, r.reviewid) < (%s, %s)"
+        params.extend(after)
+    query += " ORDER BY r.reviewdate DESC, r.reviewid DESC LIMIT %s"
+    params.append(limit + 1)
+    with get_connection(read_only=True) as conn, conn.cursor(cursor_factory=ROW_CURSOR) as cur:
+        execute(cur, "reviews_page", query, params)
+        reviews = cur.fetchall()
+    return reviews[:limit], len(reviews) > limit
+
+
+# Рейтинг товара пересчитывается триггером на Reviews в той же транзакции
+def add_review(product_id, user_id, rating, comment):
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO reviews (productid, userid, rating, comment, reviewdate)
+            VALUES (%s, %s, %s, %s, NOW())
+        """, (product_id, user_id, rating, comment or None))
+        conn.commit()
+    invalidate("productratings")
+
+
+# Корзина хранится в БД (migrations/010_carts.sql). Любая операция с корзиной —
+# один запрос, сколько бы позиций в ней ни было.
+
+# Добавление товаров {productid: количество}: корзина и позиции создаются или
+# дополняются одним INSERT ... ON CONFLICT, цена позиции запоминается текущая
+def add_to_cart(user_id, quantities):
+    product_ids = list(quantities)
+    with get_connection() as conn, conn.cursor() as cur:
+        execute(cur, "cart_add", """
+            WITH cart AS (
+                INSERT INTO carts AS c (userid) VALUES (%s)
+                ON CONFLICT (userid) DO UPDATE SET updatedat = now()
+                RETURNING c.userid
+            )
+            INSERT INTO cartitems AS ci (userid, productid, quantity, addedprice)
+            SELECT cart.userid, p.productid, i.quantity, p.price
+            FROM cart
+            CROSS JOIN unnest(%s::int[], %s::int[]) AS i(productid, quantity)
+            JOIN products p ON p.productid = i.productid
+            ORDER BY p.productid
+            ON CONFLICT (userid, productid) DO UPDATE
+            SET quantity = ci.quantity + EXCLUDED.quantity, addedprice = EXCLUDED.addedprice
+        """, (user_id, product_ids, [quantities[product_id] for product_id in product_ids]))
+        conn.commit()
+
+
+# Новое количество позиций {productid: количество}; 0 удаляет позицию
+def update_cart(user_id, quantities):
+    product_ids = list(quantities)
+    with get_connection() as conn, conn.cursor() as cur:
+        execute(cur, "cart_update", """
+            WITH changes AS (
+                SELECT * FROM unnest(%(product_ids)s::int[], %(quantities)s::int[]) AS c(productid, quantity)
+            ), removed AS (
+                DELETE FROM cartitems ci
+                USING changes c
+                WHERE ci.userid = %(user_id)s AND ci.productid = c.productid AND c.quantity <= 0
+            ), changed AS (
+                UPDATE cartitems ci
+                SET quantity = c.quantity
+                FROM changes c
+                WHERE ci.userid = %(user_id)s AND ci.productid = c.productid AND c.quantity > 0
+            )
+            UPDATE carts SET updatedat = now() WHERE userid = %(user_id)s
+        """, {"user_id": user_id, "product_ids": product_ids,
+              "quantities": [quantities[product_id] for product_id in product_ids]})
+        conn.commit()
+
+
+# Приведение корзины к каталогу: цены позиций становятся текущими, количество
+# уменьшается до остатка на складе, позиции без остатка удаляются
+def refresh_cart(user_id):
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            WITH removed AS (
+                DELETE FROM cartitems ci
+                USING products p
+                WHERE ci.userid = %(user_id)s AND p.productid = ci.productid AND p.stockquantity <= 0
+            ), changed AS (
+                UPDATE cartitems ci
+                SET addedprice = p.price, quantity = LEAST(ci.quantity, p.stockquantity)
+                FROM products p
+                WHERE ci.userid = %(user_id)s AND p.productid = ci.productid AND p.stockquantity > 0
+            )
+            UPDATE carts SET updatedat = now() WHERE userid = %(user_id)s
+        """, {"user_id": user_id})
+        conn.commit()
+
+
+# Позиции корзины, сверенные с каталогом одним запросом: текущая цена и остаток
+# рядом с ценой на момент добавления
+def fetch_cart(user_id):
+    with get_connection(read_only=True) as conn, conn.cursor(cursor_factory=ROW_CURSOR) as cur:
+        execute(cur, "cart_items", """
+            SELECT ci.productid, p.name, ci.quantity, ci.addedprice, p.price, p.stockquantity
+            FROM cartitems ci
+            JOIN products p ON p.productid = ci.productid
+            WHERE ci.userid = %s
+            ORDER BY ci.addedat, ci.productid
+        """, (user_id,))
+        return cur.fetchall()
+
+
+# Оформление заказа
+
+class InsufficientStock(Exception):
+    def __init__(self, shortages):
+        super().__init__("Недостаточно товара на складе")
+        self.shortages = shortages
+
+
+# Оформление заказа за один запрос: функция place_order в БД
+# (migrations/003_checkout.sql) блокирует товары, проверяет остатки,
+# считает сумму по текущим ценам и пишет заказ целиком. Остаток «горячих»
+# товаров списывается из секций (migrations/014_stock_buckets.sql).
+def checkout(user_id, cart):
+    items = [{"productid": product_id, "quantity": item["quantity"]} for product_id, item in cart.items()]
+    return run_checkout("place_order", "SELECT order_id, total_amount FROM place_order(%s, %s::jsonb)",
+                        (user_id, json.dumps(items)))
+
+
+# Оформление заказа из корзины в БД (checkout_cart, migrations/010_carts.sql):
+# позиции читает сама функция, корзина удаляется в той же транзакции
+def checkout_cart(user_id):
+    return run_checkout("checkout_cart", "SELECT order_id, total_amount FROM checkout_cart(%s)", (user_id,))
+
+
+def run_checkout(name, query, params):
+    try:
+        with get_connection() as conn, conn.cursor() as cur:
+            execute(cur, name, query, params)
+            order_id, total = cur.fetchone()
+            conn.commit()
+            invalidate("products")
+            return order_id, total
+    except errors.CheckViolation as e:
+        try:
+            shortages = json.loads(e.diag.message_detail or "")
+        except ValueError:
+            raise e
+        raise InsufficientStock(shortages) from e
+
+
+# Заказы
+
+ORDER_STATUSES = ["обрабатывается", "доставлен", "отменён"]
+# Допустимые смены статуса: доставленный заказ можно только отменить (возврат),
+# отменённый — вернуть в обработку
+ORDER_TRANSITIONS = {
+    "обрабатывается": ["доставлен", "отменён"],
+    "доставлен": ["отменён"],
+    "отменён": ["обрабатывается"],
+}
+
+
+# Статусы, из которых заказ можно перевести в status
+def transition_sources(status):
+    return [source for source, targets in ORDER_TRANSITIONS.items() if status in targets]
+
+
+# Условия отбора заказов. Ключи filters: order_id, user_id, username, status,
+# date_from, date_to (даты включительно); пустые значения не учитываются.
+def orders_filter_sql(filters):
+    conditions = []
+    params = []
+    if filters.get("order_id"):
+        conditions.append("o.orderid = %s")
+        params.append(filters["order_id"])
+    if filters.get("user_id"):
+        conditions.append("o.userid = %s")
+        params.append(filters["user_id"])
+    if filters.get("username"):
+        conditions.append("o.userid = (SELECT userid FROM users WHERE username = %s)")
+        params.append(filters["username"])
+    if filters.get("status"):
+        conditions.append("o.orderstatus = %s")
+        params.append(filters["status"])
+    if filters.get("date_from"):
+        conditions.append("o.orderdate >= %s")
+        params.append(filters["date_from"])
+    if filters.get("date_to"):
+        conditions.append("o.orderdate < %s::date + 1")
+        params.append(filters["date_to"])
+    return conditions, params
+
+
+# Страница заказов: одна строка на заказ, позиции собраны в JSON на стороне БД.
+# Сначала выбирается сама страница, затем позиции её заказов — одним проходом по
+# OrderDetails за месяцы между первым и последним заказом страницы: секции вне
+# них отбрасываются при выполнении. В LATERAL-подзапросе на каждый заказ
+# планировщик оценивал бы поиск по всем секциям OrderDetails для каждого заказа.
+# Навигация по ключу (orderdate, orderid) от новых заказов к старым.
+def orders_page_query(filters, after, limit):
+    conditions, params = orders_filter_sql(filters)
+    if after is not None:
+        conditions.append("(o.orderdate, o.orderid) < (%s, %s)")
+        params.extend(after)
+    where = " AND ".join(conditions) or "TRUE"
+    query = f"""
+        WITH page AS MATERIALIZED (
+            SELECT o.orderid, o.userid, o.orderdate, o.orderstatus, o.totalamount
+            FROM orders o
+            WHERE {where}
+            ORDER BY o.orderdate DESC, o.orderid DESC
+            LIMIT %s
+        ), lines AS (
+            SELECT od.orderid, od.orderdate, json_agg(json_build_object(
+                       'productid', od.productid,
+                       'name', p.name,
+                       'quantity', od.quantity,
+                       'price', od.price
+                   ) ORDER BY od.orderdetailid) AS items
+            FROM orderdetails od
+            JOIN products p ON p.productid = od.productid
+            WHERE od.orderid = ANY(ARRAY(SELECT orderid FROM page))
+              AND od.orderdate >= (SELECT MIN(orderdate) FROM page)
+              AND od.orderdate <= (SELECT MAX(orderdate) FROM page)
+            GROUP BY od.orderid, od.orderdate
+        )
+        SELECT page.orderid, page.userid, u.username, page.orderdate, page.orderstatus, page.totalamount,
+               COALESCE(lines.items, '[]') AS items
+        FROM page
+        JOIN users u ON u.userid = page.userid
+        LEFT JOIN lines ON lines.orderid = page.orderid AND lines.orderdate = page.orderdate
+        ORDER BY page.orderdate DESC, page.orderid DESC
+    """
+    params.append(limit + 1)
+    return query, tuple(params)
+
+
+# Число заказов по фильтрам. Без фильтров точный count(*) по всей таблице
+# не нужен — берём оценку планировщика из pg_class. Orders разбита на секции
+# по месяцам (migrations/012_partition_orders.sql), и оценка складывается по секциям.
+ORDERS_ESTIMATE_QUERY = """
+    SELECT COALESCE(SUM(c.reltuples) FILTER (WHERE c.reltuples > 0), 0)::bigint AS total, FALSE AS exact
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'orders'::regclass
+"""
+
+
+def orders_count_query(filters):
+    conditions, params = orders_filter_sql(filters)
+    if not conditions:
+        return ORDERS_ESTIMATE_QUERY, ()
+    return f"SELECT count(*) AS total, TRUE AS exact FROM orders o WHERE {' AND '.join(conditions)}", tuple(params)
+
+
+def fetch_orders_page(filters, after, limit):
+    with get_connection(read_only=True) as conn, conn.cursor(cursor_factory=ROW_CURSOR) as cur:
+        query, params = orders_page_query(filters, after, limit)
+        execute(cur, "orders_page", query, params)
+        orders = cur.fetchall()
+    return orders[:limit], len(orders) > limit
+
+
+def fetch_orders_count(filters):
+    with get_connection(read_only=True) as conn, conn.cursor(cursor_factory=ROW_CURSOR) as cur:
+        query, params = orders_count_query(filters)
+        execute(cur, "orders_count", query, params)
+        return cur.fetchone()
+
+
+# Массовая смена статуса одним оператором: выбранные заказы (order_ids) или все,
+# подходящие под фильтры страницы. Меняются только заказы, для которых переход
+# разрешён (ORDER_TRANSITIONS; заказ со статусом не из списка, как в старых данных,
+# можно перевести в любой); сводка продаж обновляется триггером в той же транзакции
+# (migrations/009_rollup_statement_trigger.sql). Возвращает (изменено, пропущено).
+def bulk_update_order_status(new_status, order_ids=None, filters=None):
+    if order_ids is not None:
+        conditions, params = ["o.orderid = ANY(%s)"], [list(order_ids)]
+    else:
+        conditions, params = orders_filter_sql(filters)
+    where = " AND ".join(conditions) or "TRUE"
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute(f"""
+            WITH updated AS (
+                UPDATE orders o
+                SET orderstatus = %s
+                WHERE {where} AND (o.orderstatus = ANY(%s) OR o.orderstatus <> ALL(%s))
+                RETURNING 1
+            )
+            SELECT (SELECT count(*) FROM updated),
+                   (SELECT count(*) FROM orders o WHERE {where}) - (SELECT count(*) FROM updated)
+        """, [new_status, *params, transition_sources(new_status), list(ORDER_TRANSITIONS), *params])
+        updated, skipped = cur.fetchone()
+        conn.commit()
+    return updated, skipped
+
+
+# Сводка по доставленным заказам за период из предагрегированной таблицы
+# DailySalesRollup (migrations/005_daily_sales_rollup.sql). Строки по пользователям
+# и общий итог (строка с is_total) приходят одним запросом через GROUPING SETS.
+ORDER_SUMMARY_QUERY = """
+    SELECT s.userid, u.username, s.total_orders, s.total_amount, s.is_total
+    FROM (
+        SELECT r.userid,
+               SUM(r.orderscount)::bigint AS total_orders,
+               SUM(r.totalamount) AS total_amount,
+               GROUPING(r.userid) = 1 AS is_total
+        FROM dailysalesrollup r
+        WHERE r.day BETWEEN %s AND %s
+        GROUP BY GROUPING SETS ((r.userid), ())
+        HAVING SUM(r.orderscount) > 0
+    ) s
+    LEFT JOIN users u ON u.userid = s.userid
+    ORDER BY s.is_total DESC, s.total_amount DESC
+"""
+
+
+# Сводка колонками (для таблицы страницы) и итог отдельным словарем; без заказов — ({}, None)
+def fetch_order_summary(start_date, end_date):
+    with get_connection(read_only=True) as conn, conn.cursor() as cur:
+        execute(cur, "order_summary", ORDER_SUMMARY_QUERY, (start_date, end_date))
+        columns = fetch_columns(cur)
+    if not columns["is_total"]:
+        return {}, None
+    del columns["is_total"]
+    totals = {name: values.pop(0) for name, values in columns.items()}
+    return columns, totals
@@ -0,0 +1,343 @@
+import io
+import random
+import time
+from datetime import date, datetime, timedelta
+from multiprocessing import Pool
+
+import psycopg2
+
+from db import DB_CONFIG
+
+# Генератор синтетических данных для схемы магазина (migrations/ddl.sql).
+# Объёмы задаются параметрами, данные согласованы по ссылкам и воспроизводимы:
+# каждая порция строк генерируется своим Random от (seed, таблица, номер порции),
+# поэтому результат не зависит от числа процессов. Порции загружаются через COPY
+# параллельно несколькими процессами, каждый со своим соединением.
+#
+# Распределения:
+# - пользователи регистрируются равномерно по периоду, id растёт со временем;
+# - заказы пользователь делает после регистрации, ближе к концу периода заказов больше;
+# - популярность товаров и активность покупателей степенная (немногие дают большую долю);
+# - старые заказы в основном доставлены, свежие ещё обрабатываются.
+PRODUCT_WORDS = (
+    ["Гантели", "Штанга", "Гиря", "Коврик", "Эспандер", "Скакалка", "Турник", "Мяч",
+     "Беговая дорожка", "Велотренажёр", "Блин", "Перчатки", "Пояс", "Ролик", "Степ-платформа"],
+    ["разборная", "олимпийская", "для йоги", "профессиональная", "домашняя", "резиновая",
+     "неопреновая", "складная", "компактная", "усиленная"],
+)
+DESCRIPTIONS = [
+    "Подходит для домашних тренировок",
+    "Для зала и профессионального использования",
+    "Нескользящее покрытие, лёгкий уход",
+    "Прочная сталь, долгий срок службы",
+    "Компактно хранится, удобно брать с собой",
+]
+REVIEW_COMMENTS = ["Отличное качество!", "Очень понравилось", "Среднее качество", "Не советую", "Хорошая цена"]
+DEFAULT_ROLES = [(1, "Admin", "Администратор с полным доступом"),
+                 (2, "Editor", "Редактор с доступом к управлению контентом"),
+                 (3, "Customer", "Клиент, покупающий товары")]
+MAX_LINES_PER_ORDER = 10
+CHUNK_SIZE = 50_000
+
+
+# Детерминированный хэш целого (splitmix64): свойства товара вычисляются по его id
+# одинаково и при генерации товаров, и при генерации строк заказов в другом процессе
+def _mix(value):
+    value = (value + 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+    return value ^ (value >> 31)
+
+
+def _unit(seed, value):
+    return _mix(seed * 1_000_003 + value) / 2 ** 64
+
+
+# Цена в копейках: много дешёвых товаров и немного дорогих
+def product_price_cents(seed, product_id):
+    return 10_000 + int(_unit(seed, product_id) ** 3 * 9_990_000)
+
+
+# Индекс из [0, n) со степенным перекосом к началу: чем больше skew, тем сильнее
+def _skewed(rng, n, skew):
+    return min(int(n * rng.random() ** skew), n - 1)
+
+
+def _copy(cur, table, columns, buffer):
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+
+def _ts(moment):
+    return moment.strftime("%Y-%m-%d %H:%M:%S")
+
+
+class Plan:
+    def __init__(self, seed, users, products, orders, reviews, start, end, user_offset, product_offset,
+                 order_offset, review_offset, category_ids, customer_role_id, password_hash):
+        self.seed = seed
+        self.users = users
+        self.products = products
+        self.orders = orders
+        self.reviews = reviews
+        self.start = start
+        self.end = end
+        self.user_offset = user_offset
+        self.product_offset = product_offset
+        self.order_offset = order_offset
+        self.review_offset = review_offset
+        self.category_ids = category_ids
+        self.customer_role_id = customer_role_id
+        self.password_hash = password_hash
+
+    @property
+    def span_seconds(self):
+        return (self.end - self.start).total_seconds()
+
+    def registered_at(self, index):
+        return self.start + timedelta(seconds=self.span_seconds * 0.8 * index / max(self.users, 1))
+
+    # Популярный товар по рангу: ранги переставлены умножением на число,
+    # взаимно простое с количеством товаров, чтобы популярные не шли подряд по id
+    def product_by_rank(self, rank):
+        step = 7919 if self.products % 7919 else 7907
+        return self.product_offset + 1 + (rank * step) % self.products
+
+
+def _generate_users(plan, cur, first, last):
+    rng = random.Random(f"{plan.seed}:users:{first}")
+    users = io.StringIO()
+    details = io.StringIO()
+    for index in range(first, last):
+        user_id = plan.user_offset + index + 1
+        registered = plan.registered_at(index)
+        last_login = registered + timedelta(seconds=rng.random() * (plan.end - registered).total_seconds())
+        active = "t" if rng.random() < 0.95 else "f"
+        users.write(f"{user_id}\tuser{user_id}\tuser{user_id}@example.com\t{plan.password_hash}\t"
+                    f"{plan.customer_role_id}\t{_ts(registered)}\t{_ts(last_login)}\t{active}\n")
+        if rng.random() < 0.7:
+            details.write(f"{user_id}\tИмя{user_id % 1000}\tФамилия{user_id % 5000}\t"
+                          f"+7{rng.randrange(10 ** 9, 10 ** 10)}\tг. Город{user_id % 300}, ул. {user_id % 97}\n")
+    _copy(cur, "users", ["userid", "username", "email", "passwordhash", "roleid", "registrationdate",
+                         "lastlogindate", "isactive"], users)
+    _copy(cur, "userdetails", ["userid", "firstname", "lastname", "phone", "address"], details)
+    return last - first
+
+
+def _generate_products(plan, cur, first, last):
+    rng = random.Random(f"{plan.seed}:products:{first}")
+    rows = io.StringIO()
+    nouns, adjectives = PRODUCT_WORDS
+    categories = plan.category_ids
+    for index in range(first, last):
+        product_id = plan.product_offset + index + 1
+        name = f"{rng.choice(nouns)} {rng.choice(adjectives)} {product_id}"
+        category_id = categories[_skewed(rng, len(categories), 1.5)]
+        price = product_price_cents(plan.seed, product_id)
+        stock = int(rng.random() ** 2 * 500)
+        rows.write(f"{product_id}\t{name}\t{category_id}\t{price // 100}.{price % 100:02d}\t{stock}\t"
+                   f"{rng.choice(DESCRIPTIONS)}\n")
+    _copy(cur, "products", ["productid", "name", "categoryid", "price", "stockquantity", "description"], rows)
+    return last - first
+
+
+def _order_status(rng, age_days):
+    if age_days < 3:
+        return "обрабатывается" if rng.random() < 0.8 else "доставлен"
+    return "отменён" if rng.random() < 0.07 else "доставлен"
+
+
+def _generate_orders(plan, cur, first, last):
+    rng = random.Random(f"{plan.seed}:orders:{first}")
+    orders = io.StringIO()
+    lines = io.StringIO()
+    line_count = 0
+    for index in range(first, last):
+        order_id = plan.order_offset + index + 1
+        user_index = _skewed(rng, plan.users, 2.0)
+        registered = plan.registered_at(user_index)
+        # Чем ближе к концу периода, тем больше заказов (sqrt смещает к концу)
+        window = (plan.end - registered).total_seconds()
+        ordered = registered + timedelta(seconds=window * rng.random() ** 0.5)
+        status = _order_status(rng, (plan.end - ordered).days)
+
+        total = 0
+        products = set()
+        for _ in range(min(1 + int(rng.expovariate(0.7)), MAX_LINES_PER_ORDER)):
+            product_id = plan.product_by_rank(_skewed(rng, plan.products, 3.0))
+            if product_id in products:
+                continue
+            products.add(product_id)
+            quantity = 1 if rng.random() < 0.75 else rng.randint(2, 5)
+            price = product_price_cents(plan.seed, product_id)
+            total += price * quantity
+            line_id = order_id * MAX_LINES_PER_ORDER + len(products) - 1
+            lines.write(f"{line_id}\t{order_id}\t{_ts(ordered)}\t{product_id}\t{quantity}\t"
+                        f"{price // 100}.{price % 100:02d}\n")
+        line_count += len(products)
+        orders.write(f"{order_id}\t{plan.user_offset + user_index + 1}\t{_ts(ordered)}\t"
+                     f"{total // 100}.{total % 100:02d}\t{status}\n")
+    _copy(cur, "orders", ["orderid", "userid", "orderdate", "totalamount", "orderstatus"], orders)
+    _copy(cur, "orderdetails", ["orderdetailid", "orderid", "orderdate", "productid", "quantity", "price"], lines)
+    return line_count
+
+
+def _generate_reviews(plan, cur, first, last):
+    rng = random.Random(f"{plan.seed}:reviews:{first}")
+    rows = io.StringIO()
+    for index in range(first, last):
+        review_id = plan.review_offset + index + 1
+        product_id = plan.product_by_rank(_skewed(rng, plan.products, 3.0))
+        user_index = _skewed(rng, plan.users, 2.0)
+        registered = plan.registered_at(user_index)
+        reviewed = registered + timedelta(seconds=(plan.end - registered).total_seconds() * rng.random() ** 0.5)
+        rating = rng.choices([1, 2, 3, 4, 5], weights=[5, 5, 12, 30, 48])[0]
+        rows.write(f"{review_id}\t{product_id}\t{plan.user_offset + user_index + 1}\t{rating}\t"
+                   f"{REVIEW_COMMENTS[5 - rating]}\t{_ts(reviewed)}\n")
+    _copy(cur, "reviews", ["reviewid", "productid", "userid", "rating", "comment", "reviewdate"], rows)
+    return last - first
+
+
+GENERATORS = {
+    "users": _generate_users,
+    "products": _generate_products,
+    "orders": _generate_orders,
+    "reviews": _generate_reviews,
+}
+
+
+def _run_chunk(task):
+    plan, table, first, last, fast = task
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        with conn.cursor() as cur:
+            if fast:
+                # Без триггеров и проверок внешних ключей; производные данные пересчитываются в конце
+                cur.execute("SET session_replication_role = replica")
+            cur.execute("SET synchronous_commit = off")
+            rows = GENERATORS[table](plan, cur, first, last)
+        conn.commit()
+        return table, rows
+    finally:
+        conn.close()
+
+
+def _prepare(conn, args):
+    with conn.cursor() as cur:
+        if args.truncate:
+            cur.execute("""
+                TRUNCATE reviews, orderdetails, orders, userdetails, users, products, categories, roles
+                RESTART IDENTITY CASCADE
+            """)
+        cur.execute("SELECT COUNT(*) FROM roles")
+        if cur.fetchone()[0] == 0:
+            cur.executemany("INSERT INTO roles (roleid, rolename, description) VALUES (%s, %s, %s)", DEFAULT_ROLES)
+        cur.execute("SELECT roleid FROM roles WHERE rolename = 'Customer'")
+        row = cur.fetchone()
+        customer_role_id = row[0] if row else 2
+
+        cur.execute("""
+            INSERT INTO categories (categoryname, description)
+            SELECT 'Категория ' || g, 'Сгенерированная категория'
+            FROM generate_series(1, %s) AS g
+            ON CONFLICT (categoryname) DO NOTHING
+        """, (args.categories,))
+        cur.execute("SELECT categoryid FROM categories ORDER BY categoryid")
+        category_ids = [row[0] for row in cur.fetchall()]
+
+        offsets = []
+        for table, column in (("users", "userid"), ("products", "productid"), ("orders", "orderid"),
+                              ("reviews", "reviewid")):
+            cur.execute(f"SELECT COALESCE(MAX({column}), 0) FROM {table}")
+            offsets.append(cur.fetchone()[0])
+
+        # Хэш одного пароля на всех пользователей: bcrypt на каждого занял бы часы
+        cur.execute("SELECT crypt(%s, gen_salt('bf'))", (args.password,))
+        password_hash = cur.fetchone()[0]
+
+        cur.execute("SELECT rolsuper FROM pg_roles WHERE rolname = current_user")
+        superuser = cur.fetchone()[0]
+    conn.commit()
+
+    end = datetime.combine(args.end or date.today(), datetime.min.time())
+    plan = Plan(args.seed, args.users, args.products, args.orders, args.reviews,
+                end - timedelta(days=365 * args.years), end, *offsets,
+                category_ids=category_ids, customer_role_id=customer_role_id, password_hash=password_hash)
+    # Месячные секции заказов на весь период, иначе заказы лягут в секцию по умолчанию
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regproc('ensure_order_partitions') IS NOT NULL")
+        if cur.fetchone()[0]:
+            cur.execute("SELECT ensure_order_partitions(%s)", (plan.start.date(),))
+    conn.commit()
+    return plan, superuser
+
+
+def _finish(conn, log):
+    with conn.cursor() as cur:
+        for table, column in (("users", "userid"), ("products", "productid"), ("orders", "orderid"),
+                              ("orderdetails", "orderdetailid"), ("reviews", "reviewid"),
+                              ("categories", "categoryid"), ("roles", "roleid")):
+            cur.execute(f"SELECT setval(pg_get_serial_sequence('{table}', '{column}'), "
+                        f"GREATEST((SELECT MAX({column}) FROM {table}), 1))")
+        cur.execute("SELECT to_regproc('rebuild_daily_sales_rollup') IS NOT NULL")
+        if cur.fetchone()[0]:
+            log("Пересчёт сводки продаж...")
+            cur.execute("SELECT rebuild_daily_sales_rollup()")
+        cur.execute("SELECT to_regproc('rebuild_product_ratings') IS NOT NULL")
+        if cur.fetchone()[0]:
+            log("Пересчёт рейтингов товаров...")
+            cur.execute("SELECT rebuild_product_ratings()")
+    conn.commit()
+
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("ANALYZE")
+    conn.autocommit = False
+
+
+def _tasks(plan, table, total, chunk_size, fast):
+    return [(plan, table, first, min(first + chunk_size, total), fast) for first in range(0, total, chunk_size)]
+
+
+# Заполнение БД. Сначала пользователи и товары, затем ссылающиеся на них заказы и отзывы.
+def generate(args, log=print):
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        plan, superuser = _prepare(conn, args)
+        fast = superuser and not args.keep_triggers
+        if not fast:
+            log("Триггеры остаются включёнными (нужны права суперпользователя), загрузка будет медленнее.")
+
+        started = time.perf_counter()
+        with Pool(args.workers) as pool:
+            for phase in (("users", plan.users), ("products", plan.products)), \
+                         (("orders", plan.orders), ("reviews", plan.reviews)):
+                tasks = [task for table, total in phase for task in _tasks(plan, table, total, args.chunk_size, fast)]
+                loaded = {}
+                for table, rows in pool.imap_unordered(_run_chunk, tasks):
+                    loaded[table] = loaded.get(table, 0) + rows
+                for table, rows in loaded.items():
+                    name = "строк заказов" if table == "orders" else table
+                    log(f"{name}: {rows} ({time.perf_counter() - started:.0f} с)")
+
+        _finish(conn, log)
+        log(f"Готово за {time.perf_counter() - started:.0f} с.")
+    finally:
+        conn.close()
+
+
+def add_arguments(parser):
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--products", type=int, default=5_000)
+    parser.add_argument("--orders", type=int, default=50_000, help="Строк заказов получится в ~2 раза больше")
+    parser.add_argument("--reviews", type=int, default=20_000)
+    parser.add_argument("--categories", type=int, default=20)
+    parser.add_argument("--years", type=int, default=3, help="Период, за который генерируются даты")
+    parser.add_argument("--end", type=date.fromisoformat, help="Последний день периода, ГГГГ-ММ-ДД (по умолчанию сегодня)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--password", default="password", help="Пароль всех сгенерированных пользователей")
+    parser.add_argument("--truncate", action="store_true", help="Очистить таблицы перед генерацией")
+    parser.add_argument("--keep-triggers", action="store_true",
+                        help="Не отключать триггеры и проверки внешних ключей на время загрузки")
@@ -0,0 +1,459 @@
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+import querylog
+
+# Конфигурация подключения к БД (значения по умолчанию можно переопределить переменными окружения)
+DB_CONFIG = {
+    "host": os.environ.get("DB_HOST", "host.docker.internal"),
+    "database": os.environ.get("DB_NAME", "kp_bd"),
+    "user": os.environ.get("DB_USER", "kp_bd"),
+    "password": os.environ.get("DB_PASSWORD", "kp_bd"),
+    "port": os.environ.get("DB_PORT", "5432"),
+}
+
+# Параметры пула соединений
+POOL_CONFIG = {
+    "minconn": int(os.environ.get("DB_POOL_MIN", "1")),
+    "maxconn": int(os.environ.get("DB_POOL_MAX", "10")),
+    # Сколько секунд ждать свободное соединение, прежде чем сообщить об ошибке
+    "timeout": float(os.environ.get("DB_POOL_TIMEOUT", "10")),
+    # Соединение, простаивавшее дольше этого времени, проверяется запросом SELECT 1
+    "check_after": float(os.environ.get("DB_POOL_CHECK_AFTER", "30")),
+}
+
+
+# Реплики для чтения: "хост[:порт],хост[:порт]"; база, пользователь и пароль — как у основного
+# сервера. Без реплик все запросы идут на основной сервер.
+REPLICA_HOSTS = [host.strip() for host in os.environ.get("DB_REPLICAS", "").split(",") if host.strip()]
+REPLICA_CONFIG = {
+    # Реплика, отстающая больше чем на столько секунд, не используется
+    "max_lag": float(os.environ.get("DB_REPLICA_MAX_LAG", "5")),
+    # Сколько секунд ждать, пока реплика догонит запись сессии, прежде чем читать с основного
+    "wait": float(os.environ.get("DB_REPLICA_WAIT", "0.5")),
+    # Как часто проверять отставание и доступность реплики
+    "check_interval": float(os.environ.get("DB_REPLICA_CHECK_INTERVAL", "1")),
+}
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+# Счётчик обращений к серверу: каждый execute, COPY, commit и rollback. Нужен для замеров
+# (bench/run.py): разница значений round_trips() до и после операции. Счётчик живёт
+# в контекстной переменной, поэтому общий у потока и запущенных из него загрузчиков prefetch.
+_round_trips = contextvars.ContextVar("db_round_trips")
+
+
+def _round_trip_counter():
+    counter = _round_trips.get(None)
+    if counter is None:
+        counter = [0]
+        _round_trips.set(counter)
+    return counter
+
+
+def _count_round_trips(count=1):
+    _round_trip_counter()[0] += count
+
+
+def round_trips():
+    return _round_trip_counter()[0]
+
+
+_counting_cursors = {}
+
+
+# Подкласс курсора нужного типа (RealDictCursor и т.п.), который считает обращения
+# и записывает каждый запрос в журнал querylog
+def _counting_cursor(base):
+    cls = _counting_cursors.get(base)
+    if cls is None:
+        class CountingCursor(base):
+            def execute(self, query, vars=None):
+                _count_round_trips()
+                started = time.perf_counter()
+                result = super().execute(query, vars)
+                querylog.record(self, query, vars, time.perf_counter() - started)
+                return result
+
+            def executemany(self, query, vars_list):
+                vars_list = list(vars_list)
+                _count_round_trips(len(vars_list))
+                started = time.perf_counter()
+                result = super().executemany(query, vars_list)
+                querylog.record(self, query, None, time.perf_counter() - started)
+                return result
+
+            def callproc(self, procname, parameters=None):
+                _count_round_trips()
+                return super().callproc(procname, parameters)
+
+            def copy_expert(self, sql, file, size=8192):
+                _count_round_trips()
+                started = time.perf_counter()
+                result = super().copy_expert(sql, file, size)
+                querylog.record(self, sql, None, time.perf_counter() - started)
+                return result
+
+        cls = _counting_cursors.setdefault(base, CountingCursor)
+    return cls
+
+
+class CountingConnection(extensions.connection):
+    is_replica = False
+    # Выдано через get_connection(read_only=True): querylog повторяет на нём медленные
+    # запросы под EXPLAIN ANALYZE
+    read_only = False
+
+    def cursor(self, *args, **kwargs):
+        base = kwargs.get("cursor_factory") or self.cursor_factory or extensions.cursor
+        kwargs["cursor_factory"] = _counting_cursor(base)
+        return super().cursor(*args, **kwargs)
+
+    def commit(self):
+        _count_round_trips()
+        result = super().commit()
+        if REPLICA_HOSTS and not self.is_replica:
+            _remember_write(self)
+        return result
+
+    def rollback(self):
+        _count_round_trips()
+        return super().rollback()
+
+
+# Пул соединений с проверкой живости и счётчиками использования.
+# Число выданных соединений ограничено семафором (maxconn), а свободные хранятся
+# в самом пуле, сколько бы их ни было: ThreadedConnectionPool держит открытыми
+# только minconn свободных, и при одновременных запросах каждое следующее
+# соединение открывалось бы заново. minconn соединений открываются сразу,
+# остальные — по мере надобности.
+class ConnectionPool:
+    def __init__(self, db_config, minconn, maxconn, timeout, check_after):
+        self._db_config = db_config
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        # Свободные соединения со временем возврата; выдаётся последнее возвращённое
+        self._idle = []
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_after = check_after
+        self._stats = {
+            "checkouts": 0,
+            "checked_out": 0,
+            "max_checked_out": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+            "timeouts": 0,
+            "reconnects": 0,
+        }
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        return psycopg2.connect(connection_factory=CountingConnection, **self._db_config)
+
+    def getconn(self):
+        started = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._stats["timeouts"] += 1
+            raise PoolTimeout(f"Нет свободных соединений с БД за {self.timeout} с")
+        try:
+            # Свободные соединения могут оказаться мёртвыми все разом (например, после
+            # перезапуска сервера БД), поэтому проверяем, пока не найдём живое: свободных
+            # не больше maxconn, последняя попытка получает новое соединение.
+            for _ in range(self.maxconn + 1):
+                with self._lock:
+                    conn, last_used = self._idle.pop() if self._idle else (None, None)
+                if conn is None:
+                    conn = self._connect()
+                    break
+                if self._is_alive(conn, last_used):
+                    break
+                self._close(conn)
+                with self._lock:
+                    self._stats["reconnects"] += 1
+            else:
+                raise psycopg2.OperationalError("Не удалось получить рабочее соединение с БД")
+        except Exception:
+            self._slots.release()
+            raise
+
+        waited = time.perf_counter() - started
+        with self._lock:
+            stats = self._stats
+            stats["checkouts"] += 1
+            stats["checked_out"] += 1
+            stats["max_checked_out"] = max(stats["max_checked_out"], stats["checked_out"])
+            stats["wait_time_total"] += waited
+            stats["wait_time_max"] = max(stats["wait_time_max"], waited)
+        return conn
+
+    def putconn(self, conn, close=False):
+        try:
+            if not close and not conn.closed:
+                # Не возвращаем в пул соединение с незавершённой транзакцией
+                if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            close = close or bool(conn.closed)
+        except psycopg2.Error:
+            close = True
+        finally:
+            if close:
+                self._close(conn)
+            with self._lock:
+                self._stats["checked_out"] -= 1
+                if not close:
+                    self._idle.append((conn, time.monotonic()))
+            self._slots.release()
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _is_alive(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["maxconn"] = self.maxconn
+        stats["wait_time_avg"] = stats["wait_time_total"] / stats["checkouts"] if stats["checkouts"] else 0.0
+        return stats
+
+    def closeall(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._close(conn)
+
+
+# Пул создаётся один раз на процесс: модуль импортируется Streamlit единожды,
+# поэтому он переживает перезапуски скрипта и общий для всех сессий.
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DB_CONFIG, **POOL_CONFIG)
+    return _pool
+
+
+# Чтение своих записей. Сессия пользователя (в Streamlit — словарь из session_state,
+# см. bind_session) хранит позицию WAL своей последней записи, и чтение с реплики
+# выполняется, только если реплика её уже воспроизвела. Кроме того, есть общая для
+# процесса нижняя граница — её сдвигает слушатель уведомлений каталога (cache.py),
+# чтобы кэш не заполнился с реплики данными старше сброшенных.
+_session = contextvars.ContextVar("db_session", default=None)
+_read_floor = [0]
+
+
+def bind_session(state):
+    _session.set(state)
+
+
+def parse_lsn(text):
+    high, low = text.split("/")
+    return (int(high, 16) << 32) | int(low, 16)
+
+
+def advance_read_lsn(lsn_text):
+    _read_floor[0] = max(_read_floor[0], parse_lsn(lsn_text))
+
+
+def _remember_write(conn):
+    state = _session.get()
+    if state is None:
+        return
+    _count_round_trips()
+    with extensions.cursor(conn) as cur:
+        cur.execute("SELECT pg_current_wal_insert_lsn()")
+        lsn = parse_lsn(cur.fetchone()[0])
+    state["lsn"] = max(state.get("lsn", 0), lsn)
+
+
+def _required_lsn():
+    state = _session.get()
+    return max(_read_floor[0], state.get("lsn", 0) if state else 0)
+
+
+_REPLICA_STATUS_QUERY = """
+    SELECT pg_is_in_recovery(), pg_last_wal_replay_lsn()::text,
+           CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+           END
+"""
+
+
+# Реплика с собственным пулом соединений и последним известным состоянием.
+# Отставание считается по времени последней воспроизведённой транзакции, только
+# если есть полученный, но ещё не воспроизведённый WAL (иначе реплика просто простаивает).
+class Replica:
+    def __init__(self, address):
+        host, _, port = address.rpartition(":") if ":" in address else (address, "", "")
+        self.name = address
+        self.config = dict(DB_CONFIG, host=host, port=port or DB_CONFIG["port"])
+        self.pool = None
+        self.healthy = True
+        self.lag = None
+        self.replay_lsn = 0
+        self.checked_at = None
+        self.error = None
+        self.reads = 0
+        self._lock = threading.Lock()
+
+    def get_pool(self):
+        if self.pool is None:
+            with self._lock:
+                if self.pool is None:
+                    self.pool = ConnectionPool(self.config, **POOL_CONFIG)
+        return self.pool
+
+    def due_for_check(self):
+        return self.checked_at is None or time.monotonic() - self.checked_at >= REPLICA_CONFIG["check_interval"]
+
+    def mark_down(self, error):
+        self.healthy = False
+        self.error = str(error).strip()
+        self.checked_at = time.monotonic()
+
+    def refresh(self, conn):
+        _count_round_trips()
+        with extensions.cursor(conn) as cur:
+            cur.execute(_REPLICA_STATUS_QUERY)
+            in_recovery, replay_lsn, lag = cur.fetchone()
+        self.checked_at = time.monotonic()
+        if not in_recovery:
+            # Повышенная до основного реплика больше не получает изменений
+            self.mark_down("сервер не в режиме реплики")
+            return
+        self.replay_lsn = parse_lsn(replay_lsn) if replay_lsn else 0
+        self.lag = float(lag or 0)
+        self.healthy = self.lag <= REPLICA_CONFIG["max_lag"]
+        self.error = None if self.healthy else f"отставание {self.lag:.1f} с"
+
+    # Ждёт, пока реплика воспроизведёт WAL до позиции lsn, не дольше REPLICA_CONFIG["wait"]
+    def catch_up(self, conn, lsn):
+        if lsn <= self.replay_lsn:
+            return True
+        deadline = time.monotonic() + REPLICA_CONFIG["wait"]
+        with extensions.cursor(conn) as cur:
+            while True:
+                _count_round_trips()
+                cur.execute("SELECT pg_last_wal_replay_lsn()::text")
+                replay_lsn = cur.fetchone()[0]
+                self.replay_lsn = max(self.replay_lsn, parse_lsn(replay_lsn) if replay_lsn else 0)
+                if lsn <= self.replay_lsn:
+                    return True
+                if time.monotonic() >= deadline:
+                    return False
+                time.sleep(0.01)
+
+    def stats(self):
+        return {
+            "replica": self.name,
+            "healthy": self.healthy,
+            "lag": self.lag,
+            "error": self.error,
+            "reads": self.reads,
+        }
+
+
+_replicas = [Replica(address) for address in REPLICA_HOSTS]
+_next_replica = [0]
+_routing = {"fallbacks": 0}
+
+
+# Соединение с подходящей репликой: доступной, с допустимым отставанием и догнавшей
+# позицию required_lsn. Реплики перебираются по кругу; None — читать с основного.
+def _replica_connection(required_lsn):
+    start = _next_replica[0] = (_next_replica[0] + 1) % len(_replicas)
+    for replica in _replicas[start:] + _replicas[:start]:
+        if not replica.healthy and not replica.due_for_check():
+            continue
+        try:
+            replica_pool = replica.get_pool()
+            conn = replica_pool.getconn()
+        except PoolTimeout:
+            continue
+        except psycopg2.Error as e:
+            replica.mark_down(e)
+            continue
+        conn.is_replica = True
+        try:
+            if replica.due_for_check():
+                replica.refresh(conn)
+            if replica.healthy and replica.catch_up(conn, required_lsn):
+                replica.reads += 1
+                return replica_pool, conn
+        except psycopg2.Error as e:
+            replica.mark_down(e)
+            replica_pool.putconn(conn, close=True)
+            continue
+        replica_pool.putconn(conn)
+    return None
+
+
+# Выдаёт соединение из пула и возвращает его обратно по выходу из блока.
+# read_only=True — только чтение: при настроенных репликах соединение может быть с реплики.
+# Соединение, на котором произошла ошибка связи, закрывается, а не возвращается в пул.
+@contextmanager
+def get_connection(read_only=False):
+    routed = _replica_connection(_required_lsn()) if read_only and _replicas else None
+    if routed is not None:
+        db_pool, conn = routed
+    else:
+        db_pool = get_pool()
+        conn = db_pool.getconn()
+        if read_only and _replicas:
+            _routing["fallbacks"] += 1
+    conn.read_only = read_only
+    broken = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        db_pool.putconn(conn, close=broken)
+
+
+def pool_stats():
+    if _pool is None:
+        return None
+    return _pool.stats()
+
+
+# Распределение чтений: сколько ушло на реплики, сколько пришлось читать с основного
+def routing_stats():
+    if not _replicas:
+        return None
+    return {
+        "fallbacks": _routing["fallbacks"],
+        "replicas": [replica.stats() for replica in _replicas],
+    }
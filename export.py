@@ -0,0 +1,198 @@
+import gzip
+import os
+import tempfile
+import time
+from datetime import timedelta
+
+from psycopg2 import extensions
+
+from db import get_connection
+
+# Потоковая выгрузка заказов, позиций заказов и сводки по покупателям за период.
+# CSV пишется командой COPY ... TO STDOUT: сервер отдаёт строки потоком, и они сразу
+# уходят в файл. Parquet читается серверным (именованным) курсором пачками по
+# EXPORT_CHUNK_ROWS строк, каждая пачка — отдельная группа строк файла.
+# В памяти процесса в любой момент не больше одной пачки, сколько бы строк ни было в выгрузке.
+EXPORT_CHUNK_ROWS = int(os.environ.get("EXPORT_CHUNK_ROWS", "50000"))
+EXPORT_DIR = os.environ.get("EXPORT_DIR", os.path.join(tempfile.gettempdir(), "shop_exports"))
+# Готовые файлы старше этого срока удаляются при подготовке новой выгрузки
+EXPORT_MAX_AGE_SECONDS = 3600
+FORMATS = {"csv": "text/csv", "csv.gz": "application/gzip", "parquet": "application/vnd.apache.parquet"}
+
+
+class ExportError(Exception):
+    pass
+
+
+# Набор данных: запрос (условие периода подставляется вместо {period}),
+# колонка (или колонки), по которой отбирается период, и типы колонок для Parquet
+DATASETS = {
+    "orders": {
+        "title": "Заказы",
+        "query": """
+            SELECT o.orderid, o.orderdate, o.userid, u.username, o.orderstatus, o.totalamount
+            FROM orders o
+            JOIN users u ON u.userid = o.userid
+            {period}
+            ORDER BY o.orderdate, o.orderid
+        """,
+        "period_column": "o.orderdate",
+        "columns": [("orderid", "int"), ("orderdate", "timestamp"), ("userid", "int"),
+                    ("username", "text"), ("orderstatus", "text"), ("totalamount", "money")],
+    },
+    "order_lines": {
+        "title": "Позиции заказов",
+        "query": """
+            SELECT o.orderid, o.orderdate, o.userid, d.orderdetailid, d.productid,
+                   p.name AS productname, d.quantity, d.price, d.quantity * d.price AS amount
+            FROM orders o
+            JOIN orderdetails d ON d.orderid = o.orderid AND d.orderdate = o.orderdate
+            LEFT JOIN products p ON p.productid = d.productid
+            {period}
+            ORDER BY o.orderdate, o.orderid, d.orderdetailid
+        """,
+        # Период отбирается и по позициям: обе таблицы читают только секции периода
+        "period_column": ("o.orderdate", "d.orderdate"),
+        "columns": [("orderid", "int"), ("orderdate", "timestamp"), ("userid", "int"),
+                    ("orderdetailid", "int"), ("productid", "int"), ("productname", "text"),
+                    ("quantity", "int"), ("price", "money"), ("amount", "money")],
+    },
+    # Те же данные, что на странице «Анализ заказов»: доставленные заказы из DailySalesRollup
+    "user_summary": {
+        "title": "Сводка по покупателям",
+        "query": """
+            SELECT s.userid, u.username, s.total_orders, s.total_amount
+            FROM (
+                SELECT r.userid, SUM(r.orderscount)::bigint AS total_orders,
+                       SUM(r.totalamount) AS total_amount
+                FROM dailysalesrollup r
+                {period}
+                GROUP BY r.userid
+                HAVING SUM(r.orderscount) > 0
+            ) s
+            LEFT JOIN users u ON u.userid = s.userid
+            ORDER BY s.total_amount DESC, s.userid
+        """,
+        "period_column": "r.day",
+        "columns": [("userid", "int"), ("username", "text"), ("total_orders", "bigint"),
+                    ("total_amount", "money")],
+    },
+}
+
+
+# Запрос набора данных за период (даты включительно, пустая граница не ограничивает)
+def dataset_query(dataset, date_from=None, date_to=None):
+    spec = DATASETS[dataset]
+    columns = spec["period_column"]
+    if isinstance(columns, str):
+        columns = (columns,)
+    conditions = []
+    params = []
+    for column in columns:
+        if date_from:
+            conditions.append(f"{column} >= %s")
+            params.append(date_from)
+        if date_to:
+            conditions.append(f"{column} < %s")
+            params.append(date_to + timedelta(days=1))
+    period = "WHERE " + " AND ".join(conditions) if conditions else ""
+    return spec["query"].format(period=period), tuple(params)
+
+
+def detect_format(filename):
+    for fmt in sorted(FORMATS, key=len, reverse=True):
+        if filename.lower().endswith("." + fmt):
+            return fmt
+    return "csv"
+
+
+def file_name(dataset, fmt, date_from=None, date_to=None):
+    period = f"{date_from or 'начало'}_{date_to or 'конец'}"
+    return f"{dataset}_{period}.{fmt}"
+
+
+def _write_csv(conn, query, params, output):
+    with conn.cursor() as cur:
+        # COPY не принимает параметры, поэтому значения подставляются на клиенте
+        sql = cur.mogrify(query, params)
+        cur.copy_expert(b"COPY (" + sql + b") TO STDOUT WITH (FORMAT csv, HEADER)", output)
+        return cur.rowcount
+
+
+def _parquet_schema(pa, columns):
+    types = {
+        "int": pa.int32(),
+        "bigint": pa.int64(),
+        "text": pa.string(),
+        "timestamp": pa.timestamp("us"),
+        "money": pa.decimal128(16, 2),
+    }
+    return pa.schema([(name, types[kind]) for name, kind in columns])
+
+
+def _write_parquet(conn, query, params, columns, output):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ExportError("Для выгрузки в Parquet нужен пакет pyarrow")
+
+    schema = _parquet_schema(pa, columns)
+    rows_written = 0
+    with pq.ParquetWriter(output, schema, compression="zstd") as writer, \
+            conn.cursor(name="export_cursor", cursor_factory=extensions.cursor) as cur:
+        cur.execute(query, params)
+        while True:
+            rows = cur.fetchmany(EXPORT_CHUNK_ROWS)
+            if not rows:
+                break
+            arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            rows_written += len(rows)
+    return rows_written
+
+
+# Выгрузка набора данных за период в двоичный файловый объект output;
+# возвращает число строк. Читается с реплики, если она есть (db.get_connection).
+def export(dataset, fmt, output, date_from=None, date_to=None):
+    if dataset not in DATASETS:
+        raise ExportError(f"Неизвестный набор данных: {dataset}")
+    if fmt not in FORMATS:
+        raise ExportError(f"Неизвестный формат: {fmt}")
+    query, params = dataset_query(dataset, date_from, date_to)
+    with get_connection(read_only=True) as conn:
+        try:
+            if fmt == "parquet":
+                return _write_parquet(conn, query, params, DATASETS[dataset]["columns"], output)
+            if fmt == "csv.gz":
+                with gzip.GzipFile(fileobj=output, mode="wb", compresslevel=6) as compressed:
+                    return _write_csv(conn, query, params, compressed)
+            return _write_csv(conn, query, params, output)
+        finally:
+            conn.rollback()
+
+
+def _remove_stale_files():
+    limit = time.time() - EXPORT_MAX_AGE_SECONDS
+    for name in os.listdir(EXPORT_DIR):
+        path = os.path.join(EXPORT_DIR, name)
+        try:
+            if os.path.getmtime(path) < limit:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+# Выгрузка во временный файл в EXPORT_DIR (для скачивания со страниц администратора);
+# возвращает путь к файлу и число строк. Недописанный файл удаляется.
+def export_to_file(dataset, fmt, date_from=None, date_to=None):
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    _remove_stale_files()
+    fd, path = tempfile.mkstemp(prefix=f"{dataset}_", suffix="." + fmt, dir=EXPORT_DIR)
+    try:
+        with os.fdopen(fd, "wb") as output:
+            rows = export(dataset, fmt, output, date_from, date_to)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, rows
@@ -0,0 +1,122 @@
+import base64
+import binascii
+import hashlib
+import io
+import os
+
+from PIL import Image
+from psycopg2.extras import execute_values
+
+from db import get_connection
+
+# Локальное хранилище изображений, адресуемое по SHA-256 содержимого.
+# В Products.ImageURL хранится только короткая ссылка вида "img:<sha256>".
+IMAGE_STORE_DIR = os.environ.get("IMAGE_STORE_DIR", "image_store")
+IMAGE_REF_PREFIX = "img:"
+THUMBNAIL_SIZES = (128, 512)
+
+
+def is_image_ref(image_url):
+    return bool(image_url) and image_url.startswith(IMAGE_REF_PREFIX)
+
+
+def _image_dir(digest):
+    return os.path.join(IMAGE_STORE_DIR, digest[:2])
+
+
+def image_path(ref, size=None):
+    digest = ref[len(IMAGE_REF_PREFIX):]
+    name = digest if size is None else f"{digest}_{size}.jpg"
+    return os.path.join(_image_dir(digest), name)
+
+
+# Запись во временный файл и переименование, чтобы читатель не увидел недописанный файл
+def _write_atomic(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _make_thumbnail(image, size):
+    thumbnail = image.copy()
+    thumbnail.thumbnail((size, size))
+    if thumbnail.mode not in ("RGB", "L"):
+        thumbnail = thumbnail.convert("RGB")
+    buffer = io.BytesIO()
+    thumbnail.save(buffer, format="JPEG", quality=85, optimize=True)
+    return buffer.getvalue()
+
+
+# Сохраняет изображение и его миниатюры, возвращает ссылку для ImageURL.
+# Одинаковые картинки хранятся один раз: повторное сохранение ничего не делает.
+def save_image(data):
+    digest = hashlib.sha256(data).hexdigest()
+    ref = IMAGE_REF_PREFIX + digest
+    os.makedirs(_image_dir(digest), exist_ok=True)
+
+    original_path = image_path(ref)
+    if not os.path.exists(original_path):
+        # Проверяем, что это действительно изображение, до записи в хранилище
+        Image.open(io.BytesIO(data)).verify()
+        _write_atomic(original_path, data)
+
+    image = None
+    for size in THUMBNAIL_SIZES:
+        path = image_path(ref, size)
+        if not os.path.exists(path):
+            if image is None:
+                image = Image.open(io.BytesIO(data))
+            _write_atomic(path, _make_thumbnail(image, size))
+    return ref
+
+
+def read_image(ref, size=None):
+    with open(image_path(ref, size), "rb") as f:
+        return f.read()
+
+
+def decode_data_uri(uri):
+    header, _, payload = uri.partition(",")
+    if not header.startswith("data:image/") or not header.endswith(";base64"):
+        raise ValueError("Ожидался data URI изображения в base64")
+    return base64.b64decode(payload, validate=False)
+
+
+# Выносит встроенные data URI из Products.ImageURL в хранилище изображений.
+# Товары обрабатываются пачками по productid, каждая пачка в своей транзакции,
+# поэтому миграцию можно прервать и запустить заново.
+def migrate_inline_images(batch_size=100, log=print):
+    migrated = failed = 0
+    last_id = 0
+    while True:
+        with get_connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                SELECT productid, imageurl FROM products
+                WHERE productid > %s AND imageurl LIKE 'data:%%'
+                ORDER BY productid
+                LIMIT %s
+            """, (last_id, batch_size))
+            rows = cur.fetchall()
+            if not rows:
+                break
+
+            updates = []
+            for product_id, image_url in rows:
+                try:
+                    updates.append((product_id, save_image(decode_data_uri(image_url))))
+                except (ValueError, binascii.Error, OSError) as e:
+                    failed += 1
+                    log(f"Товар {product_id}: не удалось перенести изображение: {e}")
+
+            if updates:
+                execute_values(cur, """
+                    UPDATE products AS p SET imageurl = v.ref
+                    FROM (VALUES %s) AS v(productid, ref)
+                    WHERE p.productid = v.productid
+                """, updates)
+            conn.commit()
+            migrated += len(updates)
+            last_id = rows[-1][0]
+            log(f"Перенесено изображений: {migrated}")
+    return migrated, failed
@@ -0,0 +1,213 @@
+import csv
+import io
+import itertools
+import json
+from decimal import Decimal, InvalidOperation
+
+from db import get_connection
+
+# Потоковый импорт товаров из JSON-массива, JSON Lines или CSV.
+# Файл читается по частям, строки проверяются пачками и пачками же загружаются
+# через COPY во временную таблицу, откуда одним INSERT ... SELECT попадают в products.
+# Отклонённые строки с причиной пишутся в CSV-файл ошибок.
+BATCH_SIZE = 5000
+READ_CHUNK_SIZE = 1 << 16
+MAX_PRICE = Decimal("99999999.99")  # NUMERIC(10, 2)
+MAX_INT = 2 ** 31 - 1
+
+
+class ImportFormatError(Exception):
+    pass
+
+
+def detect_format(filename):
+    name = filename.lower()
+    if name.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    if name.endswith(".csv"):
+        return "csv"
+    return "json"
+
+
+# Элементы JSON-массива по одному, не читая файл целиком.
+# Элемент принимается, только если после него в буфере уже есть следующий символ
+# (или файл кончился) — иначе число на границе блока можно прочитать не полностью.
+def iter_json_array(stream):
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def skip_whitespace():
+        nonlocal buffer, pos, eof
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos < len(buffer) or eof:
+                return
+            buffer, pos = stream.read(READ_CHUNK_SIZE), 0
+            eof = not buffer
+
+    skip_whitespace()
+    if buffer[pos:pos + 1] != "[":
+        # Не массив: такой файл читается как JSON Lines. Последнюю строку
+        # уже прочитанного блока дочитываем из потока до конца строки.
+        lines = buffer[pos:].splitlines(keepends=True)
+        if lines and not lines[-1].endswith(("\n", "\r")):
+            lines[-1] += stream.readline()
+        yield from iter_json_lines(itertools.chain(lines, stream))
+        return
+    pos += 1
+
+    index = 0
+    expect_value = True
+    while True:
+        skip_whitespace()
+        if pos >= len(buffer):
+            raise ImportFormatError("Неожиданный конец JSON-массива")
+        if buffer[pos] == "]":
+            return
+        if not expect_value:
+            if buffer[pos] != ",":
+                raise ImportFormatError(f"Ожидалась запятая после элемента {index}")
+            pos += 1
+            expect_value = True
+            continue
+
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+                if end < len(buffer) or eof:
+                    break
+            except json.JSONDecodeError as e:
+                if eof:
+                    raise ImportFormatError(f"Ошибка JSON в элементе {index + 1}: {e.msg}") from e
+            chunk = stream.read(READ_CHUNK_SIZE)
+            eof = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+
+        index += 1
+        pos = end
+        expect_value = False
+        yield index, value
+
+
+# Строки JSON Lines; строка с ошибкой разбора отдаётся как ValueError и попадает в отчёт
+def iter_json_lines(lines):
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, ValueError(f"ошибка JSON: {e.msg}")
+
+
+def iter_csv(stream):
+    reader = csv.DictReader(stream)
+    for record in reader:
+        yield reader.line_num, record
+
+
+def iter_records(stream, fmt):
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if fmt == "csv":
+        return iter_csv(text)
+    if fmt == "jsonl":
+        return iter_json_lines(text)
+    return iter_json_array(text)
+
+
+def _int_field(record, key):
+    value = record.get(key)
+    if value is None or value == "":
+        raise ValueError(f"не указано поле {key}")
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError(f"поле {key} должно быть целым числом")
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"поле {key} должно быть целым числом")
+    if not 0 <= number <= MAX_INT:
+        raise ValueError(f"поле {key} вне допустимого диапазона")
+    return number
+
+
+# Проверка одной строки; возвращает кортеж для COPY или бросает ValueError с причиной
+def validate_record(record, category_ids):
+    if not isinstance(record, dict):
+        raise ValueError("ожидался объект с полями товара")
+
+    name = record.get("name")
+    if not isinstance(name, str) or not name.strip():
+        raise ValueError("не указано название")
+    if len(name) > 100:
+        raise ValueError("название длиннее 100 символов")
+
+    description = record.get("description")
+    if description is not None and not isinstance(description, str):
+        raise ValueError("описание должно быть строкой")
+
+    try:
+        price = Decimal(str(record.get("price")))
+    except InvalidOperation:
+        raise ValueError("некорректная цена")
+    if not price.is_finite() or not 0 <= price <= MAX_PRICE:
+        raise ValueError("цена вне допустимого диапазона")
+
+    stock = _int_field(record, "stockquantity")
+    category_id = _int_field(record, "categoryid")
+    if category_id not in category_ids:
+        raise ValueError(f"категория {category_id} не существует")
+
+    return name.strip(), description or None, price, stock, category_id
+
+
+def _copy_batch(cur, rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cur.copy_expert("COPY products_import FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+# Импорт товаров из бинарного потока stream в формате fmt ("json", "jsonl", "csv").
+# errors_out — текстовый файл, куда пишется CSV отклонённых строк.
+# Все принятые строки добавляются одной транзакцией. Возвращает (добавлено, отклонено).
+def import_products(stream, fmt, errors_out, batch_size=BATCH_SIZE):
+    errors_writer = csv.writer(errors_out)
+    errors_writer.writerow(["row", "error", "data"])
+    rejected = 0
+
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT categoryid FROM categories")
+        category_ids = {row[0] for row in cur.fetchall()}
+        cur.execute("""
+            CREATE TEMP TABLE products_import (
+                name TEXT, description TEXT, price NUMERIC(10, 2), stockquantity INT, categoryid INT
+            ) ON COMMIT DROP
+        """)
+
+        batch = []
+        for row_number, record in iter_records(stream, fmt):
+            try:
+                if isinstance(record, Exception):
+                    raise record
+                batch.append(validate_record(record, category_ids))
+            except ValueError as e:
+                rejected += 1
+                data = None if isinstance(record, Exception) else record
+                errors_writer.writerow([row_number, str(e), json.dumps(data, ensure_ascii=False, default=str)])
+                continue
+            if len(batch) >= batch_size:
+                _copy_batch(cur, batch)
+                batch = []
+        if batch:
+            _copy_batch(cur, batch)
+
+        cur.execute("""
+            INSERT INTO products (name, description, price, stockquantity, categoryid)
+            SELECT name, description, price, stockquantity, categoryid FROM products_import
+        """)
+        imported = cur.rowcount
+        conn.commit()
+    return imported, rejected
@@ -1,138 +1,90 @@
+import os
+import tempfile
 from datetime import datetime
 
+import pandas as pd
 import streamlit as st
-import psycopg2
 from psycopg2.extras import RealDictCursor
 
-# Конфигурация подключения к БД
-DB_CONFIG = {
-    "host": "host.docker.internal",
-    "database": "kp_bd",
-    "user": "kp_bd",
-    "password": "kp_bd",
-    "port": "5432",
-}
-
-# Подключение к БД
-def get_db_connection():
-    try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        return conn
-    except Exception as e:
-        st.error(f"Ошибка подключения к базе данных: {e}")
-        return None
+import export
+import images
+import querylog
+from cache import cache_stats, invalidate
+from dal import (ORDER_STATUSES, ORDER_TRANSITIONS, InsufficientStock, add_review, add_to_cart, authenticate,
+                 bulk_update_order_status, checkout_cart, create_user, fetch_cart, fetch_categories,
+                 fetch_order_summary, fetch_orders_count, fetch_orders_page, fetch_product_rating,
+                 fetch_products_page, fetch_reviews_page, insert_category, insert_product, next_products_cursor,
+                 refresh_cart, update_cart, update_products, update_user)
+from db import bind_session, get_connection, pool_stats, routing_stats
+from importer import ImportFormatError, detect_format, import_products
+from prefetch import prefetch
 
 # Инициализация состояния
 if "logged_in" not in st.session_state:
     st.session_state.logged_in = False
     st.session_state.user = None
     st.session_state.role = None
-    st.session_state.cart = {}  # Корзина
+
+
+# Привязка состояния маршрутизации чтений к сессии пользователя (db.bind_session):
+# после своей записи пользователь читает только с реплики, которая её уже получила.
+# Вызывается в начале скрипта и каждого фрагмента — фрагмент перезапускается отдельно.
+def bind_db_session():
+    bind_session(st.session_state.setdefault("db_session", {}))
 
 # Функция логина
 def login(username, password):
-    conn = get_db_connection()
-    if not conn:
-        return False
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT * FROM users
-                WHERE username = %s AND passwordhash = crypt(%s, passwordhash)
-            """, (username, password))
-            user = cur.fetchone()
-            if user:
-                st.session_state.logged_in = True
-                st.session_state.user = user
-                st.session_state.role = user["roleid"]
-                return True
-            else:
-                return False
+        user = authenticate(username, password)
+        if user:
+            st.session_state.logged_in = True
+            st.session_state.user = dict(user)
+            st.session_state.role = user["roleid"]
+            return True
+        else:
+            return False
     except Exception as e:
         st.error(f"Ошибка при входе: {e}")
         return False
-    finally:
-        conn.close()
 
 # Функция регистрации
 def register(username, email, password, role=2):
-    conn = get_db_connection()
-    if not conn:
-        return False
     try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO users (username, email, passwordhash, roleid, registrationdate, isactive)
-                VALUES (%s, %s, crypt(%s, gen_salt('bf')), %s, NOW(), TRUE)
-            """, (username, email, password, role))
-            conn.commit()
-            return True
+        create_user(username, email, password, role)
+        return True
     except Exception as e:
         st.error(f"Ошибка при регистрации: {e}")
         return False
-    finally:
-        conn.close()
 
 # Функция обновления данных профиля
 def update_profile(user_id, username, email):
-    conn = get_db_connection()
-    if not conn:
-        return False
     try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                UPDATE users
-                SET username = %s, email = %s
-                WHERE userid = %s
-            """, (username, email, user_id))
-            conn.commit()
-            st.success("Профиль обновлен.")
+        update_user(user_id, username, email)
+        st.success("Профиль обновлен.")
     except Exception as e:
         st.error(f"Ошибка обновления профиля: {e}")
-    finally:
-        conn.close()
+
 
 # Функция добавления заказа
-def place_order(user_id, cart):
-    conn = get_db_connection()
-    if not conn:
-        return False
+def place_order(user_id):
     try:
-        with conn.cursor() as cur:
-            # Вставка заказа и получение orderid
-            cur.execute("""
-                INSERT INTO orders (userid, orderdate, totalamount, orderstatus)
-                VALUES (%s, NOW(), %s, 'обрабатывается') RETURNING orderid
-            """, (user_id, sum(item['price'] * item['quantity'] for item in cart.values())))
-
-            order_id = cur.fetchone()[0]  # Получаем orderid
-
-            # Вставка деталей заказа
-            for product_id, item in cart.items():
-                cur.execute("""
-                    INSERT INTO orderdetails (orderid, productid, quantity, price)
-                    VALUES (%s, %s, %s, %s)
-                """, (order_id, product_id, item["quantity"], item["price"]))
-
-                cur.execute("""
-                    UPDATE products
-                    SET stockquantity = stockquantity - %s
-                    WHERE productid = %s AND stockquantity >= %s
-                """, (item["quantity"], product_id, item["quantity"]))
-
-            # Завершаем транзакцию
-            conn.commit()
-            st.success("Заказ успешно оформлен!")
-            return True
+        order_id, total = checkout_cart(user_id)
+        st.success(f"Заказ №{order_id} успешно оформлен! Сумма: {total}₽")
+        return True
+    except InsufficientStock as e:
+        st.error("Недостаточно товара на складе, заказ не оформлен:")
+        for item in e.shortages:
+            name = item["name"] or f"Товар №{item['productid']}"
+            st.write(f"{name}: в корзине {item['requested']} шт., доступно {item['available']} шт.")
+        return False
     except Exception as e:
-        conn.rollback()  # Откат транзакции в случае ошибки
         st.error(f"Ошибка оформления заказа: {e}")
         return False
-    finally:
-        conn.close()
+
 
 # Основная функция
 def main():
+    bind_db_session()
     if not st.session_state.logged_in:
         st.title("Добро пожаловать!")
         st.subheader("Вход или регистрация")
@@ -161,196 +113,393 @@ def main():
         role = st.session_state.role
         st.sidebar.title("Навигация")
         if role == 1:  # Админ
-            page = st.sidebar.selectbox("Страницы", ["Товары", "Добавить товар", "Добавить категорию", "Заказы", "Анализ заказов", "Аккаунт"])
+            page = st.sidebar.selectbox("Страницы", ["Товары", "Добавить товар", "Добавить категорию", "Заказы", "Анализ заказов", "Производительность", "Аккаунт"])
         else:
             page = st.sidebar.selectbox("Страницы", ["Товары", "Корзина", "Мои заказы", "Мой профиль"])
 
         st.sidebar.button("Выйти", on_click=lambda: st.session_state.update({"logged_in": False, "user": None}))
 
-        if page == "Товары":
-            view_products(role)
-        elif page == "Корзина":
-            view_cart()
-        elif page == "Мои заказы" or page == "Заказы":
-            view_orders(role)
-        elif page == "Мой профиль" or page == "Аккаунт":
-            view_account()
-        elif page == "Добавить товар" and role == 1:
-            add_product()
-        elif page == "Добавить категорию" and role == 1:
-            add_category()
-        elif page == "Анализ заказов" and role == 1:
-            view_user_order_summary()
+        if role == 1:
+            stats = pool_stats()
+            if stats:
+                with st.sidebar.expander("Соединения с БД"):
+                    st.write(f"Выдано сейчас: {stats['checked_out']} из {stats['maxconn']}")
+                    st.write(f"Максимум одновременно: {stats['max_checked_out']}")
+                    st.write(f"Ожидание пула: среднее {stats['wait_time_avg'] * 1000:.1f} мс, "
+                             f"максимум {stats['wait_time_max'] * 1000:.1f} мс")
+                    st.write(f"Переподключений: {stats['reconnects']}, таймаутов: {stats['timeouts']}")
+            stats = cache_stats()
+            with st.sidebar.expander("Кэш каталога"):
+                st.write(f"Попаданий: {stats['hits']}, промахов: {stats['misses']} ({stats['hit_ratio']:.0%})")
+                st.write(f"Записей: {stats['entries']} из {stats['max_entries']}, вытеснено: {stats['evictions']}")
+                st.write(f"Сброшено по изменениям: {stats['invalidations']}")
+                st.write("Уведомления: " + ("подключены" if stats["listening"] else "нет соединения, кэш отключён"))
+
+        with querylog.page_run(page):
+            if page == "Товары":
+                view_products(role)
+            elif page == "Корзина":
+                view_cart()
+            elif page == "Мои заказы" or page == "Заказы":
+                view_orders(role)
+            elif page == "Мой профиль" or page == "Аккаунт":
+                view_account()
+            elif page == "Добавить товар" and role == 1:
+                add_product()
+            elif page == "Добавить категорию" and role == 1:
+                add_category()
+            elif page == "Анализ заказов" and role == 1:
+                view_user_order_summary()
+            elif page == "Производительность" and role == 1:
+                view_performance()
+
+PAGE_SIZES = [10, 25, 50, 100]
+CATALOG_SORTS = {"id": "По умолчанию", "rating": "По рейтингу"}
+MIN_RATINGS = [None, 3, 4, 4.5]
+
+
+# Состояние постраничной навигации: стек курсоров начала уже открытых страниц.
+# При смене фильтров навигация сбрасывается на первую страницу.
+def page_cursors(key, filters):
+    state = st.session_state.get(key)
+    if state is None or state["filters"] != filters:
+        state = {"filters": filters, "cursors": [None]}
+        st.session_state[key] = state
+    return state["cursors"]
+
+
+def next_page(key, cursor):
+    st.session_state[key]["cursors"].append(cursor)
+
+
+def previous_page(key):
+    cursors = st.session_state[key]["cursors"]
+    if len(cursors) > 1:
+        cursors.pop()
+
+
+def page_navigation(key, has_next, next_cursor):
+    cursors = st.session_state[key]["cursors"]
+    col_prev, col_page, col_next = st.columns([1, 2, 1])
+    col_prev.button("← Назад", key=f"{key}_prev", disabled=len(cursors) == 1,
+                    on_click=previous_page, args=(key,))
+    col_page.write(f"Страница {len(cursors)}")
+    col_next.button("Вперёд →", key=f"{key}_next", disabled=not has_next,
+                    on_click=next_page, args=(key, next_cursor))
+
+
+# Миниатюры неизменяемы (адресуются хэшем содержимого), поэтому их можно кэшировать без срока
+@st.cache_data(max_entries=2000, show_spinner=False)
+def thumbnail_bytes(ref, size):
+    return images.read_image(ref, size)
+
+
+def show_product_image(image_url, size=128):
+    try:
+        if images.is_image_ref(image_url):
+            st.image(thumbnail_bytes(image_url, size), width=size)
+        elif image_url and image_url.startswith(("http://", "https://")):
+            st.image(image_url, width=size)
+    except OSError:
+        pass
+
 
 # Отображение товаров
 # Функция просмотра товаров с поиском и фильтрацией
 def view_products(role):
     st.title("Список товаров")
-
-    conn = get_db_connection()
-    if not conn:
-        return
-
-    try:
-        # Выполнить запрос на получение всех категорий
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT categoryid, categoryname FROM categories")
-            categories = cur.fetchall()
-
-        # Поле для поиска
-        search_query = st.text_input("Поиск товара", placeholder="Введите название товара...")
-
-        # Выпадающий список для выбора категории
-        category_options = {}
-        category_options["Все категории"] = None
-        for category in categories:
-            category_options[category["categoryname"]] = category["categoryid"]
-
-        selected_category = st.selectbox("Выберите категорию", list(category_options.keys()))
-
-        # Формируем SQL-запрос на основе фильтров
-        query = "SELECT * FROM products WHERE 1=1"
-        params = []
-
-        if search_query:
-            query += " AND (LOWER(name) LIKE %s or LOWER(name) LIKE fix_mistake_search(%s))"
-            params.append(f"%{search_query.lower()}%")
-            params.append(f"%{search_query.lower()}%")
-
-        if category_options[selected_category]:
-            query += " AND categoryid = %s"
-            params.append(category_options[selected_category])
-
-        # Получение товаров из базы данных
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(query, tuple(params))
-            products = cur.fetchall()
-
-        # Отображение товаров
-        for product in products:
-            st.write(f"**{product['name']}** - {product['price']}₽")
-            st.write(f"Описание: {product['description']}")
-            st.write(f"На складе: {product['stockquantity']} шт.")
-
-            if role == 1:  # Администратор
-                if "editing" not in st.session_state:
-                    st.session_state.editing = None
-
-                if st.button("Удалить", key=f"delete_{product['productid']}"):
-                    delete_product(product['productid'])
-                    st.rerun()
-
-                # Если нажата кнопка "Редактировать"
-                if st.button("Редактировать", key=f"edit_{product['productid']}"):
-                    st.session_state.editing = product['productid']
-                    st.session_state.new_name = product['name']
-                    st.session_state.new_price = float(product['price'])
-                    st.session_state.new_stock = int(product['stockquantity'])
-
-                # Если текущий продукт редактируется
-                if st.session_state.editing == product['productid']:
-                    new_name = st.text_input("Название", value=st.session_state.new_name,
-                                             key=f"name_{product['productid']}")
-                    new_price = st.number_input(
-                        "Цена", value=st.session_state.new_price, min_value=0.0, key=f"price_{product['productid']}"
-                    )
-                    new_stock = st.number_input(
-                        "Количество на складе", value=st.session_state.new_stock, min_value=0,
-                        key=f"stock_{product['productid']}"
-                    )
-
-                    # Сохраняем новые значения в session_state
-                    st.session_state.new_name = new_name
-                    st.session_state.new_price = new_price
-                    st.session_state.new_stock = new_stock
-
-                    # Кнопка "Сохранить изменения"
-                    if st.button("Сохранить изменения продукта", key=f"save_{product['productid']}"):
-                        update_product(product['productid'], new_name, new_price, new_stock)
-                        # Сбрасываем режим редактирования
-                        st.session_state.editing = None
-                        # st.rerun()  # Перезапускаем страницу для обновления
-            else:  # Обычный пользователь
-                quantity = st.number_input(
-                    f"Количество для {product['name']}", min_value=1, max_value=product['stockquantity'], step=1,
-                    key=f"qty_{product['productid']}"
-                )
-                if st.button("Добавить в корзину", key=f"add_{product['productid']}"):
-                    add_to_cart(product, quantity)
-                    st.success(f"{product['name']} добавлен в корзину!")
-    except Exception as e:
-        st.error(f"Ошибка загрузки товаров: {e}")
-    finally:
-        conn.close()
-
-
-# Вспомогательная функция для удаления продукта (для администратора)
-def delete_product(product_id):
-    conn = get_db_connection()
-    if not conn:
+    catalog_fragment(role)
+
+
+# Каталог — отдельный фрагмент: поиск, листание и действия с таблицей
+# перезапускают только его, а не весь скрипт со страницей и боковой панелью.
+# Товары страницы выводятся одной таблицей вместо набора виджетов на каждый товар.
+@st.fragment
+@querylog.fragment_run("Товары: каталог")
+def catalog_fragment(role):
+    bind_db_session()
+    # Значения фильтров берутся из состояния виджетов ещё до их отрисовки,
+    # поэтому категории и страница товаров загружаются одновременно
+    search_query = st.session_state.get("catalog_search", "").strip()
+    category_id = st.session_state.get("catalog_category")
+    page_size = st.session_state.get("catalog_page_size", PAGE_SIZES[0])
+    sort = st.session_state.get("catalog_sort", "id")
+    min_rating = st.session_state.get("catalog_min_rating")
+    cursors = page_cursors("catalog_page", (search_query, category_id, page_size, sort, min_rating))
+    results = prefetch(
+        categories=fetch_categories,
+        products=lambda: fetch_products_page(search_query, category_id, cursors[-1], page_size, sort, min_rating),
+    )
+
+    # Поле для поиска
+    st.text_input("Поиск товара", key="catalog_search", placeholder="Введите название товара...")
+
+    # Выпадающий список для выбора категории
+    category_names = {category["categoryid"]: category["categoryname"]
+                      for category in results["categories"].value or []}
+    col_category, col_size = st.columns([3, 1])
+    col_category.selectbox("Выберите категорию", [None] + list(category_names), key="catalog_category",
+                           format_func=lambda cid: "Все категории" if cid is None
+                           else category_names.get(cid, f"Категория №{cid}"))
+    col_size.selectbox("Товаров на странице", PAGE_SIZES, key="catalog_page_size")
+    col_sort, col_rating = st.columns([3, 1])
+    col_sort.selectbox("Сортировка", list(CATALOG_SORTS), key="catalog_sort", format_func=CATALOG_SORTS.get)
+    col_rating.selectbox("Рейтинг", MIN_RATINGS, key="catalog_min_rating",
+                         format_func=lambda rating: "Любой" if rating is None else f"от {rating}")
+
+    if not results["categories"].ok:
+        st.error(f"Ошибка загрузки категорий: {results['categories'].error}")
+    if not results["products"].ok:
+        st.error(f"Ошибка загрузки товаров: {results['products'].error}")
         return
+    products, has_next = results["products"].value
 
-    try:
-        with conn.cursor() as cur:
-            cur.execute("DELETE FROM products WHERE productid = %s", (product_id,))
-            conn.commit()
-            st.success("Продукт успешно удалён!")
-    except Exception as e:
-        st.error(f"Ошибка удаления продукта: {e}")
-    finally:
-        conn.close()
+    if not products:
+        st.write("Товары не найдены.")
+    else:
+        # Ключ таблицы зависит от страницы и версии, чтобы правки не переносились между страницами
+        version = st.session_state.setdefault("catalog_grid_version", 0)
+        grid_key = f"catalog_grid_{version}_{hash((search_query, category_id, page_size, sort, min_rating, cursors[-1]))}"
+        if role == 1:  # Администратор
+            admin_products_grid(products, grid_key)
+        else:  # Обычный пользователь
+            customer_products_grid(products, grid_key)
+        show_product_photo(products)
+        product_reviews(products, role)
+
+    page_navigation("catalog_page", has_next, next_products_cursor(search_query, cursors[-1], products, sort))
+
+
+def rating_text(avg_rating, rating_count):
+    if not rating_count:
+        return "—"
+    return f"★ {avg_rating:.1f} ({rating_count})"
+
+
+def products_frame(products, extra_columns):
+    frame = pd.DataFrame(
+        [{
+            "productid": product["productid"],
+            "Товар": product["name"],
+            "Цена": float(product["price"]),
+            "На складе": product["stockquantity"],
+            "Рейтинг": rating_text(product["avgrating"], product["ratingcount"]),
+            "Описание": product["description"],
+            **extra_columns,
+        } for product in products]
+    )
+    return frame.set_index("productid")
+
+
+def customer_products_grid(products, grid_key):
+    edited = st.data_editor(
+        products_frame(products, {"Количество": 0}),
+        key=grid_key,
+        hide_index=True,
+        disabled=["Товар", "Цена", "На складе", "Рейтинг", "Описание"],
+        column_config={
+            "Цена": st.column_config.NumberColumn(format="%.2f ₽"),
+            "Количество": st.column_config.NumberColumn(min_value=0, step=1, required=True),
+        },
+    )
+    if st.button("Добавить выбранное в корзину"):
+        by_id = {product["productid"]: product for product in products}
+        quantities = {}
+        for product_id, quantity in edited["Количество"].items():
+            quantity = int(quantity or 0)
+            if quantity <= 0:
+                continue
+            product = by_id[product_id]
+            if quantity > product["stockquantity"]:
+                st.error(f"{product['name']}: на складе только {product['stockquantity']} шт.")
+                return
+            quantities[product_id] = quantity
+        if not quantities:
+            st.warning("Укажите количество хотя бы для одного товара.")
+            return
+        try:
+            add_to_cart(st.session_state.user["userid"], quantities)
+        except Exception as e:
+            st.error(f"Ошибка добавления в корзину: {e}")
+            return
+        st.session_state.catalog_grid_version += 1
+        st.toast(f"Добавлено в корзину: {', '.join(by_id[product_id]['name'] for product_id in quantities)}")
+        st.rerun(scope="fragment")
+
+
+def admin_products_grid(products, grid_key):
+    original = products_frame(products, {"Удалить": False})
+    edited = st.data_editor(
+        original,
+        key=grid_key,
+        hide_index=True,
+        disabled=["Рейтинг", "Описание"],
+        column_config={
+            "Товар": st.column_config.TextColumn(required=True, max_chars=100),
+            "Цена": st.column_config.NumberColumn(min_value=0.0, format="%.2f ₽", required=True),
+            "На складе": st.column_config.NumberColumn(min_value=0, step=1, required=True),
+        },
+    )
+    if st.button("Сохранить изменения"):
+        deleted_ids = [int(product_id) for product_id in edited.index[edited["Удалить"]]]
+        changed = edited[["Товар", "Цена", "На складе"]].ne(original[["Товар", "Цена", "На складе"]]).any(axis=1)
+        kept = edited[changed & ~edited["Удалить"]]
+        changes = [(int(product_id), row["Товар"], row["Цена"]) for product_id, row in kept.iterrows()]
+        stock_changes = [
+            (int(product_id), int(row["На складе"]))
+            for product_id, row in kept.iterrows()
+            if row["На складе"] != original.loc[product_id, "На складе"]
+        ]
+        if not changes and not deleted_ids:
+            st.info("Изменений нет.")
+        elif save_product_changes(changes, deleted_ids, stock_changes):
+            st.session_state.catalog_grid_version += 1
+            st.toast(f"Сохранено: изменено {len(changes)}, удалено {len(deleted_ids)}")
+            st.rerun(scope="fragment")
+
+
+def show_product_photo(products):
+    with_images = {product["name"]: product["imageurl"] for product in products if product["imageurl"]}
+    if with_images:
+        with st.expander("Фото товаров"):
+            name = st.selectbox("Товар", list(with_images.keys()))
+            show_product_image(with_images[name], size=512)
+
+
+REVIEWS_PAGE_SIZE = 10
+
+
+# Отзывы о товаре со страницы каталога: распределение оценок из агрегатов,
+# постраничный список отзывов и форма нового отзыва для покупателя
+def product_reviews(products, role):
+    names = {product["productid"]: product["name"] for product in products}
+    with st.expander("Отзывы о товаре"):
+        product_id = st.selectbox("Товар", list(names), format_func=names.get, key="reviews_product")
+        cursors = page_cursors("reviews_page", product_id)
+        results = prefetch(
+            rating=lambda: fetch_product_rating(product_id),
+            reviews=lambda: fetch_reviews_page(product_id, cursors[-1], REVIEWS_PAGE_SIZE),
+        )
+        if not results["rating"].ok or not results["reviews"].ok:
+            st.error(f"Ошибка загрузки отзывов: {results['rating'].error or results['reviews'].error}")
+            return
+        rating = results["rating"].value
+        reviews, has_next = results["reviews"].value
+
+        if rating and rating["ratingcount"]:
+            st.write(f"Средняя оценка: {rating['avgrating']:.2f} из 5, оценок: {rating['ratingcount']}")
+            st.bar_chart(pd.DataFrame({"Отзывов": rating["histogram"]}, index=["1", "2", "3", "4", "5"]),
+                         height=160)
+        if not reviews:
+            st.write("Отзывов пока нет.")
+        for review in reviews:
+            stars = "★" * review["rating"] if review["rating"] else "без оценки"
+            st.write(f"**{review['username']}** — {stars} — {review['reviewdate']:%d.%m.%Y}")
+            if review["comment"]:
+                st.write(review["comment"])
+        if reviews or len(cursors) > 1:
+            next_cursor = (reviews[-1]["reviewdate"], reviews[-1]["reviewid"]) if reviews else None
+            page_navigation("reviews_page", has_next, next_cursor)
+
+        if role == 1:
+            return
+        with st.form("review_form", clear_on_submit=True):
+            new_rating = st.radio("Оценка", [5, 4, 3, 2, 1], horizontal=True)
+            comment = st.text_area("Отзыв", max_chars=2000)
+            if not st.form_submit_button("Оставить отзыв"):
+                return
+        try:
+            add_review(product_id, st.session_state.user["userid"], new_rating, comment.strip())
+        except Exception as e:
+            st.error(f"Ошибка сохранения отзыва: {e}")
+            return
+        st.toast("Спасибо за отзыв!")
+        st.rerun(scope="fragment")
 
 
-def update_product(product_id, name, price, stock_quantity):
-    conn = get_db_connection()
-    if not conn:
-        return
+def save_product_changes(changes, deleted_ids, stock_changes):
     try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                UPDATE products
-                SET name = %s, price = %s, stockquantity = %s
-                WHERE productid = %s
-            """, (name, price, stock_quantity, product_id))
-            conn.commit()
-            st.success("Товар успешно обновлен!")
+        update_products(changes, deleted_ids, stock_changes)
+        return True
     except Exception as e:
-        st.error(f"Ошибка обновления товара: {e}")
-    finally:
-        conn.close()
-
+        st.error(f"Ошибка сохранения товаров: {e}")
+        return False
 
-# Вспомогательная функция для добавления товара в корзину
-def add_to_cart(product, quantity):
-    if "cart" not in st.session_state:
-        st.session_state.cart = {}
-
-    product_id = product["productid"]
-    if product_id in st.session_state.cart:
-        st.session_state.cart[product_id]["quantity"] += quantity
-    else:
-        st.session_state.cart[product_id] = {
-            "name": product["name"],
-            "price": product["price"],
-            "quantity": quantity,
-        }
 
 # Просмотр корзины
 def view_cart():
     st.title("Корзина")
-    cart = st.session_state.cart
-    if cart:
-        total = 0
-        for product_id, item in cart.items():
-            st.write(f"{item['name']}: {item['quantity']} шт. x {item['price']}₽")
-            total += item['quantity'] * item['price']
-        st.write(f"Итого: {total}₽")
-        if st.button("Оформить заказ"):
-            if place_order(st.session_state.user["userid"], cart):
-                st.session_state.cart = {}
-                st.rerun()
-    else:
+    cart_fragment()
+
+
+@st.fragment
+@querylog.fragment_run("Корзина: корзина")
+def cart_fragment():
+    bind_db_session()
+    user_id = st.session_state.user["userid"]
+    try:
+        items = fetch_cart(user_id)
+    except Exception as e:
+        st.error(f"Ошибка загрузки корзины: {e}")
+        return
+    if not items:
         st.write("Корзина пуста.")
+        return
+
+    version = st.session_state.setdefault("cart_grid_version", 0)
+    edited = st.data_editor(
+        pd.DataFrame([{
+            "productid": item["productid"],
+            "Товар": item["name"],
+            "Цена": float(item["price"]),
+            "Цена при добавлении": float(item["addedprice"]),
+            "На складе": item["stockquantity"],
+            "Количество": item["quantity"],
+        } for item in items]).set_index("productid"),
+        key=f"cart_grid_{version}",
+        hide_index=True,
+        disabled=["Товар", "Цена", "Цена при добавлении", "На складе"],
+        column_config={
+            "Цена": st.column_config.NumberColumn(format="%.2f ₽"),
+            "Цена при добавлении": st.column_config.NumberColumn(format="%.2f ₽"),
+            "Количество": st.column_config.NumberColumn(min_value=0, step=1, required=True),
+        },
+    )
+
+    changed_prices = [item for item in items if item["price"] != item["addedprice"]]
+    shortages = [item for item in items if item["quantity"] > item["stockquantity"]]
+    for item in changed_prices:
+        st.warning(f"{item['name']}: цена изменилась с {item['addedprice']}₽ на {item['price']}₽")
+    for item in shortages:
+        st.error(f"{item['name']}: в корзине {item['quantity']} шт., на складе {item['stockquantity']} шт.")
+    total = sum(item["quantity"] * item["price"] for item in items)
+    st.write(f"Итого по текущим ценам: {total}₽")
+
+    col_save, col_refresh, col_order = st.columns(3)
+    saved = {item["productid"]: item["quantity"] for item in items}
+    changes = {product_id: int(quantity or 0) for product_id, quantity in edited["Количество"].items()
+               if int(quantity or 0) != saved[product_id]}
+    if col_save.button("Сохранить количество", disabled=not changes):
+        try:
+            update_cart(user_id, changes)
+        except Exception as e:
+            st.error(f"Ошибка изменения корзины: {e}")
+            return
+        st.session_state.cart_grid_version += 1
+        st.rerun(scope="fragment")
+    if col_refresh.button("Обновить по каталогу", disabled=not (changed_prices or shortages),
+                          help="Принять текущие цены и уменьшить количество до остатка на складе"):
+        try:
+            refresh_cart(user_id)
+        except Exception as e:
+            st.error(f"Ошибка обновления корзины: {e}")
+            return
+        st.session_state.cart_grid_version += 1
+        st.rerun(scope="fragment")
+    if col_order.button("Оформить заказ", disabled=bool(shortages or changes)):
+        if place_order(user_id):
+            st.rerun()
+
 
 # Управление аккаунтом
 def view_account():
@@ -361,113 +510,191 @@ def view_account():
     if st.button("Сохранить"):
         update_profile(user["userid"], username, email)
 
+
+def show_order_items(order):
+    st.write(f"Дата: {order['orderdate']} - Сумма: {order['totalamount']}₽")
+    for item in order['items']:
+        st.write(
+            f"Продукт: {item['name']} | Количество: {item['quantity']} | Цена за единицу: {item['price']}₽")
+
+
+# Смена статуса заказа перезапускает только этот фрагмент, а не весь список заказов
+@st.fragment
+@querylog.fragment_run("Заказы: смена статуса")
+def order_status_control(order_id, status):
+    bind_db_session()
+    new_status = st.selectbox(f"Изменить статус заказа №{order_id}", ORDER_TRANSITIONS.get(status, ORDER_STATUSES),
+                              key=f"status_{order_id}")
+    if st.button(f"Обновить статус заказа №{order_id}", key=f"update_{order_id}"):
+        try:
+            updated, _ = bulk_update_order_status(new_status, order_ids=[order_id])
+        except Exception as e:
+            st.error(f"Ошибка обновления статуса: {e}")
+            return
+        if updated:
+            st.success(f"Статус заказа №{order_id} обновлён на '{new_status}'")
+        else:
+            st.warning(f"Статус заказа №{order_id} уже изменён, обновите страницу")
+
+
+# Смена статуса сразу у многих заказов: отмеченных на странице или всех по фильтрам.
+# После изменения страница перезапускается, результат показывается над списком.
+def bulk_status_form(orders, filters, count):
+    with st.form("bulk_status"):
+        st.write("**Смена статуса нескольких заказов**")
+        selected = st.multiselect("Заказы на странице", [order["orderid"] for order in orders],
+                                  format_func=lambda order_id: f"№{order_id}")
+        scope = st.radio("Применить к", ["Отмеченным заказам", "Всем заказам по фильтрам"], horizontal=True)
+        new_status = st.selectbox("Новый статус", ORDER_STATUSES)
+        confirmed = st.checkbox(f"Подтверждаю изменение всех заказов по фильтрам ({count})")
+        if not st.form_submit_button("Изменить статус"):
+            return
+    if scope == "Отмеченным заказам" and not selected:
+        st.error("Отметьте заказы.")
+        return
+    if scope == "Всем заказам по фильтрам" and not confirmed:
+        st.error("Подтвердите изменение всех заказов по фильтрам.")
+        return
+    try:
+        if scope == "Отмеченным заказам":
+            updated, skipped = bulk_update_order_status(new_status, order_ids=selected)
+        else:
+            updated, skipped = bulk_update_order_status(new_status, filters=filters)
+    except Exception as e:
+        st.error(f"Ошибка обновления статуса: {e}")
+        return
+    message = f"Статус '{new_status}' установлен у заказов: {updated}."
+    if skipped:
+        message += f" Пропущено (переход не разрешён или статус уже такой): {skipped}."
+    st.session_state.orders_bulk_result = message
+    st.rerun()
+
+
 # Управление заказами
 def view_orders(role):
     st.title("Заказы" if role == 1 else "Мои заказы")
 
-    # Подключаемся к базе данных
-    conn = get_db_connection()
-    if not conn:
+    if role == 1:  # Для администратора
+        search_query = st.text_input("Поиск по номеру заказа", placeholder="Введите номер заказа...").strip()
+        col_status, col_user = st.columns(2)
+        status = col_status.selectbox("Статус", ["Все статусы"] + ORDER_STATUSES)
+        username = col_user.text_input("Пользователь", placeholder="Логин покупателя").strip()
+        col_from, col_to = st.columns(2)
+        date_from = col_from.date_input("Дата с", value=None)
+        date_to = col_to.date_input("Дата по", value=None)
+
+        if search_query and not search_query.isdigit():
+            st.error("Номер заказа должен быть числом.")
+            return
+        filters = {
+            "order_id": int(search_query) if search_query else None,
+            "status": None if status == "Все статусы" else status,
+            "username": username,
+            "date_from": date_from,
+            "date_to": date_to,
+        }
+    else:  # Для обычного пользователя
+        filters = {"user_id": st.session_state.user["userid"]}
+
+    if "orders_bulk_result" in st.session_state:
+        st.success(st.session_state.pop("orders_bulk_result"))
+
+    page_size = st.selectbox("Заказов на странице", PAGE_SIZES)
+    cursors = page_cursors("orders_page", (tuple(filters.items()), page_size))
+    # Страница и число заказов загружаются одновременно на разных соединениях
+    loaders = {"orders": lambda: fetch_orders_page(filters, cursors[-1], page_size)}
+    if role == 1:
+        loaders["count"] = lambda: fetch_orders_count(filters)
+    results = prefetch(**loaders)
+    if not results["orders"].ok:
+        st.error(f"Ошибка загрузки заказов: {results['orders'].error}")
         return
+    orders, has_next = results["orders"].value
+
+    count_text = "?"
+    if "count" in results:
+        if results["count"].ok:
+            count = results["count"].value
+            count_text = f"{'' if count['exact'] else '≈'}{max(count['total'], 0)}"
+            st.write(f"Найдено заказов: {count_text}")
+        else:
+            st.error(f"Ошибка подсчёта заказов: {results['count'].error}")
+    if not orders:
+        st.write("Нет заказов в системе." if role == 1 else "У вас нет заказов.")
+
+    # Выводим информацию по заказам
+    for order in orders:
+        order_id = order['orderid']
+        if role == 1:
+            st.write(f"**Заказ №{order_id}** - Статус: {order['orderstatus']} - Покупатель: {order['username']}")
+            show_order_items(order)
+
+            order_status_control(order_id, order['orderstatus'])
+        else:
+            st.write(f"**Заказ №{order_id}**")
+            show_order_items(order)
 
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            if role == 1:  # Для администратора
-                search_query = st.text_input("Поиск по номеру заказа", placeholder="Введите номер заказа...")
-
-                # Получаем все данные из представления OrderDetailsView
-                # cur.execute("SELECT * FROM OrderDetailsView")
-                if search_query:
-                    cur.execute(f"SELECT * FROM OrderDetailsView WHERE OrderID={search_query}")
-                else:
-                    cur.execute("SELECT * FROM OrderDetailsView")
-                orders = cur.fetchall()
-                if not orders:
-                    st.write("Нет заказов в системе.")
-                # Создаем словарь для хранения заказов по OrderID
-                orders_dict = {}
-                for order in orders:
-                    order_id = order['orderid']
-                    if order_id not in orders_dict:
-                        orders_dict[order_id] = {
-                            'orderdate': order['orderdate'],
-                            'orderstatus': order['orderstatus'],
-                            'totalamount': order['totalamount'],
-                            'items': []
-                        }
-                    orders_dict[order_id]['items'].append({
-                        'productid': order['productid'],
-                        'productname': order['name'],
-                        'quantity': order['quantity'],
-                        'price': order['price']
-                    })
-
-                # Выводим информацию по заказам
-                for order_id, order_info in orders_dict.items():
-                    st.write(f"**Заказ №{order_id}** - Статус: {order_info['orderstatus']}")
-                    st.write(f"Дата: {order_info['orderdate']} - Сумма: {order_info['totalamount']}₽")
-                    for item in order_info['items']:
-                        st.write(
-                            f"Продукт: {item['productname']} | Количество: {item['quantity']} | Цена за единицу: {item['price']}₽")
-
-                    # Возможность изменения статуса заказа
-                    new_status = st.selectbox(f"Изменить статус заказа №{order_id}",
-                                              ["обрабатывается", "доставлен", "отменён"],
-                                              key=f"status_{order_id}")
-                    if st.button(f"Обновить статус заказа №{order_id}", key=f"update_{order_id}"):
-                        cur.execute("""
-                            UPDATE Orders
-                            SET OrderStatus = %s
-                            WHERE OrderID = %s
-                        """, (new_status, order_id))
-                        conn.commit()
-                        st.success(f"Статус заказа №{order_id} обновлён на '{new_status}'")
-
-            else:  # Для обычного пользователя
-                user_id = st.session_state.user["userid"]
-                # Получаем заказы текущего пользователя из представления OrderDetailsView
-                cur.execute("SELECT * FROM OrderDetailsView WHERE UserID = %s", (user_id,))
-                orders = cur.fetchall()
-                if not orders:
-                    st.write("У вас нет заказов.")
-                # Создаем словарь для хранения заказов по OrderID
-                orders_dict = {}
-                for order in orders:
-                    order_id = order['orderid']
-                    if order_id not in orders_dict:
-                        orders_dict[order_id] = {
-                            'orderdate': order['orderdate'],
-                            'orderstatus': order['orderstatus'],
-                            'totalamount': order['totalamount'],
-                            'items': []
-                        }
-                    orders_dict[order_id]['items'].append({
-                        'productid': order['productid'],
-                        'productname': order['name'],
-                        'quantity': order['quantity'],
-                        'price': order['price']
-                    })
-
-                # Выводим информацию по заказам
-                for order_id, order_info in orders_dict.items():
-                    st.write(f"**Заказ №{order_id}**") # - Статус: {order_info['orderstatus']}
-                    st.write(f"Дата: {order_info['orderdate']} - Сумма: {order_info['totalamount']}₽")
-                    for item in order_info['items']:
-                        st.write(
-                            f"Продукт: {item['productname']} | Количество: {item['quantity']} | Цена за единицу: {item['price']}₽")
-
-                    # Ожидание подтверждения или отмены (если администратор этого не сделал)
-                    if order_info['orderstatus'] == 'обрабатывается':
-                        st.warning(f"Ваш заказ №{order_id} ещё обрабатывается.")
-                    elif order_info['orderstatus'] == 'доставлен':
-                        st.success(f"Ваш заказ №{order_id} доставлен.")
-                    elif order_info['orderstatus'] == 'отменён':
-                        st.error(f"Ваш заказ №{order_id} был отменён.")
+            # Ожидание подтверждения или отмены (если администратор этого не сделал)
+            if order['orderstatus'] == 'обрабатывается':
+                st.warning(f"Ваш заказ №{order_id} ещё обрабатывается.")
+            elif order['orderstatus'] == 'доставлен':
+                st.success(f"Ваш заказ №{order_id} доставлен.")
+            elif order['orderstatus'] == 'отменён':
+                st.error(f"Ваш заказ №{order_id} был отменён.")
 
-    except Exception as e:
-        st.error(f"Ошибка загрузки заказов: {e}")
-    finally:
-        conn.close()
+    next_cursor = (orders[-1]['orderdate'], orders[-1]['orderid']) if orders else None
+    page_navigation("orders_page", has_next, next_cursor)
+
+    if role == 1:
+        bulk_status_form(orders, filters, count_text)
+        export_controls("orders_export", ["orders", "order_lines", "user_summary"], date_from, date_to)
+
+
+# Файл больше этого размера скачивается не через страницу, а командой manage.py export:
+# st.download_button держит отдаваемый файл в памяти процесса Streamlit целиком
+EXPORT_DOWNLOAD_MAX_MB = int(os.environ.get("EXPORT_DOWNLOAD_MAX_MB", "200"))
+
+
+def read_file(path):
+    with open(path, "rb") as source:
+        return source.read()
+
+
+# Выгрузка за период страницы: файл готовится потоково (export.py) по кнопке
+# и остаётся доступным для скачивания до следующей подготовки
+def export_controls(key, datasets, date_from, date_to):
+    with st.expander("Выгрузка за период"):
+        col_dataset, col_format = st.columns(2)
+        dataset = col_dataset.selectbox("Данные", datasets, key=f"{key}_dataset",
+                                        format_func=lambda name: export.DATASETS[name]["title"])
+        fmt = col_format.selectbox("Формат", list(export.FORMATS), key=f"{key}_format")
+        if st.button("Подготовить файл", key=f"{key}_prepare"):
+            try:
+                with st.spinner("Выгрузка..."):
+                    path, rows = export.export_to_file(dataset, fmt, date_from, date_to)
+            except Exception as e:
+                st.error(f"Ошибка выгрузки: {e}")
+            else:
+                st.session_state[key] = {
+                    "dataset": dataset,
+                    "path": path,
+                    "rows": rows,
+                    "file_name": export.file_name(dataset, fmt, date_from, date_to),
+                    "mime": export.FORMATS[fmt],
+                }
+
+        prepared = st.session_state.get(key)
+        if not prepared or not os.path.exists(prepared["path"]):
+            return
+        size_mb = os.path.getsize(prepared["path"]) / 2 ** 20
+        st.write(f"{prepared['file_name']}: строк {prepared['rows']}, {size_mb:.1f} МБ")
+        if size_mb > EXPORT_DOWNLOAD_MAX_MB:
+            st.warning(f"Файл больше {EXPORT_DOWNLOAD_MAX_MB} МБ. Выгрузите его на сервере командой "
+                       f"python manage.py export {prepared['dataset']} <файл> --from ... --to ...")
+            return
+        # Файл читается только при нажатии, а не при каждом перезапуске страницы
+        st.download_button("Скачать", data=lambda: read_file(prepared["path"]), file_name=prepared["file_name"],
+                           mime=prepared["mime"], on_click="ignore", key=f"{key}_download")
 
 
 def add_category():
@@ -476,76 +703,74 @@ def add_category():
     if st.button("Добавить категорию"):
         if category_name.strip():
             try:
-                conn = get_db_connection()
-                with conn.cursor() as cur:
-                    cur.execute(
-                        "INSERT INTO categories (CategoryName) VALUES (%s)",
-                        (category_name,),
-                    )
-                    conn.commit()
-                    st.success(f"Категория '{category_name}' успешно добавлена!")
+                insert_category(category_name)
+                st.success(f"Категория '{category_name}' успешно добавлена!")
             except Exception as e:
                 st.error(f"Ошибка при добавлении категории: {e}")
-            finally:
-                conn.close()
         else:
             st.error("Название категории не может быть пустым.")
 
 
+# Импорт товаров из загруженного файла; отклонённые строки можно скачать CSV-файлом
+def import_uploaded_products(uploaded_file):
+    with tempfile.TemporaryFile("w+", encoding="utf-8", newline="") as errors_file:
+        try:
+            imported, rejected = import_products(uploaded_file, detect_format(uploaded_file.name), errors_file)
+            invalidate("products")
+        except ImportFormatError as e:
+            st.error(f"Файл не разобран, товары не добавлены: {e}")
+            return
+        except Exception as e:
+            st.error(f"Ошибка добавления товаров: {e}")
+            return
+
+        st.success(f"Товаров добавлено: {imported}")
+        if rejected:
+            errors_file.seek(0)
+            st.warning(f"Строк отклонено: {rejected}")
+            st.download_button("Скачать отчёт об ошибках", errors_file.read().encode("utf-8"),
+                               file_name="import_errors.csv", mime="text/csv")
+
+
 # Функция добавления продукта
 def add_product():
     st.title("Добавление продукта")
-    conn = get_db_connection()
 
-    uploaded_file = st.file_uploader("Загрузите JSON-файл с товарами", type="json")
-    if uploaded_file:
-        try:
-            product_data = uploaded_file.getvalue().decode("utf-8")
-            conn = get_db_connection()
-            with conn.cursor() as cur:
-                cur.execute("CALL bulk_add_products(%s::json)", (product_data,))
-                conn.commit()
-            st.success("Товары успешно добавлены!")
-        except Exception as e:
-            st.error(f"Ошибка добавления товаров: {e}")
+    uploaded_file = st.file_uploader("Загрузите файл с товарами (JSON, JSON Lines или CSV)",
+                                     type=["json", "jsonl", "ndjson", "csv"])
+    if uploaded_file and st.button("Импортировать товары"):
+        import_uploaded_products(uploaded_file)
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # Загрузка списка категорий
-            cur.execute("SELECT categoryid, categoryname FROM categories")
-            categories = cur.fetchall()
-            category_options = {cat['categoryname']: cat['categoryid'] for cat in categories}
-
-        if categories:
-            product_name = st.text_input("Название продукта")
-            product_description = st.text_input("Описание продукта")
-            product_price = st.number_input("Цена", min_value=0.0, step=0.01)
-            product_stock = st.number_input("Количество на складе", min_value=0, step=1)
-            selected_category = st.selectbox("Категория", list(category_options.keys()))
-
-            if st.button("Добавить продукт"):
-                if product_name.strip():
-                    try:
-                        with conn.cursor() as cur:
-                            cur.execute(
-                                """
-                                INSERT INTO products (name, description, price, stockquantity, categoryid)
-                                VALUES (%s, %s, %s, %s)
-                                """,
-                                (product_name, product_description, product_price, product_stock, category_options[selected_category]),
-                            )
-                            conn.commit()
-                            st.success(f"Продукт '{product_name}' успешно добавлен!")
-                            # st.rerun()
-                    except Exception as e:
-                        st.error(f"Ошибка при добавлении продукта: {e}")
-                else:
-                    st.error("Название продукта не может быть пустым.")
-        else:
-            st.warning("Сначала создайте категорию, чтобы добавить продукт.")
+        # Загрузка списка категорий
+        categories = fetch_categories()
+        category_options = {cat['categoryname']: cat['categoryid'] for cat in categories}
     except Exception as e:
         st.error(f"Ошибка при загрузке категорий: {e}")
-    finally:
-        conn.close()
+        return
+
+    if categories:
+        product_name = st.text_input("Название продукта")
+        product_description = st.text_input("Описание продукта")
+        product_price = st.number_input("Цена", min_value=0.0, step=0.01)
+        product_stock = st.number_input("Количество на складе", min_value=0, step=1)
+        selected_category = st.selectbox("Категория", list(category_options.keys()))
+        product_image = st.file_uploader("Изображение товара", type=["jpg", "jpeg", "png", "webp"])
+
+        if st.button("Добавить продукт"):
+            if product_name.strip():
+                try:
+                    image_ref = images.save_image(product_image.getvalue()) if product_image else None
+                    insert_product(product_name, product_description, product_price, product_stock,
+                                   category_options[selected_category], image_ref)
+                    st.success(f"Продукт '{product_name}' успешно добавлен!")
+                    # st.rerun()
+                except Exception as e:
+                    st.error(f"Ошибка при добавлении продукта: {e}")
+            else:
+                st.error("Название продукта не может быть пустым.")
+    else:
+        st.warning("Сначала создайте категорию, чтобы добавить продукт.")
+
 
 def view_user_order_summary():
     # Выбор даты начала и окончания периода
@@ -557,42 +782,138 @@ def view_user_order_summary():
         st.error("Дата начала не может быть позже даты окончания.")
         return
 
-    # Подключение к базе данных
-    conn = get_db_connection()
-    if not conn:
-        return
-
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # Запрос к функции get_orders_summary_for_all_users
-            cur.execute("""
-                SELECT *
-                FROM get_orders_summary_for_all_users(%s, %s)
-            """, (start_date, end_date))
-            result = cur.fetchall()
-            cur.execute("""
-            SELECT SUM(total_orders) as all_orders, SUM(total_amount) as all_amount
-            FROM get_orders_summary_for_all_users(%s, %s)
-        """, (start_date, end_date))
-            result2 = cur.fetchall()
-
-            # Выводим таблицу с результатами
-            if result:
-                st.write("### Сводка по заказам всех пользователей")
-                st.write(f"Период: {start_date} - {end_date}")
-                for res in result2:
-                    st.write(f"Количество заказов: {res['all_orders']}. Общая сумма: {res['all_amount']}")
-                st.write(
-                    f"Таблица с количеством заказов и суммами для каждого пользователя:"
-                )
-                st.dataframe(result)
-            else:
-                st.write("Нет данных за указанный период.")
-
+        columns, totals = fetch_order_summary(start_date, end_date)
     except Exception as e:
         st.error(f"Ошибка загрузки данных: {e}")
-    finally:
-        conn.close()
+        return
+
+    # Выводим таблицу с результатами
+    if totals:
+        st.write("### Сводка по заказам всех пользователей")
+        st.write(f"Период: {start_date} - {end_date}")
+        st.write(f"Количество заказов: {totals['total_orders']}. Общая сумма: {totals['total_amount']}")
+        st.write("Таблица с количеством заказов и суммами для каждого пользователя:")
+        st.dataframe(columns)
+    else:
+        st.write("Нет данных за указанный период.")
+
+    export_controls("summary_export", ["user_summary", "orders", "order_lines"], start_date, end_date)
+
+
+# Топ запросов по суммарному времени из pg_stat_statements (если расширение загружено,
+# см. migrations/007_pg_stat_statements.sql)
+PG_STAT_STATEMENTS_QUERY = """
+    SELECT query, calls, total_exec_time AS total_ms, mean_exec_time AS mean_ms, rows,
+           shared_blks_hit, shared_blks_read
+    FROM pg_stat_statements
+    WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+    ORDER BY total_exec_time DESC
+    LIMIT 20
+"""
+
+
+def fetch_pg_stat_statements():
+    with get_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("SELECT to_regclass('pg_stat_statements') IS NOT NULL AS installed")
+        if not cur.fetchone()["installed"]:
+            return None
+        cur.execute(PG_STAT_STATEMENTS_QUERY)
+        return cur.fetchall()
+
+
+def fetch_connection_states():
+    with get_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("""
+            SELECT COALESCE(state, 'фоновый процесс') AS state, count(*) AS connections
+            FROM pg_stat_activity
+            WHERE datname = current_database()
+            GROUP BY 1
+            ORDER BY 2 DESC
+        """)
+        return cur.fetchall()
+
+
+# Страница администратора: запросы приложения, время страниц, соединения
+def view_performance():
+    st.title("Производительность")
+    collected, capacity = querylog.window()
+    st.caption(f"По последним {collected} запросам (буфер на {capacity}). "
+               f"Медленными считаются запросы дольше {querylog.SLOW_SECONDS * 1000:.0f} мс.")
+    if st.button("Сбросить статистику"):
+        querylog.reset()
+        st.rerun()
+
+    st.write("### Запросы приложения")
+    queries = querylog.top_queries()
+    if queries:
+        st.dataframe(pd.DataFrame([{
+            "Запрос": row["query"],
+            "Вызовов": row["calls"],
+            "Всего, мс": round(row["total"] * 1000, 1),
+            "Среднее, мс": round(row["mean"] * 1000, 2),
+            "Максимум, мс": round(row["max"] * 1000, 1),
+            "Строк в среднем": round(row["rows"] / row["calls"], 1),
+            "КБ в среднем": round(row["bytes"] / row["calls"] / 1024, 1),
+            "Страницы": row["pages"],
+        } for row in queries]), hide_index=True)
+    else:
+        st.write("Запросов пока не было.")
+
+    st.write("### Время выполнения страниц")
+    timings = querylog.page_timings()
+    if timings:
+        st.dataframe(pd.DataFrame([{
+            "Страница": row["page"],
+            "Запусков": row["runs"],
+            "Среднее, мс": round(row["mean"] * 1000, 1),
+            "p95, мс": round(row["p95"] * 1000, 1),
+            "Запросов за запуск": round(row["statements"], 1),
+            "Доля БД": f"{row['db_share']:.0%}",
+        } for row in timings]), hide_index=True)
+
+    results = prefetch(connections=fetch_connection_states, statements=fetch_pg_stat_statements)
+
+    st.write("### Соединения")
+    stats = pool_stats()
+    if stats:
+        st.write(f"Пул: выдано {stats['checked_out']} из {stats['maxconn']}, максимум одновременно "
+                 f"{stats['max_checked_out']}, выдач {stats['checkouts']}, среднее ожидание "
+                 f"{stats['wait_time_avg'] * 1000:.1f} мс, таймаутов {stats['timeouts']}")
+    if results["connections"].ok:
+        st.dataframe(pd.DataFrame(results["connections"].value), hide_index=True)
+    else:
+        st.error(f"Ошибка загрузки состояния соединений: {results['connections'].error}")
+    routing = routing_stats()
+    if routing:
+        st.write(f"Чтений с основного сервера вместо реплики: {routing['fallbacks']}")
+        st.dataframe(pd.DataFrame([{
+            "Реплика": replica["replica"],
+            "Доступна": "да" if replica["healthy"] else "нет",
+            "Отставание, с": replica["lag"],
+            "Чтений": replica["reads"],
+            "Ошибка": replica["error"] or "",
+        } for replica in routing["replicas"]]), hide_index=True)
+
+    st.write("### Медленные запросы")
+    slow = querylog.slow_queries()
+    if not slow:
+        st.write("Нет.")
+    for entry in slow:
+        moment = datetime.fromtimestamp(entry["time"]).strftime("%d.%m %H:%M:%S")
+        with st.expander(f"{moment} · {entry['duration'] * 1000:.0f} мс · {entry['page'] or '—'} · "
+                         f"{entry['fingerprint']}"):
+            st.code(entry["plan"] or "План не снимался для этого запроса", language=None)
+
+    st.write("### pg_stat_statements")
+    if not results["statements"].ok:
+        st.error(f"pg_stat_statements недоступно: {results['statements'].error}")
+        return
+    statements = results["statements"].value
+    if statements is None:
+        st.write("Расширение pg_stat_statements не установлено.")
+    else:
+        st.dataframe(pd.DataFrame(statements), hide_index=True)
 
 
 
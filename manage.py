@@ -0,0 +1,277 @@
+import argparse
+import sys
+from datetime import date
+
+from archive import ORDER_ARCHIVE_DIR, parse_month
+from datagen import add_arguments as datagen_arguments
+from db import get_connection
+
+
+def migrate_images(args):
+    from images import migrate_inline_images
+
+    migrated, failed = migrate_inline_images(batch_size=args.batch_size)
+    print(f"Готово: перенесено {migrated}, с ошибками {failed}.")
+    if args.vacuum_full:
+        # VACUUM нельзя выполнять внутри транзакции
+        with get_connection() as conn:
+            conn.autocommit = True
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("VACUUM FULL products")
+            finally:
+                conn.autocommit = False
+        print("Таблица products сжата (VACUUM FULL).")
+
+
+def rollup_backfill(args):
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT rebuild_daily_sales_rollup(%s, %s)", (args.date_from, args.date_to))
+        rows = cur.fetchone()[0]
+        conn.commit()
+    print(f"Сводка продаж пересчитана: {rows} строк.")
+
+
+def rollup_check(args):
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT * FROM check_daily_sales_rollup(%s, %s)", (args.date_from, args.date_to))
+        mismatches = cur.fetchall()
+    for day, user_id, rollup_orders, raw_orders, rollup_amount, raw_amount in mismatches:
+        print(f"{day} пользователь {user_id}: в сводке {rollup_orders} заказов на {rollup_amount}, "
+              f"в заказах {raw_orders} на {raw_amount}")
+    if mismatches:
+        print(f"Найдено расхождений: {len(mismatches)}")
+        sys.exit(1)
+    print("Сводка продаж совпадает с заказами.")
+
+
+def ratings_rebuild(args):
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT rebuild_product_ratings(%s)", (args.products,))
+        rows = cur.fetchone()[0]
+        conn.commit()
+    print(f"Рейтинги пересчитаны: {rows} товаров.")
+
+
+def ratings_check(args):
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT * FROM check_product_ratings()")
+        mismatches = cur.fetchall()
+    for product_id, stored, actual in mismatches:
+        print(f"Товар {product_id}: в агрегатах {stored}, по отзывам {actual}")
+    if mismatches:
+        print(f"Найдено расхождений: {len(mismatches)}")
+        sys.exit(1)
+    print("Рейтинги товаров совпадают с отзывами.")
+
+
+def import_products_file(args):
+    from importer import detect_format, import_products
+
+    fmt = args.format or detect_format(args.path)
+    with open(args.path, "rb") as source, open(args.errors, "w", encoding="utf-8", newline="") as errors_out:
+        imported, rejected = import_products(source, fmt, errors_out, batch_size=args.batch_size)
+    print(f"Добавлено товаров: {imported}, отклонено строк: {rejected}.")
+    if rejected:
+        print(f"Отчёт об ошибках: {args.errors}")
+
+
+def run_migrations(args):
+    from migrate import MigrationError, migrate, status
+
+    if args.status:
+        for migration, row in status():
+            state = f"применена {row[3]:%Y-%m-%d %H:%M}" if row else "не применена"
+            if row and row[2] != migration.checksum:
+                state += ", файл изменён после применения"
+            print(f"{migration.name:<40} {state}")
+        return
+    try:
+        applied = migrate(dry_run=args.dry_run)
+    except MigrationError as e:
+        print(f"Ошибка миграции {e}")
+        sys.exit(1)
+    if not args.dry_run:
+        print(f"Применено миграций: {len(applied)}.")
+
+
+def generate_data(args):
+    from datagen import generate
+
+    generate(args)
+
+
+# Удаление брошенных корзин (не менявшихся дольше --days дней) пачками,
+# чтобы не держать блокировки долго. Запускается по расписанию, например из cron:
+#     0 3 * * * cd /app && python manage.py expire-carts
+def expire_carts(args):
+    expired = 0
+    with get_connection() as conn, conn.cursor() as cur:
+        while True:
+            cur.execute("""
+                DELETE FROM carts
+                WHERE userid IN (
+                    SELECT userid FROM carts
+                    WHERE updatedat < now() - %s * INTERVAL '1 day'
+                    ORDER BY updatedat
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+            """, (args.days, args.batch_size))
+            deleted = cur.rowcount
+            conn.commit()
+            expired += deleted
+            if deleted < args.batch_size:
+                break
+    print(f"Удалено брошенных корзин: {expired}.")
+
+
+def export_data(args):
+    from export import ExportError, detect_format, export
+
+    fmt = args.format or detect_format(args.output)
+    try:
+        with open(args.output, "wb") as output:
+            rows = export(args.dataset, fmt, output, args.date_from, args.date_to)
+    except ExportError as e:
+        print(f"Ошибка выгрузки: {e}")
+        sys.exit(1)
+    print(f"Выгружено строк: {rows} в {args.output}.")
+
+
+# Месячные секции заказов на --months-ahead месяцев вперёд. Запускается по расписанию,
+# например раз в сутки из cron:
+#     30 2 * * * cd /app && python manage.py order-partitions
+def order_partitions(args):
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT ensure_order_partitions(NULL, %s)", (args.months_ahead,))
+        created = cur.fetchone()[0]
+        conn.commit()
+    print(f"Создано секций заказов: {created}.")
+
+
+def order_archive(args):
+    from archive import ArchiveError, archive_before
+
+    try:
+        archived = archive_before(args.before, args.directory)
+    except ArchiveError as e:
+        print(f"Ошибка архивирования: {e}")
+        sys.exit(1)
+    print(f"Архивировано месяцев: {len(archived)} в {args.directory}.")
+
+
+def order_restore(args):
+    from archive import ArchiveError, restore_month
+
+    try:
+        rows = restore_month(args.month, args.directory)
+    except ArchiveError as e:
+        print(f"Ошибка восстановления: {e}")
+        sys.exit(1)
+    print(f"Восстановлено заказов: {rows['orders']}, позиций: {rows['orderdetails']}.")
+
+
+# Секции остатка для «горячего» товара: оформления заказов на него не ждут
+# друг друга (migrations/014_stock_buckets.sql). --buckets 0 возвращает остаток в Products.
+def stock_buckets(args):
+    from psycopg2 import errors
+
+    from dal import set_stock_buckets
+
+    try:
+        stock = set_stock_buckets(args.product_id, args.buckets)
+    except (errors.NoDataFound, errors.InvalidParameterValue) as e:
+        print(f"Ошибка: {e.diag.message_primary}")
+        sys.exit(1)
+    if args.buckets > 1:
+        print(f"Остаток товара {args.product_id} ({stock} шт.) разделён на {args.buckets} секций.")
+    else:
+        print(f"Остаток товара {args.product_id} ({stock} шт.) хранится в одной строке.")
+
+
+def add_period_arguments(cmd):
+    cmd.add_argument("--from", dest="date_from", type=date.fromisoformat, help="ГГГГ-ММ-ДД")
+    cmd.add_argument("--to", dest="date_to", type=date.fromisoformat, help="ГГГГ-ММ-ДД")
+
+
+# Служебные команды: python manage.py <команда> [параметры]
+def main():
+    parser = argparse.ArgumentParser(description="Служебные команды магазина")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    cmd = commands.add_parser("migrate", help="Применить новые миграции из migrations/")
+    cmd.add_argument("--status", action="store_true", help="Показать, какие миграции применены")
+    cmd.add_argument("--dry-run", action="store_true", help="Только перечислить миграции, которые будут применены")
+    cmd.set_defaults(handler=run_migrations)
+
+    cmd = commands.add_parser("migrate-images", help="Вынести встроенные изображения товаров в хранилище")
+    cmd.add_argument("--batch-size", type=int, default=100)
+    cmd.add_argument("--vacuum-full", action="store_true",
+                     help="После переноса вернуть место, освобождённое в products и её TOAST")
+    cmd.set_defaults(handler=migrate_images)
+
+    cmd = commands.add_parser("rollup-backfill", help="Пересчитать сводку продаж по дням из заказов")
+    add_period_arguments(cmd)
+    cmd.set_defaults(handler=rollup_backfill)
+
+    cmd = commands.add_parser("rollup-check", help="Сверить сводку продаж с заказами")
+    add_period_arguments(cmd)
+    cmd.set_defaults(handler=rollup_check)
+
+    cmd = commands.add_parser("ratings-rebuild", help="Пересчитать рейтинги товаров по отзывам")
+    cmd.add_argument("--products", type=int, nargs="+", help="Только эти товары (по умолчанию все)")
+    cmd.set_defaults(handler=ratings_rebuild)
+
+    cmd = commands.add_parser("ratings-check", help="Сверить рейтинги товаров с отзывами")
+    cmd.set_defaults(handler=ratings_check)
+
+    cmd = commands.add_parser("import-products", help="Импортировать товары из JSON, JSON Lines или CSV")
+    cmd.add_argument("path")
+    cmd.add_argument("--format", choices=["json", "jsonl", "csv"], help="По умолчанию — по расширению файла")
+    cmd.add_argument("--errors", default="import_errors.csv", help="Куда записать отклонённые строки")
+    cmd.add_argument("--batch-size", type=int, default=5000)
+    cmd.set_defaults(handler=import_products_file)
+
+    cmd = commands.add_parser("generate-data", help="Заполнить БД синтетическими данными для нагрузочных проверок")
+    datagen_arguments(cmd)
+    cmd.set_defaults(handler=generate_data)
+
+    cmd = commands.add_parser("expire-carts", help="Удалить корзины, которые давно не менялись")
+    cmd.add_argument("--days", type=int, default=30)
+    cmd.add_argument("--batch-size", type=int, default=1000)
+    cmd.set_defaults(handler=expire_carts)
+
+    cmd = commands.add_parser("export", help="Выгрузить заказы, позиции заказов или сводку по покупателям за период")
+    cmd.add_argument("dataset", choices=["orders", "order_lines", "user_summary"])
+    cmd.add_argument("output", help="Файл .csv, .csv.gz или .parquet")
+    cmd.add_argument("--format", choices=["csv", "csv.gz", "parquet"], help="По умолчанию — по расширению файла")
+    add_period_arguments(cmd)
+    cmd.set_defaults(handler=export_data)
+
+    cmd = commands.add_parser("order-partitions", help="Создать месячные секции заказов наперёд")
+    cmd.add_argument("--months-ahead", type=int, default=3)
+    cmd.set_defaults(handler=order_partitions)
+
+    cmd = commands.add_parser("order-archive",
+                              help="Выгрузить старые месяцы заказов в сжатые файлы и удалить их секции")
+    cmd.add_argument("--before", type=parse_month, required=True,
+                     help="ГГГГ-ММ: архивировать месяцы раньше этого")
+    cmd.add_argument("--directory", default=ORDER_ARCHIVE_DIR)
+    cmd.set_defaults(handler=order_archive)
+
+    cmd = commands.add_parser("order-restore", help="Вернуть месяц заказов из архива")
+    cmd.add_argument("month", type=parse_month, help="ГГГГ-ММ")
+    cmd.add_argument("--directory", default=ORDER_ARCHIVE_DIR)
+    cmd.set_defaults(handler=order_restore)
+
+    cmd = commands.add_parser("stock-buckets", help="Разделить остаток популярного товара на секции")
+    cmd.add_argument("product_id", type=int)
+    cmd.add_argument("--buckets", type=int, default=16, help="Число секций; 0 — одна строка, как у обычных товаров")
+    cmd.set_defaults(handler=stock_buckets)
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
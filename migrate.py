@@ -0,0 +1,186 @@
+import hashlib
+import os
+import re
+import time
+
+import psycopg2
+from psycopg2 import extensions
+
+from db import DB_CONFIG
+
+# Применение миграций из migrations/ по порядку номеров.
+# Применённые версии записываются в schema_migrations, поэтому повторный запуск
+# выполняет только новые файлы. Одновременный запуск с нескольких машин
+# исключён рекомендательной блокировкой.
+#
+# ddl.sql — исходная схема (версия 0): выполняется только на пустой базе,
+# на существующей просто отмечается применённой. dml.sql — тестовые данные, не миграция.
+# Остальные файлы — NNN_описание.sql; каждый выполняется в одной транзакции
+# вместе с записью в schema_migrations. Файл, первая строка которого
+# "-- migrate: no-transaction", выполняется вне транзакции по одному оператору
+# (нужно для CREATE INDEX CONCURRENTLY; операторы разделяются ";" в конце строки).
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+BASELINE = "ddl.sql"
+NO_TRANSACTION_MARKER = "-- migrate: no-transaction"
+LOCK_KEY = 48_151_623
+
+_MIGRATION_NAME = re.compile(r"^(\d{3})_\w+\.sql$")
+_CONCURRENT_INDEX = re.compile(r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)",
+                               re.IGNORECASE)
+
+
+class MigrationError(Exception):
+    pass
+
+
+class Migration:
+    def __init__(self, version, name, path):
+        self.version = version
+        self.name = name
+        self.path = path
+        with open(path, encoding="utf-8") as source:
+            self.sql = source.read()
+        self.checksum = hashlib.sha256(self.sql.encode("utf-8")).hexdigest()
+
+    @property
+    def transactional(self):
+        return not self.sql.lstrip().startswith(NO_TRANSACTION_MARKER)
+
+    def statements(self):
+        return [statement.strip() for statement in re.split(r";\s*$", self.sql, flags=re.MULTILINE)
+                if _strip_comments(statement)]
+
+
+def _strip_comments(sql):
+    return "\n".join(line for line in sql.splitlines() if not line.strip().startswith("--")).strip()
+
+
+def load_migrations(directory=MIGRATIONS_DIR):
+    migrations = [Migration(0, BASELINE, os.path.join(directory, BASELINE))]
+    for filename in sorted(os.listdir(directory)):
+        match = _MIGRATION_NAME.match(filename)
+        if match:
+            migrations.append(Migration(int(match.group(1)), filename, os.path.join(directory, filename)))
+    versions = [migration.version for migration in migrations]
+    if len(versions) != len(set(versions)):
+        raise MigrationError("Несколько миграций с одним номером: " + ", ".join(m.name for m in migrations))
+    return migrations
+
+
+def _ensure_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            name TEXT NOT NULL,
+            checksum TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            duration_ms INT
+        )
+    """)
+
+
+def _applied(cur):
+    cur.execute("SELECT version, name, checksum, applied_at FROM schema_migrations ORDER BY version")
+    return {row[0]: row for row in cur.fetchall()}
+
+
+def _record(cur, migration, duration_ms):
+    cur.execute("""
+        INSERT INTO schema_migrations (version, name, checksum, duration_ms)
+        VALUES (%s, %s, %s, %s)
+    """, (migration.version, migration.name, migration.checksum, duration_ms))
+
+
+# Индекс, построение которого CONCURRENTLY прервалось, остаётся невалидным,
+# и IF NOT EXISTS его бы пропустил. Такие индексы удаляются перед повтором.
+def _drop_invalid_indexes(cur, statement):
+    match = _CONCURRENT_INDEX.search(statement)
+    if not match:
+        return
+    cur.execute("""
+        SELECT i.indexrelid::regclass::text
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = lower(%s) AND NOT i.indisvalid
+    """, (match.group(1),))
+    for (name,) in cur.fetchall():
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+def _apply(conn, migration):
+    started = time.perf_counter()
+    with conn.cursor() as cur:
+        if migration.transactional:
+            conn.autocommit = False
+            try:
+                cur.execute(migration.sql)
+                _record(cur, migration, int((time.perf_counter() - started) * 1000))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.autocommit = True
+        else:
+            for statement in migration.statements():
+                _drop_invalid_indexes(cur, statement)
+                cur.execute(statement)
+            _record(cur, migration, int((time.perf_counter() - started) * 1000))
+
+
+# Применение всех новых миграций; возвращает список применённых имён.
+# log получает строки о ходе работы.
+def migrate(log=print, dry_run=False):
+    migrations = load_migrations()
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cur:
+            # Блокировка сессии, а не транзакции: часть миграций выполняется вне транзакций
+            cur.execute("SELECT pg_advisory_lock(%s)", (LOCK_KEY,))
+            try:
+                _ensure_table(cur)
+                applied = _applied(cur)
+                cur.execute("SELECT to_regclass('users') IS NOT NULL")
+                schema_exists = cur.fetchone()[0]
+
+                done = []
+                for migration in migrations:
+                    row = applied.get(migration.version)
+                    if row is not None:
+                        if row[2] != migration.checksum:
+                            log(f"Внимание: {migration.name} изменён после применения ({row[3]:%Y-%m-%d %H:%M})")
+                        continue
+                    if migration.version == 0 and schema_exists:
+                        # База создана до появления schema_migrations: схема уже есть
+                        if not dry_run:
+                            _record(cur, migration, None)
+                        log(f"{migration.name}: схема уже существует, отмечена применённой")
+                        continue
+                    if dry_run:
+                        log(f"Будет применена: {migration.name}")
+                        done.append(migration.name)
+                        continue
+                    log(f"Применяется {migration.name}...")
+                    try:
+                        _apply(conn, migration)
+                    except psycopg2.Error as e:
+                        raise MigrationError(f"{migration.name}: {e}") from e
+                    done.append(migration.name)
+                return done
+            finally:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (LOCK_KEY,))
+    finally:
+        conn.close()
+
+
+def status():
+    migrations = load_migrations()
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+            applied = _applied(cur) if cur.fetchone()[0] else {}
+    finally:
+        conn.close()
+    return [(migration, applied.get(migration.version)) for migration in migrations]
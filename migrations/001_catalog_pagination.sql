@@ -0,0 +1,3 @@
+-- migrate: no-transaction
+-- Постраничный просмотр каталога по ключу productid внутри категории
+CREATE INDEX CONCURRENTLY IF NOT EXISTS products_category_product_idx ON Products (CategoryID, ProductID);
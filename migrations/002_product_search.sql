@@ -0,0 +1,29 @@
+-- Индексированный поиск товаров: триграммы по названию и полнотекстовый поиск
+-- по названию и описанию. btree_gin позволяет положить CategoryID в тот же GIN-индекс,
+-- так что фильтр по категории не требует отдельного прохода по таблице.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS btree_gin;
+
+-- Исправление раскладки клавиатуры: "ufyntkb" -> "гантели" и обратно.
+-- Прежняя версия функции могла быть создана с другим именем параметра, поэтому пересоздаём
+DROP FUNCTION IF EXISTS fix_mistake_search(TEXT);
+CREATE FUNCTION fix_mistake_search(p_text TEXT)
+RETURNS TEXT AS $$
+    SELECT translate(
+        lower(p_text),
+        'qwertyuiop[]asdfghjkl;''zxcvbnm,.`йцукенгшщзхъфывапролджэячсмитьбюё',
+        'йцукенгшщзхъфывапролджэячсмитьбюёqwertyuiop[]asdfghjkl;''zxcvbnm,.`'
+    );
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+ALTER TABLE Products ADD COLUMN IF NOT EXISTS SearchVector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('russian', coalesce(Name, '')), 'A') ||
+        setweight(to_tsvector('russian', coalesce(Description, '')), 'B')
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS products_name_trgm_idx
+    ON Products USING gin (CategoryID, lower(Name) gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS products_search_vector_idx
+    ON Products USING gin (CategoryID, SearchVector);
@@ -0,0 +1,84 @@
+-- Оформление заказа одной серверной операцией.
+-- Остаток товара больше не проверяется построчным триггером: строки товаров
+-- блокируются в порядке ProductID (без взаимоблокировок между покупателями),
+-- а отрицательный остаток запрещён ограничением таблицы.
+DROP TRIGGER IF EXISTS check_stock_trigger ON OrderDetails;
+DROP FUNCTION IF EXISTS check_stock();
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'products_stock_nonnegative') THEN
+        ALTER TABLE Products ADD CONSTRAINT products_stock_nonnegative CHECK (StockQuantity >= 0);
+    END IF;
+END;
+$$;
+
+-- p_items: [{"productid": 1, "quantity": 2}, ...]
+-- При нехватке товара бросает check_violation, в DETAIL — JSON-массив позиций
+-- {productid, name, requested, available}. Сумма заказа считается по текущим ценам.
+CREATE OR REPLACE FUNCTION place_order(p_user_id INT, p_items JSONB)
+RETURNS TABLE (order_id INT, total_amount NUMERIC) AS $$
+DECLARE
+    v_ids INT[];
+    v_quantities INT[];
+    v_shortage JSONB;
+    v_order_id INT;
+    v_total NUMERIC(10, 2);
+BEGIN
+    SELECT array_agg(r.productid ORDER BY r.productid), array_agg(r.quantity ORDER BY r.productid)
+    INTO v_ids, v_quantities
+    FROM (
+        SELECT (item->>'productid')::INT AS productid, SUM((item->>'quantity')::INT)::INT AS quantity
+        FROM jsonb_array_elements(p_items) AS item
+        GROUP BY 1
+    ) r;
+
+    IF v_ids IS NULL THEN
+        RAISE EXCEPTION 'Корзина пуста' USING ERRCODE = 'invalid_parameter_value';
+    END IF;
+    IF EXISTS (SELECT 1 FROM unnest(v_quantities) AS q WHERE q IS NULL OR q <= 0) THEN
+        RAISE EXCEPTION 'Количество товара должно быть положительным' USING ERRCODE = 'invalid_parameter_value';
+    END IF;
+
+    -- Блокируем товары всегда в одном порядке
+    PERFORM 1 FROM Products WHERE ProductID = ANY(v_ids) ORDER BY ProductID FOR UPDATE;
+
+    SELECT jsonb_agg(jsonb_build_object(
+               'productid', r.productid,
+               'name', p.Name,
+               'requested', r.quantity,
+               'available', COALESCE(p.StockQuantity, 0)
+           ) ORDER BY r.productid)
+    INTO v_shortage
+    FROM unnest(v_ids, v_quantities) AS r(productid, quantity)
+    LEFT JOIN Products p ON p.ProductID = r.productid
+    WHERE p.ProductID IS NULL OR p.StockQuantity < r.quantity;
+
+    IF v_shortage IS NOT NULL THEN
+        RAISE EXCEPTION 'Недостаточно товара на складе'
+            USING ERRCODE = 'check_violation', DETAIL = v_shortage::TEXT;
+    END IF;
+
+    SELECT SUM(p.Price * r.quantity)
+    INTO v_total
+    FROM unnest(v_ids, v_quantities) AS r(productid, quantity)
+    JOIN Products p ON p.ProductID = r.productid;
+
+    INSERT INTO Orders (UserID, OrderDate, TotalAmount, OrderStatus)
+    VALUES (p_user_id, NOW(), v_total, 'обрабатывается')
+    RETURNING Orders.OrderID INTO v_order_id;
+
+    INSERT INTO OrderDetails (OrderID, ProductID, Quantity, Price)
+    SELECT v_order_id, r.productid, r.quantity, p.Price
+    FROM unnest(v_ids, v_quantities) AS r(productid, quantity)
+    JOIN Products p ON p.ProductID = r.productid
+    ORDER BY r.productid;
+
+    UPDATE Products p
+    SET StockQuantity = p.StockQuantity - r.quantity
+    FROM unnest(v_ids, v_quantities) AS r(productid, quantity)
+    WHERE p.ProductID = r.productid;
+
+    RETURN QUERY SELECT v_order_id, v_total;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,6 @@
+-- migrate: no-transaction
+-- Индексы для постраничного списка заказов (новые сверху) и его фильтров
+CREATE INDEX CONCURRENTLY IF NOT EXISTS orders_date_idx ON Orders (OrderDate DESC, OrderID DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS orders_status_date_idx ON Orders (OrderStatus, OrderDate DESC, OrderID DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS orders_user_date_idx ON Orders (UserID, OrderDate DESC, OrderID DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS orderdetails_order_idx ON OrderDetails (OrderID);
@@ -0,0 +1,94 @@
+-- Предагрегированные продажи по дням и пользователям (только доставленные заказы).
+-- Таблица поддерживается триггером на Orders, страница «Анализ заказов» читает только её.
+CREATE TABLE IF NOT EXISTS DailySalesRollup (
+    Day DATE NOT NULL,
+    UserID INT NOT NULL REFERENCES Users(UserID),
+    OrdersCount INT NOT NULL DEFAULT 0,
+    TotalAmount NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (Day, UserID)
+);
+
+CREATE OR REPLACE FUNCTION daily_sales_rollup_add(p_day DATE, p_user_id INT, p_orders INT, p_amount NUMERIC)
+RETURNS VOID AS $$
+BEGIN
+    INSERT INTO DailySalesRollup AS r (Day, UserID, OrdersCount, TotalAmount)
+    VALUES (p_day, p_user_id, p_orders, p_amount)
+    ON CONFLICT (Day, UserID) DO UPDATE
+    SET OrdersCount = r.OrdersCount + EXCLUDED.OrdersCount,
+        TotalAmount = r.TotalAmount + EXCLUDED.TotalAmount;
+
+    DELETE FROM DailySalesRollup
+    WHERE Day = p_day AND UserID = p_user_id AND OrdersCount = 0;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION orders_rollup_trigger() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.OrderStatus = 'доставлен' THEN
+        PERFORM daily_sales_rollup_add(OLD.OrderDate::DATE, OLD.UserID, -1, -OLD.TotalAmount);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.OrderStatus = 'доставлен' THEN
+        PERFORM daily_sales_rollup_add(NEW.OrderDate::DATE, NEW.UserID, 1, NEW.TotalAmount);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS orders_rollup ON Orders;
+CREATE TRIGGER orders_rollup
+AFTER INSERT OR DELETE OR UPDATE OF OrderStatus, OrderDate, UserID, TotalAmount ON Orders
+FOR EACH ROW
+EXECUTE FUNCTION orders_rollup_trigger();
+
+-- Пересчёт сводки по сырым данным за период (NULL — без ограничения).
+-- Запись в Orders на время пересчёта блокируется, чтобы не потерять изменения.
+CREATE OR REPLACE FUNCTION rebuild_daily_sales_rollup(p_from DATE DEFAULT NULL, p_to DATE DEFAULT NULL)
+RETURNS BIGINT AS $$
+DECLARE
+    v_rows BIGINT;
+BEGIN
+    LOCK TABLE Orders IN SHARE MODE;
+
+    DELETE FROM DailySalesRollup
+    WHERE (p_from IS NULL OR Day >= p_from) AND (p_to IS NULL OR Day <= p_to);
+
+    INSERT INTO DailySalesRollup (Day, UserID, OrdersCount, TotalAmount)
+    SELECT o.OrderDate::DATE, o.UserID, COUNT(*), SUM(o.TotalAmount)
+    FROM Orders o
+    WHERE o.OrderStatus = 'доставлен'
+      AND (p_from IS NULL OR o.OrderDate >= p_from)
+      AND (p_to IS NULL OR o.OrderDate < p_to + 1)
+    GROUP BY 1, 2;
+
+    GET DIAGNOSTICS v_rows = ROW_COUNT;
+    RETURN v_rows;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Расхождения между сводкой и сырыми данными за период
+CREATE OR REPLACE FUNCTION check_daily_sales_rollup(p_from DATE DEFAULT NULL, p_to DATE DEFAULT NULL)
+RETURNS TABLE (day DATE, user_id INT, rollup_orders BIGINT, raw_orders BIGINT,
+               rollup_amount NUMERIC, raw_amount NUMERIC) AS $$
+    WITH raw AS (
+        SELECT o.OrderDate::DATE AS day, o.UserID AS user_id, COUNT(*) AS orders, SUM(o.TotalAmount) AS amount
+        FROM Orders o
+        WHERE o.OrderStatus = 'доставлен'
+          AND (p_from IS NULL OR o.OrderDate >= p_from)
+          AND (p_to IS NULL OR o.OrderDate < p_to + 1)
+        GROUP BY 1, 2
+    ), rollup AS (
+        SELECT r.Day AS day, r.UserID AS user_id, r.OrdersCount::BIGINT AS orders, r.TotalAmount AS amount
+        FROM DailySalesRollup r
+        WHERE (p_from IS NULL OR r.Day >= p_from) AND (p_to IS NULL OR r.Day <= p_to)
+    )
+    SELECT COALESCE(rollup.day, raw.day), COALESCE(rollup.user_id, raw.user_id),
+           COALESCE(rollup.orders, 0), COALESCE(raw.orders, 0),
+           COALESCE(rollup.amount, 0), COALESCE(raw.amount, 0)
+    FROM rollup
+    FULL JOIN raw ON raw.day = rollup.day AND raw.user_id = rollup.user_id
+    WHERE COALESCE(rollup.orders, 0) <> COALESCE(raw.orders, 0)
+       OR COALESCE(rollup.amount, 0) <> COALESCE(raw.amount, 0)
+    ORDER BY 1, 2;
+$$ LANGUAGE sql STABLE;
+
+SELECT rebuild_daily_sales_rollup();
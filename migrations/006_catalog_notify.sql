@@ -0,0 +1,21 @@
+-- Уведомления об изменении каталога для сброса кэша приложения (cache.py).
+-- Триггеры уровня оператора: массовый импорт шлёт одно уведомление, а не по строке,
+-- и одинаковые уведомления в одной транзакции PostgreSQL объединяет.
+CREATE OR REPLACE FUNCTION notify_catalog_changed() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('catalog_changed', json_build_object('table', TG_TABLE_NAME::TEXT)::TEXT);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS products_notify ON Products;
+CREATE TRIGGER products_notify
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON Products
+FOR EACH STATEMENT
+EXECUTE FUNCTION notify_catalog_changed();
+
+DROP TRIGGER IF EXISTS categories_notify ON Categories;
+CREATE TRIGGER categories_notify
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON Categories
+FOR EACH STATEMENT
+EXECUTE FUNCTION notify_catalog_changed();
@@ -0,0 +1,13 @@
+-- Статистика запросов сервера для страницы «Производительность».
+-- Данные собираются, только если библиотека загружена при старте сервера:
+--     shared_preload_libraries = 'pg_stat_statements'   (postgresql.conf)
+-- Без неё или без прав на создание расширения миграция ничего не делает,
+-- а страница показывает только статистику приложения.
+DO $$
+BEGIN
+    CREATE EXTENSION IF NOT EXISTS pg_stat_statements;
+EXCEPTION
+    WHEN undefined_file OR insufficient_privilege OR feature_not_supported THEN
+        RAISE NOTICE 'pg_stat_statements не установлено: %', SQLERRM;
+END;
+$$;
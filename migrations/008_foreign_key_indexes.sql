@@ -0,0 +1,12 @@
+-- migrate: no-transaction
+-- Индексы по внешним ключам, которых не было в исходной схеме.
+-- Orders(UserID), Orders(OrderDate, OrderStatus), OrderDetails(OrderID) и Products(CategoryID)
+-- уже покрыты индексами из 001 и 004 (по первым колонкам).
+-- OrderDetails(ProductID): продажи товара и проверка ссылок при удалении товара
+CREATE INDEX CONCURRENTLY IF NOT EXISTS orderdetails_product_idx ON OrderDetails (ProductID);
+-- Reviews: отзывы о товаре и проверка ссылок при удалении товара или пользователя
+CREATE INDEX CONCURRENTLY IF NOT EXISTS reviews_product_idx ON Reviews (ProductID, ReviewDate DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS reviews_user_idx ON Reviews (UserID);
+-- Users(RoleID), DailySalesRollup(UserID): проверка ссылок при удалении роли или пользователя
+CREATE INDEX CONCURRENTLY IF NOT EXISTS users_role_idx ON Users (RoleID);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS dailysalesrollup_user_idx ON DailySalesRollup (UserID);
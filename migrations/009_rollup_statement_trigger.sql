@@ -0,0 +1,95 @@
+-- Сводка продаж обновляется один раз на оператор, а не на каждую строку.
+-- Массовая смена статусов (UPDATE ... WHERE OrderID = ANY(...)) меняет сотни заказов
+-- одним оператором: изменения суммируются по (день, пользователь) из таблиц переходов
+-- и вносятся в DailySalesRollup одним INSERT ... ON CONFLICT в той же транзакции.
+
+-- Внесение набора изменений; строки, в которых не осталось заказов, удаляются.
+-- Ключи обрабатываются по порядку, чтобы параллельные транзакции не взаимоблокировались.
+CREATE OR REPLACE FUNCTION daily_sales_rollup_apply(p_days DATE[], p_user_ids INT[],
+                                                    p_orders INT[], p_amounts NUMERIC[])
+RETURNS VOID AS $$
+BEGIN
+    INSERT INTO DailySalesRollup AS r (Day, UserID, OrdersCount, TotalAmount)
+    SELECT d.day, d.user_id, d.orders, d.amount
+    FROM unnest(p_days, p_user_ids, p_orders, p_amounts) AS d(day, user_id, orders, amount)
+    ORDER BY d.day, d.user_id
+    ON CONFLICT (Day, UserID) DO UPDATE
+    SET OrdersCount = r.OrdersCount + EXCLUDED.OrdersCount,
+        TotalAmount = r.TotalAmount + EXCLUDED.TotalAmount;
+
+    DELETE FROM DailySalesRollup r
+    USING unnest(p_days, p_user_ids) AS d(day, user_id)
+    WHERE r.Day = d.day AND r.UserID = d.user_id AND r.OrdersCount = 0;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Таблицы переходов нельзя объявить у триггера на несколько событий,
+-- поэтому триггеров три, а функция одна: запрос выбирается по TG_OP.
+-- UPDATE, не затронувший доставленные заказы, даёт пустой набор изменений.
+CREATE OR REPLACE FUNCTION orders_rollup_statement_trigger() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM daily_sales_rollup_apply(array_agg(c.day), array_agg(c.user_id),
+                                         array_agg(c.orders), array_agg(c.amount))
+        FROM (
+            SELECT n.OrderDate::DATE AS day, n.UserID AS user_id,
+                   COUNT(*)::INT AS orders, SUM(n.TotalAmount) AS amount
+            FROM new_rows n
+            WHERE n.OrderStatus = 'доставлен'
+            GROUP BY 1, 2
+        ) c
+        HAVING COUNT(*) > 0;
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM daily_sales_rollup_apply(array_agg(c.day), array_agg(c.user_id),
+                                         array_agg(c.orders), array_agg(c.amount))
+        FROM (
+            SELECT o.OrderDate::DATE AS day, o.UserID AS user_id,
+                   -COUNT(*)::INT AS orders, -SUM(o.TotalAmount) AS amount
+            FROM old_rows o
+            WHERE o.OrderStatus = 'доставлен'
+            GROUP BY 1, 2
+        ) c
+        HAVING COUNT(*) > 0;
+    ELSE
+        PERFORM daily_sales_rollup_apply(array_agg(c.day), array_agg(c.user_id),
+                                         array_agg(c.orders), array_agg(c.amount))
+        FROM (
+            SELECT ch.day, ch.user_id, SUM(ch.orders)::INT AS orders, SUM(ch.amount) AS amount
+            FROM (
+                SELECT o.OrderDate::DATE AS day, o.UserID AS user_id, -1 AS orders, -o.TotalAmount AS amount
+                FROM old_rows o
+                WHERE o.OrderStatus = 'доставлен'
+                UNION ALL
+                SELECT n.OrderDate::DATE, n.UserID, 1, n.TotalAmount
+                FROM new_rows n
+                WHERE n.OrderStatus = 'доставлен'
+            ) ch
+            GROUP BY 1, 2
+            HAVING SUM(ch.orders) <> 0 OR SUM(ch.amount) <> 0
+        ) c
+        HAVING COUNT(*) > 0;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS orders_rollup ON Orders;
+DROP FUNCTION IF EXISTS orders_rollup_trigger();
+
+CREATE TRIGGER orders_rollup_insert
+AFTER INSERT ON Orders
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION orders_rollup_statement_trigger();
+
+CREATE TRIGGER orders_rollup_update
+AFTER UPDATE ON Orders
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION orders_rollup_statement_trigger();
+
+CREATE TRIGGER orders_rollup_delete
+AFTER DELETE ON Orders
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION orders_rollup_statement_trigger();
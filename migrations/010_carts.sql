@@ -0,0 +1,44 @@
+-- Корзина покупателя в БД вместо st.session_state: не теряется при перезапуске
+-- контейнера и одинакова на всех экземплярах приложения.
+-- Carts — одна строка на покупателя со временем последнего изменения (по нему
+-- удаляются брошенные корзины), CartItems — позиции с ценой на момент добавления,
+-- чтобы при просмотре показать, какие цены изменились.
+CREATE TABLE IF NOT EXISTS Carts (
+    UserID INT PRIMARY KEY REFERENCES Users(UserID) ON DELETE CASCADE,
+    CreatedAt TIMESTAMPTZ NOT NULL DEFAULT now(),
+    UpdatedAt TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS CartItems (
+    UserID INT NOT NULL REFERENCES Carts(UserID) ON DELETE CASCADE,
+    ProductID INT NOT NULL REFERENCES Products(ProductID) ON DELETE CASCADE,
+    Quantity INT NOT NULL CHECK (Quantity > 0),
+    AddedPrice NUMERIC(10, 2) NOT NULL,
+    AddedAt TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (UserID, ProductID)
+);
+
+CREATE INDEX IF NOT EXISTS carts_updated_idx ON Carts (UpdatedAt);
+CREATE INDEX IF NOT EXISTS cartitems_product_idx ON CartItems (ProductID);
+
+-- Оформление заказа из корзины за один вызов: позиции берутся из CartItems,
+-- заказ пишется через place_order (migrations/003_checkout.sql), и при успехе
+-- корзина удаляется в той же транзакции. Строка Carts блокируется, поэтому
+-- повторное нажатие из другой вкладки получит пустую корзину, а не второй заказ.
+CREATE OR REPLACE FUNCTION checkout_cart(p_user_id INT)
+RETURNS TABLE (order_id INT, total_amount NUMERIC) AS $$
+DECLARE
+    v_items JSONB;
+BEGIN
+    PERFORM 1 FROM Carts WHERE UserID = p_user_id FOR UPDATE;
+
+    SELECT jsonb_agg(jsonb_build_object('productid', ci.ProductID, 'quantity', ci.Quantity))
+    INTO v_items
+    FROM CartItems ci
+    WHERE ci.UserID = p_user_id;
+
+    RETURN QUERY SELECT * FROM place_order(p_user_id, COALESCE(v_items, '[]'::JSONB));
+
+    DELETE FROM Carts WHERE UserID = p_user_id;
+END;
+$$ LANGUAGE plpgsql;
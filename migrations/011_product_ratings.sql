@@ -0,0 +1,179 @@
+-- Агрегаты отзывов по товарам: число отзывов и оценок, сумма оценок, распределение
+-- оценок 1–5 и время последнего отзыва. Поддерживаются триггерами на Reviews,
+-- поэтому каталог показывает и сортирует по рейтингу без AVG/COUNT по отзывам.
+-- Таблица рядом с Products, а не колонки в ней: отзыв не пересчитывает SearchVector
+-- товара и не конкурирует за блокировку строки товара с оформлением заказов.
+-- CategoryID повторяет категорию товара, чтобы фильтр по категории и сортировка
+-- по рейтингу обслуживались одним индексом.
+CREATE TABLE IF NOT EXISTS ProductRatings (
+    ProductID INT PRIMARY KEY REFERENCES Products(ProductID) ON DELETE CASCADE,
+    CategoryID INT,
+    ReviewCount INT NOT NULL DEFAULT 0,
+    RatingCount INT NOT NULL DEFAULT 0,
+    RatingSum INT NOT NULL DEFAULT 0,
+    Histogram INT[] NOT NULL DEFAULT '{0,0,0,0,0}',
+    LastReviewAt TIMESTAMP,
+    -- 0 у товаров без оценок: при сортировке по рейтингу они идут после оценённых
+    AvgRating NUMERIC(3, 2) GENERATED ALWAYS AS (
+        CASE WHEN RatingCount > 0 THEN round(RatingSum::NUMERIC / RatingCount, 2) ELSE 0 END
+    ) STORED
+);
+
+CREATE INDEX IF NOT EXISTS productratings_rating_idx ON ProductRatings (AvgRating, ProductID);
+CREATE INDEX IF NOT EXISTS productratings_category_rating_idx ON ProductRatings (CategoryID, AvgRating, ProductID);
+
+-- Изменение агрегатов товара на один отзыв: p_sign = 1 — отзыв добавлен, -1 — удалён
+CREATE OR REPLACE FUNCTION product_ratings_add(p_product_id INT, p_rating INT, p_sign INT)
+RETURNS VOID AS $$
+    UPDATE ProductRatings
+    SET ReviewCount = ReviewCount + p_sign,
+        RatingCount = RatingCount + CASE WHEN p_rating IS NULL THEN 0 ELSE p_sign END,
+        RatingSum = RatingSum + COALESCE(p_rating, 0) * p_sign,
+        Histogram = ARRAY(
+            SELECT h.count + CASE WHEN h.rating = p_rating THEN p_sign ELSE 0 END
+            FROM unnest(Histogram) WITH ORDINALITY AS h(count, rating)
+            ORDER BY h.rating
+        )
+    WHERE ProductID = p_product_id;
+$$ LANGUAGE sql;
+
+-- Время последнего отзыва при добавлении только растёт; после удаления или правки
+-- берётся заново по индексу Reviews (ProductID, ReviewDate DESC)
+CREATE OR REPLACE FUNCTION reviews_ratings_trigger() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM product_ratings_add(OLD.ProductID, OLD.Rating, -1);
+        UPDATE ProductRatings
+        SET LastReviewAt = (SELECT MAX(r.ReviewDate) FROM Reviews r WHERE r.ProductID = OLD.ProductID)
+        WHERE ProductID = OLD.ProductID;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM product_ratings_add(NEW.ProductID, NEW.Rating, 1);
+        UPDATE ProductRatings
+        SET LastReviewAt = CASE WHEN TG_OP = 'INSERT' THEN GREATEST(LastReviewAt, NEW.ReviewDate)
+                                ELSE (SELECT MAX(r.ReviewDate) FROM Reviews r WHERE r.ProductID = NEW.ProductID) END
+        WHERE ProductID = NEW.ProductID;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS reviews_ratings ON Reviews;
+CREATE TRIGGER reviews_ratings
+AFTER INSERT OR DELETE OR UPDATE OF ProductID, Rating, ReviewDate ON Reviews
+FOR EACH ROW
+EXECUTE FUNCTION reviews_ratings_trigger();
+
+-- Строка агрегатов заводится для каждого нового товара (одним оператором на вставку,
+-- массовый импорт не платит по строке) и следует за сменой категории товара
+CREATE OR REPLACE FUNCTION products_ratings_insert_trigger() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO ProductRatings (ProductID, CategoryID)
+    SELECT n.ProductID, n.CategoryID FROM new_rows n
+    ON CONFLICT (ProductID) DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION products_ratings_category_trigger() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE ProductRatings SET CategoryID = NEW.CategoryID WHERE ProductID = NEW.ProductID;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS products_ratings_insert ON Products;
+CREATE TRIGGER products_ratings_insert
+AFTER INSERT ON Products
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION products_ratings_insert_trigger();
+
+DROP TRIGGER IF EXISTS products_ratings_category ON Products;
+CREATE TRIGGER products_ratings_category
+AFTER UPDATE OF CategoryID ON Products
+FOR EACH ROW
+WHEN (OLD.CategoryID IS DISTINCT FROM NEW.CategoryID)
+EXECUTE FUNCTION products_ratings_category_trigger();
+
+-- Рейтинги показываются в каталоге, поэтому их изменение сбрасывает кэш каталога
+-- (migrations/006_catalog_notify.sql)
+DROP TRIGGER IF EXISTS productratings_notify ON ProductRatings;
+CREATE TRIGGER productratings_notify
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON ProductRatings
+FOR EACH STATEMENT
+EXECUTE FUNCTION notify_catalog_changed();
+
+-- Пересчёт агрегатов по отзывам (NULL — все товары). Запись в Reviews на время
+-- пересчёта блокируется, чтобы не потерять изменения.
+CREATE OR REPLACE FUNCTION rebuild_product_ratings(p_product_ids INT[] DEFAULT NULL)
+RETURNS BIGINT AS $$
+DECLARE
+    v_rows BIGINT;
+BEGIN
+    LOCK TABLE Reviews IN SHARE MODE;
+
+    INSERT INTO ProductRatings AS pr (ProductID, CategoryID, ReviewCount, RatingCount, RatingSum,
+                                      Histogram, LastReviewAt)
+    SELECT p.ProductID, p.CategoryID,
+           COUNT(r.ReviewID), COUNT(r.Rating), COALESCE(SUM(r.Rating), 0),
+           ARRAY[COUNT(*) FILTER (WHERE r.Rating = 1), COUNT(*) FILTER (WHERE r.Rating = 2),
+                 COUNT(*) FILTER (WHERE r.Rating = 3), COUNT(*) FILTER (WHERE r.Rating = 4),
+                 COUNT(*) FILTER (WHERE r.Rating = 5)]::INT[],
+           MAX(r.ReviewDate)
+    FROM Products p
+    LEFT JOIN Reviews r ON r.ProductID = p.ProductID
+    WHERE p_product_ids IS NULL OR p.ProductID = ANY(p_product_ids)
+    GROUP BY p.ProductID
+    ON CONFLICT (ProductID) DO UPDATE
+    SET CategoryID = EXCLUDED.CategoryID,
+        ReviewCount = EXCLUDED.ReviewCount,
+        RatingCount = EXCLUDED.RatingCount,
+        RatingSum = EXCLUDED.RatingSum,
+        Histogram = EXCLUDED.Histogram,
+        LastReviewAt = EXCLUDED.LastReviewAt;
+
+    GET DIAGNOSTICS v_rows = ROW_COUNT;
+    RETURN v_rows;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Товары, у которых агрегаты расходятся с отзывами или строки агрегатов нет
+CREATE OR REPLACE FUNCTION check_product_ratings()
+RETURNS TABLE (product_id INT, stored JSONB, actual JSONB) AS $$
+    WITH actual AS (
+        SELECT p.ProductID AS product_id,
+               jsonb_build_object(
+                   'category', p.CategoryID,
+                   'reviews', COUNT(r.ReviewID),
+                   'ratings', COUNT(r.Rating),
+                   'sum', COALESCE(SUM(r.Rating), 0),
+                   'histogram', jsonb_build_array(
+                       COUNT(*) FILTER (WHERE r.Rating = 1), COUNT(*) FILTER (WHERE r.Rating = 2),
+                       COUNT(*) FILTER (WHERE r.Rating = 3), COUNT(*) FILTER (WHERE r.Rating = 4),
+                       COUNT(*) FILTER (WHERE r.Rating = 5)),
+                   'last_review', MAX(r.ReviewDate)
+               ) AS totals
+        FROM Products p
+        LEFT JOIN Reviews r ON r.ProductID = p.ProductID
+        GROUP BY p.ProductID
+    ), stored AS (
+        SELECT pr.ProductID AS product_id,
+               jsonb_build_object(
+                   'category', pr.CategoryID,
+                   'reviews', pr.ReviewCount,
+                   'ratings', pr.RatingCount,
+                   'sum', pr.RatingSum,
+                   'histogram', to_jsonb(pr.Histogram),
+                   'last_review', pr.LastReviewAt
+               ) AS totals
+        FROM ProductRatings pr
+    )
+    SELECT a.product_id, s.totals, a.totals
+    FROM actual a
+    LEFT JOIN stored s ON s.product_id = a.product_id
+    WHERE s.totals IS DISTINCT FROM a.totals
+    ORDER BY a.product_id;
+$$ LANGUAGE sql STABLE;
+
+SELECT rebuild_product_ratings();
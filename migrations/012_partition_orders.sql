@@ -0,0 +1,301 @@
+-- Orders и OrderDetails разбиты на секции по месяцам OrderDate. Запросы за период
+-- (список заказов администратора, выгрузки, пересчёт сводки) читают только секции
+-- своих месяцев, а старые месяцы архивируются отсоединением секции
+-- (manage.py order-archive) вместо DELETE, после которого остаётся раздутая таблица.
+--
+-- Ключ секционирования должен входить в первичный ключ, поэтому ключи стали
+-- (OrderID, OrderDate) и (OrderDetailID, OrderDate); уникальность OrderID
+-- по-прежнему обеспечивает последовательность orders_orderid_seq.
+-- Позиция заказа хранит дату своего заказа: секции позиций совпадают с секциями
+-- заказов, и месяц архивируется целиком, с позициями.
+-- Строки вне созданных секций попадают в секции по умолчанию (orders_default,
+-- orderdetails_default); create_order_partition переносит их в новую секцию.
+
+-- Секции заказов и позиций за месяц p_month. Таблица создаётся отдельно и
+-- присоединяется через ATTACH PARTITION: в отличие от CREATE TABLE ... PARTITION OF,
+-- это не блокирует чтение из Orders. Возвращает FALSE, если секции уже есть.
+CREATE OR REPLACE FUNCTION create_order_partition(p_month DATE)
+RETURNS BOOLEAN AS $$
+DECLARE
+    v_from DATE := date_trunc('month', p_month);
+    v_to DATE := date_trunc('month', p_month) + INTERVAL '1 month';
+    v_orders TEXT := 'orders_' || to_char(p_month, 'YYYY_MM');
+    v_lines TEXT := 'orderdetails_' || to_char(p_month, 'YYYY_MM');
+BEGIN
+    IF to_regclass(v_orders) IS NOT NULL THEN
+        RETURN FALSE;
+    END IF;
+
+    EXECUTE format('CREATE TABLE %I (LIKE Orders INCLUDING DEFAULTS)', v_orders);
+    EXECUTE format('CREATE TABLE %I (LIKE OrderDetails INCLUDING DEFAULTS)', v_lines);
+
+    -- Строки этого месяца, попавшие в секцию по умолчанию; сначала позиции, потом заказы,
+    -- чтобы не нарушить внешний ключ
+    EXECUTE format('WITH moved AS (DELETE FROM orderdetails_default WHERE OrderDate >= %L AND OrderDate < %L '
+                   'RETURNING *) INSERT INTO %I SELECT * FROM moved', v_from, v_to, v_lines);
+    EXECUTE format('WITH moved AS (DELETE FROM orders_default WHERE OrderDate >= %L AND OrderDate < %L '
+                   'RETURNING *) INSERT INTO %I SELECT * FROM moved', v_from, v_to, v_orders);
+
+    EXECUTE format('ALTER TABLE Orders ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)', v_orders, v_from, v_to);
+    EXECUTE format('ALTER TABLE OrderDetails ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)', v_lines, v_from, v_to);
+    RETURN TRUE;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Секции с месяца p_from (по умолчанию текущего) до p_months_ahead месяцев вперёд.
+-- Вызывается по расписанию (manage.py order-partitions), чтобы новые заказы
+-- не копились в секции по умолчанию. Возвращает число созданных секций.
+CREATE OR REPLACE FUNCTION ensure_order_partitions(p_from DATE DEFAULT NULL, p_months_ahead INT DEFAULT 3)
+RETURNS INT AS $$
+DECLARE
+    v_month DATE := date_trunc('month', COALESCE(p_from, CURRENT_DATE));
+    v_created INT := 0;
+BEGIN
+    WHILE v_month <= date_trunc('month', CURRENT_DATE) + make_interval(months => p_months_ahead) LOOP
+        IF create_order_partition(v_month) THEN
+            v_created := v_created + 1;
+        END IF;
+        v_month := v_month + INTERVAL '1 month';
+    END LOOP;
+    RETURN v_created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Перенос данных в секционированные таблицы (один раз: повторный запуск миграции
+-- на уже секционированной Orders ничего не делает)
+DO $$
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'orders'::regclass) = 'p' THEN
+        RETURN;
+    END IF;
+
+    DROP VIEW IF EXISTS OrderDetailsView;
+    ALTER SEQUENCE orders_orderid_seq OWNED BY NONE;
+    ALTER SEQUENCE orderdetails_orderdetailid_seq OWNED BY NONE;
+    ALTER TABLE Orders RENAME TO orders_unpartitioned;
+    ALTER TABLE OrderDetails RENAME TO orderdetails_unpartitioned;
+
+    CREATE TABLE Orders (
+        OrderID INT NOT NULL DEFAULT nextval('orders_orderid_seq'),
+        UserID INT NOT NULL,
+        OrderDate TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        TotalAmount NUMERIC(10, 2) NOT NULL,
+        OrderStatus VARCHAR(50) DEFAULT 'Processing'
+    ) PARTITION BY RANGE (OrderDate);
+
+    CREATE TABLE OrderDetails (
+        OrderDetailID INT NOT NULL DEFAULT nextval('orderdetails_orderdetailid_seq'),
+        OrderID INT NOT NULL,
+        OrderDate TIMESTAMP NOT NULL,
+        ProductID INT NOT NULL,
+        Quantity INT NOT NULL,
+        Price NUMERIC(10, 2) NOT NULL
+    ) PARTITION BY RANGE (OrderDate);
+
+    ALTER SEQUENCE orders_orderid_seq OWNED BY Orders.OrderID;
+    ALTER SEQUENCE orderdetails_orderdetailid_seq OWNED BY OrderDetails.OrderDetailID;
+
+    CREATE TABLE orders_default PARTITION OF Orders DEFAULT;
+    CREATE TABLE orderdetails_default PARTITION OF OrderDetails DEFAULT;
+    PERFORM ensure_order_partitions((SELECT MIN(OrderDate)::DATE FROM orders_unpartitioned));
+
+    -- Заказы без даты (столбец раньше допускал NULL) относятся ко времени миграции
+    INSERT INTO Orders (OrderID, UserID, OrderDate, TotalAmount, OrderStatus)
+    SELECT OrderID, UserID, COALESCE(OrderDate, CURRENT_TIMESTAMP), TotalAmount, OrderStatus
+    FROM orders_unpartitioned;
+
+    INSERT INTO OrderDetails (OrderDetailID, OrderID, OrderDate, ProductID, Quantity, Price)
+    SELECT d.OrderDetailID, d.OrderID, o.OrderDate, d.ProductID, d.Quantity, d.Price
+    FROM orderdetails_unpartitioned d
+    JOIN Orders o ON o.OrderID = d.OrderID;
+
+    DROP TABLE orderdetails_unpartitioned;
+    DROP TABLE orders_unpartitioned;
+
+    -- Ключи и индексы создаются после загрузки; на родительской таблице они
+    -- создаются во всех секциях, в том числе будущих
+    ALTER TABLE Orders ADD PRIMARY KEY (OrderID, OrderDate);
+    ALTER TABLE Orders ADD FOREIGN KEY (UserID) REFERENCES Users(UserID);
+    ALTER TABLE OrderDetails ADD PRIMARY KEY (OrderDetailID, OrderDate);
+    ALTER TABLE OrderDetails ADD FOREIGN KEY (OrderID, OrderDate)
+        REFERENCES Orders(OrderID, OrderDate) ON UPDATE CASCADE;
+    ALTER TABLE OrderDetails ADD FOREIGN KEY (ProductID) REFERENCES Products(ProductID);
+
+    -- Индексы из migrations/004_order_list.sql и 008_foreign_key_indexes.sql
+    CREATE INDEX orders_date_idx ON Orders (OrderDate DESC, OrderID DESC);
+    CREATE INDEX orders_status_date_idx ON Orders (OrderStatus, OrderDate DESC, OrderID DESC);
+    CREATE INDEX orders_user_date_idx ON Orders (UserID, OrderDate DESC, OrderID DESC);
+    CREATE INDEX orderdetails_order_idx ON OrderDetails (OrderID);
+    CREATE INDEX orderdetails_product_idx ON OrderDetails (ProductID);
+
+    -- Триггеры сводки продаж (migrations/009_rollup_statement_trigger.sql) на новой Orders;
+    -- операторы над родительской таблицей вызывают их один раз на оператор, как и раньше
+    CREATE TRIGGER orders_rollup_insert
+    AFTER INSERT ON Orders
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION orders_rollup_statement_trigger();
+
+    CREATE TRIGGER orders_rollup_update
+    AFTER UPDATE ON Orders
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION orders_rollup_statement_trigger();
+
+    CREATE TRIGGER orders_rollup_delete
+    AFTER DELETE ON Orders
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION orders_rollup_statement_trigger();
+END;
+$$;
+
+ANALYZE Orders;
+ANALYZE OrderDetails;
+
+CREATE OR REPLACE VIEW OrderDetailsView AS
+SELECT
+    o.OrderID,
+    o.UserID,
+    o.OrderDate,
+    o.OrderStatus,
+    o.TotalAmount,
+    od.ProductID,
+    p.Name AS ProductName,
+    od.Quantity,
+    od.Price
+FROM Orders o
+JOIN OrderDetails od ON o.OrderID = od.OrderID AND o.OrderDate = od.OrderDate
+JOIN Products p ON od.ProductID = p.ProductID;
+
+-- place_order из migrations/003_checkout.sql: позиции пишутся с датой заказа
+CREATE OR REPLACE FUNCTION place_order(p_user_id INT, p_items JSONB)
+RETURNS TABLE (order_id INT, total_amount NUMERIC) AS $$
+DECLARE
+    v_ids INT[];
+    v_quantities INT[];
+    v_shortage JSONB;
+    v_order_id INT;
+    v_order_date TIMESTAMP;
+    v_total NUMERIC(10, 2);
+BEGIN
+    SELECT array_agg(r.productid ORDER BY r.productid), array_agg(r.quantity ORDER BY r.productid)
+    INTO v_ids, v_quantities
+    FROM (
+        SELECT (item->>'productid')::INT AS productid, SUM((item->>'quantity')::INT)::INT AS quantity
+        FROM jsonb_array_elements(p_items) AS item
+        GROUP BY 1
+    ) r;
+
+    IF v_ids IS NULL THEN
+        RAISE EXCEPTION 'Корзина пуста' USING ERRCODE = 'invalid_parameter_value';
+    END IF;
+    IF EXISTS (SELECT 1 FROM unnest(v_quantities) AS q WHERE q IS NULL OR q <= 0) THEN
+        RAISE EXCEPTION 'Количество товара должно быть положительным' USING ERRCODE = 'invalid_parameter_value';
+    END IF;
+
+    -- Блокируем товары всегда в одном порядке
+    PERFORM 1 FROM Products WHERE ProductID = ANY(v_ids) ORDER BY ProductID FOR UPDATE;
+
+    SELECT jsonb_agg(jsonb_build_object(
+               'productid', r.productid,
+               'name', p.Name,
+               'requested', r.quantity,
+               'available', COALESCE(p.StockQuantity, 0)
+           ) ORDER BY r.productid)
+    INTO v_shortage
+    FROM unnest(v_ids, v_quantities) AS r(productid, quantity)
+    LEFT JOIN Products p ON p.ProductID = r.productid
+    WHERE p.ProductID IS NULL OR p.StockQuantity < r.quantity;
+
+    IF v_shortage IS NOT NULL THEN
+        RAISE EXCEPTION 'Недостаточно товара на складе'
+            USING ERRCODE = 'check_violation', DETAIL = v_shortage::TEXT;
+    END IF;
+
+    SELECT SUM(p.Price * r.quantity)
+    INTO v_total
+    FROM unnest(v_ids, v_quantities) AS r(productid, quantity)
+    JOIN Products p ON p.ProductID = r.productid;
+
+    INSERT INTO Orders (UserID, OrderDate, TotalAmount, OrderStatus)
+    VALUES (p_user_id, NOW(), v_total, 'обрабатывается')
+    RETURNING Orders.OrderID, Orders.OrderDate INTO v_order_id, v_order_date;
+
+    INSERT INTO OrderDetails (OrderID, OrderDate, ProductID, Quantity, Price)
+    SELECT v_order_id, v_order_date, r.productid, r.quantity, p.Price
+    FROM unnest(v_ids, v_quantities) AS r(productid, quantity)
+    JOIN Products p ON p.ProductID = r.productid
+    ORDER BY r.productid;
+
+    UPDATE Products p
+    SET StockQuantity = p.StockQuantity - r.quantity
+    FROM unnest(v_ids, v_quantities) AS r(productid, quantity)
+    WHERE p.ProductID = r.productid;
+
+    RETURN QUERY SELECT v_order_id, v_total;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Месяцы, выгруженные в архив (manage.py order-archive). Сводка продаж за них
+-- остаётся в DailySalesRollup: заказов в базе нет, но история продаж сохраняется.
+CREATE TABLE IF NOT EXISTS ArchivedOrderMonths (
+    Month DATE PRIMARY KEY,
+    OrdersCount BIGINT NOT NULL,
+    LinesCount BIGINT NOT NULL,
+    ArchivedAt TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- Пересчёт и проверка сводки из migrations/005_daily_sales_rollup.sql.
+-- Границы периода сравниваются без "p_from IS NULL OR ...", чтобы планировщик
+-- отбросил секции вне периода. Архивированные месяцы не пересчитываются и не
+-- сверяются: их заказов в Orders уже нет.
+CREATE OR REPLACE FUNCTION rebuild_daily_sales_rollup(p_from DATE DEFAULT NULL, p_to DATE DEFAULT NULL)
+RETURNS BIGINT AS $$
+DECLARE
+    v_rows BIGINT;
+BEGIN
+    LOCK TABLE Orders IN SHARE MODE;
+
+    DELETE FROM DailySalesRollup r
+    WHERE r.Day >= COALESCE(p_from, '-infinity') AND r.Day <= COALESCE(p_to, 'infinity')
+      AND NOT EXISTS (SELECT 1 FROM ArchivedOrderMonths a WHERE a.Month = date_trunc('month', r.Day));
+
+    INSERT INTO DailySalesRollup (Day, UserID, OrdersCount, TotalAmount)
+    SELECT o.OrderDate::DATE, o.UserID, COUNT(*), SUM(o.TotalAmount)
+    FROM Orders o
+    WHERE o.OrderStatus = 'доставлен'
+      AND o.OrderDate >= COALESCE(p_from, '-infinity')
+      AND o.OrderDate < COALESCE(p_to + 1, 'infinity')
+    GROUP BY 1, 2;
+
+    GET DIAGNOSTICS v_rows = ROW_COUNT;
+    RETURN v_rows;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION check_daily_sales_rollup(p_from DATE DEFAULT NULL, p_to DATE DEFAULT NULL)
+RETURNS TABLE (day DATE, user_id INT, rollup_orders BIGINT, raw_orders BIGINT,
+               rollup_amount NUMERIC, raw_amount NUMERIC) AS $$
+    WITH raw AS (
+        SELECT o.OrderDate::DATE AS day, o.UserID AS user_id, COUNT(*) AS orders, SUM(o.TotalAmount) AS amount
+        FROM Orders o
+        WHERE o.OrderStatus = 'доставлен'
+          AND o.OrderDate >= COALESCE(p_from, '-infinity')
+          AND o.OrderDate < COALESCE(p_to + 1, 'infinity')
+        GROUP BY 1, 2
+    ), rollup AS (
+        SELECT r.Day AS day, r.UserID AS user_id, r.OrdersCount::BIGINT AS orders, r.TotalAmount AS amount
+        FROM DailySalesRollup r
+        WHERE r.Day >= COALESCE(p_from, '-infinity') AND r.Day <= COALESCE(p_to, 'infinity')
+          AND NOT EXISTS (SELECT 1 FROM ArchivedOrderMonths a WHERE a.Month = date_trunc('month', r.Day))
+    )
+    SELECT COALESCE(rollup.day, raw.day), COALESCE(rollup.user_id, raw.user_id),
+           COALESCE(rollup.orders, 0), COALESCE(raw.orders, 0),
+           COALESCE(rollup.amount, 0), COALESCE(raw.amount, 0)
+    FROM rollup
+    FULL JOIN raw ON raw.day = rollup.day AND raw.user_id = rollup.user_id
+    WHERE COALESCE(rollup.orders, 0) <> COALESCE(raw.orders, 0)
+       OR COALESCE(rollup.amount, 0) <> COALESCE(raw.amount, 0)
+    ORDER BY 1, 2;
+$$ LANGUAGE sql STABLE;
@@ -0,0 +1,28 @@
+-- Версии таблиц для условных запросов JSON API (api.py). Уведомление об изменении
+-- (migrations/006_catalog_notify.sql) несёт номер транзакции, изменившей таблицу:
+-- процессы приложения хранят его как версию таблицы и строят из версий ETag ответов,
+-- не обращаясь к БД. В одной транзакции номер один, поэтому одинаковые уведомления
+-- по-прежнему объединяются.
+CREATE OR REPLACE FUNCTION notify_catalog_changed() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('catalog_changed',
+                      json_build_object('table', TG_TABLE_NAME::TEXT, 'xid', txid_current())::TEXT);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- От заказов зависят ответы API с заказами покупателя, от сводки продаж — сводка
+-- администратора. Позиции пишутся вместе с заказом, поэтому уведомления по
+-- OrderDetails не нужны. Триггеры уровня оператора на родительской таблице:
+-- оформление заказа добавляет по одному уведомлению на таблицу.
+DROP TRIGGER IF EXISTS orders_notify ON Orders;
+CREATE TRIGGER orders_notify
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON Orders
+FOR EACH STATEMENT
+EXECUTE FUNCTION notify_catalog_changed();
+
+DROP TRIGGER IF EXISTS dailysalesrollup_notify ON DailySalesRollup;
+CREATE TRIGGER dailysalesrollup_notify
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON DailySalesRollup
+FOR EACH STATEMENT
+EXECUTE FUNCTION notify_catalog_changed();
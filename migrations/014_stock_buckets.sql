@@ -0,0 +1,342 @@
+-- Остаток «горячих» товаров в нескольких секциях. place_order блокирует строку
+-- Products на всё время транзакции, поэтому заказы одного популярного товара
+-- оформляются строго по одному. У товара с секциями остаток делится между строками
+-- ProductStockBuckets, и оформление списывает его из любой свободной секции
+-- (SKIP LOCKED), не дожидаясь других покупателей. Когда свободных секций не хватает,
+-- секции блокируются по порядку с ожиданием и остаток проверяется точно, поэтому
+-- товар не продаётся сверх остатка.
+--
+-- Секции включаются для отдельных товаров: python manage.py stock-buckets <ProductID> --buckets 16
+-- (0 — вернуть остаток в Products). Products.StockQuantity для товара с секциями —
+-- сумма секций на момент одного из недавних заказов: по нему показывается остаток,
+-- а списание проверяется по секциям. Секции лучше включать заранее, до наплыва
+-- покупателей: заказ, пришедшийся на переключение, может прерваться взаимоблокировкой.
+CREATE TABLE IF NOT EXISTS ProductStockBuckets (
+    ProductID INT NOT NULL REFERENCES Products(ProductID) ON DELETE CASCADE,
+    Bucket SMALLINT NOT NULL,
+    Quantity INT NOT NULL CHECK (Quantity >= 0),
+    PRIMARY KEY (ProductID, Bucket)
+) WITH (fillfactor = 50);
+-- Quantity не индексируется, а fillfactor оставляет место на странице: списание
+-- остаётся HOT-обновлением и не трогает индекс
+
+-- Включение (p_buckets > 1) или отключение (0 или 1) секций товара. Остаток
+-- делится между секциями поровну; возвращается общий остаток.
+CREATE OR REPLACE FUNCTION set_product_stock_buckets(p_product_id INT, p_buckets INT)
+RETURNS INT AS $$
+DECLARE
+    v_stock INT;
+    v_count INT;
+    v_total INT;
+BEGIN
+    IF p_buckets IS NULL OR p_buckets < 0 OR p_buckets > 1024 THEN
+        RAISE EXCEPTION 'Число секций должно быть от 0 до 1024' USING ERRCODE = 'invalid_parameter_value';
+    END IF;
+
+    SELECT StockQuantity INTO v_stock FROM Products WHERE ProductID = p_product_id FOR NO KEY UPDATE;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Товар % не найден', p_product_id USING ERRCODE = 'no_data_found';
+    END IF;
+    SELECT COUNT(*), SUM(b.Quantity)::INT INTO v_count, v_total
+    FROM (
+        SELECT Quantity FROM ProductStockBuckets WHERE ProductID = p_product_id ORDER BY Bucket FOR UPDATE
+    ) b;
+    IF v_count > 0 THEN
+        v_stock := v_total;
+    END IF;
+
+    DELETE FROM ProductStockBuckets WHERE ProductID = p_product_id;
+    IF p_buckets > 1 THEN
+        INSERT INTO ProductStockBuckets (ProductID, Bucket, Quantity)
+        SELECT p_product_id, b, v_stock / p_buckets + CASE WHEN b < v_stock % p_buckets THEN 1 ELSE 0 END
+        FROM generate_series(0, p_buckets - 1) AS b;
+    END IF;
+    UPDATE Products SET StockQuantity = v_stock WHERE ProductID = p_product_id;
+    RETURN v_stock;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Новый остаток товаров (правка администратора): у товара с секциями
+-- он заново делится между секциями. Товары обрабатываются в порядке ProductID.
+CREATE OR REPLACE FUNCTION set_product_stock(p_product_ids INT[], p_quantities INT[])
+RETURNS VOID AS $$
+DECLARE
+    v_product_id INT;
+    v_quantity INT;
+    v_buckets INT;
+BEGIN
+    FOR v_product_id, v_quantity IN
+        SELECT r.productid, r.quantity FROM unnest(p_product_ids, p_quantities) AS r(productid, quantity)
+        ORDER BY r.productid
+    LOOP
+        PERFORM 1 FROM Products WHERE ProductID = v_product_id FOR NO KEY UPDATE;
+        SELECT COUNT(*) INTO v_buckets
+        FROM (SELECT 1 FROM ProductStockBuckets WHERE ProductID = v_product_id ORDER BY Bucket FOR UPDATE) b;
+        IF v_buckets > 0 THEN
+            UPDATE ProductStockBuckets
+            SET Quantity = v_quantity / v_buckets + CASE WHEN Bucket < v_quantity % v_buckets THEN 1 ELSE 0 END
+            WHERE ProductID = v_product_id;
+        END IF;
+        UPDATE Products SET StockQuantity = v_quantity WHERE ProductID = v_product_id;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Списание из незанятых секций товара в случайном порядке: занятые другими
+-- транзакциями пропускаются, блокируется по одной секции за раз. Возвращает,
+-- сколько списать не удалось.
+CREATE OR REPLACE FUNCTION take_free_buckets(p_product_id INT, p_quantity INT)
+RETURNS INT AS $$
+DECLARE
+    v_need INT := p_quantity;
+    v_bucket INT;
+    v_available INT;
+BEGIN
+    WHILE v_need > 0 LOOP
+        SELECT Bucket, Quantity INTO v_bucket, v_available
+        FROM ProductStockBuckets
+        WHERE ProductID = p_product_id AND Quantity > 0
+        ORDER BY random()
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED;
+        EXIT WHEN NOT FOUND;
+
+        UPDATE ProductStockBuckets SET Quantity = Quantity - LEAST(v_need, v_available)
+        WHERE ProductID = p_product_id AND Bucket = v_bucket;
+        v_need := v_need - LEAST(v_need, v_available);
+    END LOOP;
+    RETURN v_need;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Списание p_quantity единиц товара с секциями. Возвращает NULL, если списано;
+-- если товара не хватает — сколько его есть (ничего не списывается); -1 — у товара
+-- нет секций (их отключили, пока оформлялся заказ, или товара нет).
+--
+-- Ожидание секции допускается, только когда транзакция не держит ни одной секции
+-- этого товара: каждая неудачная попытка выполняется в блоке BEGIN ... EXCEPTION,
+-- и его откат снимает и списание, и блокировки. Так ожидающие секций одного товара
+-- не образуют цикла и взаимоблокировок нет.
+CREATE OR REPLACE FUNCTION take_bucket_stock(p_product_id INT, p_quantity INT)
+RETURNS INT AS $$
+DECLARE
+    v_bucket INT;
+    v_available INT;
+    v_count INT;
+BEGIN
+    -- Быстрый путь: только незанятые секции
+    BEGIN
+        IF take_free_buckets(p_product_id, p_quantity) = 0 THEN
+            RETURN NULL;
+        END IF;
+        RAISE EXCEPTION USING ERRCODE = 'lock_not_available';
+    EXCEPTION WHEN lock_not_available THEN
+        NULL;
+    END;
+
+    -- Все секции с остатком заняты (покупателей больше, чем секций): ждём одну
+    -- случайную. Она блокируется по первичному ключу, без условия на остаток,
+    -- чтобы повторная проверка условия после ожидания не оставила лишних блокировок.
+    SELECT Bucket INTO v_bucket
+    FROM ProductStockBuckets
+    WHERE ProductID = p_product_id AND Quantity > 0
+    ORDER BY random()
+    LIMIT 1;
+    IF FOUND THEN
+        BEGIN
+            SELECT Quantity INTO v_available
+            FROM ProductStockBuckets
+            WHERE ProductID = p_product_id AND Bucket = v_bucket
+            FOR UPDATE;
+            -- Секцию удалили, пока мы её ждали: секции товара пересоздали или отключили
+            IF NOT FOUND THEN
+                RAISE EXCEPTION USING ERRCODE = 'lock_not_available';
+            END IF;
+            UPDATE ProductStockBuckets SET Quantity = Quantity - LEAST(p_quantity, v_available)
+            WHERE ProductID = p_product_id AND Bucket = v_bucket;
+            IF take_free_buckets(p_product_id, p_quantity - LEAST(p_quantity, v_available)) = 0 THEN
+                RETURN NULL;
+            END IF;
+            RAISE EXCEPTION USING ERRCODE = 'lock_not_available';
+        EXCEPTION WHEN lock_not_available THEN
+            NULL;
+        END;
+    END IF;
+
+    -- Медленный путь: все секции товара по порядку с ожиданием, остаток точный
+    SELECT COUNT(*), COALESCE(SUM(b.Quantity), 0)::INT INTO v_count, v_available
+    FROM (
+        SELECT Quantity FROM ProductStockBuckets WHERE ProductID = p_product_id ORDER BY Bucket FOR UPDATE
+    ) b;
+    IF v_count = 0 THEN
+        RETURN -1;
+    END IF;
+    IF v_available < p_quantity THEN
+        RETURN v_available;
+    END IF;
+
+    UPDATE ProductStockBuckets b
+    SET Quantity = b.Quantity - t.take
+    FROM (
+        -- Секции по порядку, пока не наберётся p_quantity: из каждой берётся
+        -- остаток заказа за вычетом взятого из предыдущих
+        SELECT Bucket,
+               LEAST(Quantity, GREATEST(p_quantity - (SUM(Quantity) OVER (ORDER BY Bucket) - Quantity), 0)) AS take
+        FROM ProductStockBuckets
+        WHERE ProductID = p_product_id
+    ) t
+    WHERE b.ProductID = p_product_id AND b.Bucket = t.Bucket AND t.take > 0;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- place_order из migrations/012_partition_orders.sql: остаток товаров с секциями
+-- списывается через take_bucket_stock, строка Products таких товаров не блокируется.
+-- Порядок блокировок: сначала строки обычных товаров, затем секции товаров
+-- в порядке ProductID — ожидание идёт только «вперёд», без взаимоблокировок.
+CREATE OR REPLACE FUNCTION place_order(p_user_id INT, p_items JSONB)
+RETURNS TABLE (order_id INT, total_amount NUMERIC) AS $$
+DECLARE
+    v_ids INT[];
+    v_quantities INT[];
+    v_plain INT[];
+    v_sharded INT[] := '{}';
+    v_short_ids INT[] := '{}';
+    v_short_requested INT[] := '{}';
+    v_short_available INT[] := '{}';
+    v_product_id INT;
+    v_quantity INT;
+    v_available INT;
+    v_refresh INT[];
+    v_shortage JSONB;
+    v_order_id INT;
+    v_order_date TIMESTAMP;
+    v_total NUMERIC(10, 2);
+BEGIN
+    SELECT array_agg(r.productid ORDER BY r.productid), array_agg(r.quantity ORDER BY r.productid)
+    INTO v_ids, v_quantities
+    FROM (
+        SELECT (item->>'productid')::INT AS productid, SUM((item->>'quantity')::INT)::INT AS quantity
+        FROM jsonb_array_elements(p_items) AS item
+        GROUP BY 1
+    ) r;
+
+    IF v_ids IS NULL THEN
+        RAISE EXCEPTION 'Корзина пуста' USING ERRCODE = 'invalid_parameter_value';
+    END IF;
+    IF EXISTS (SELECT 1 FROM unnest(v_quantities) AS q WHERE q IS NULL OR q <= 0) THEN
+        RAISE EXCEPTION 'Количество товара должно быть положительным' USING ERRCODE = 'invalid_parameter_value';
+    END IF;
+
+    -- Обычные товары блокируем всегда в одном порядке. NO KEY UPDATE, а не UPDATE:
+    -- остаток — не ключ, и блокировка не задерживает проверку внешнего ключа
+    -- OrderDetails в чужих заказах. Пока строка товара заблокирована,
+    -- set_product_stock_buckets не может включить или отключить его секции.
+    SELECT array_agg(p.ProductID) INTO v_plain
+    FROM (
+        SELECT p.ProductID FROM Products p
+        WHERE p.ProductID = ANY(v_ids)
+          AND NOT EXISTS (SELECT 1 FROM ProductStockBuckets b WHERE b.ProductID = p.ProductID)
+        ORDER BY p.ProductID
+        FOR NO KEY UPDATE
+    ) p;
+    -- Проверка после блокировки: секции могли включить, пока мы ждали строку
+    SELECT array_agg(l.id) INTO v_plain
+    FROM unnest(v_plain) AS l(id)
+    WHERE NOT EXISTS (SELECT 1 FROM ProductStockBuckets b WHERE b.ProductID = l.id);
+    v_plain := COALESCE(v_plain, '{}');
+
+    FOR v_product_id, v_quantity IN
+        SELECT r.productid, r.quantity FROM unnest(v_ids, v_quantities) AS r(productid, quantity)
+        WHERE r.productid <> ALL(v_plain)
+        ORDER BY r.productid
+    LOOP
+        v_available := take_bucket_stock(v_product_id, v_quantity);
+        IF v_available = -1 THEN
+            -- Секции отключили или пересоздали, пока шло оформление. После блокировки
+            -- строки товара способ хранения остатка уже не изменится: проверяем заново.
+            PERFORM 1 FROM Products WHERE ProductID = v_product_id FOR NO KEY UPDATE;
+            IF NOT FOUND THEN
+                v_available := 0;
+            ELSIF EXISTS (SELECT 1 FROM ProductStockBuckets WHERE ProductID = v_product_id) THEN
+                v_available := take_bucket_stock(v_product_id, v_quantity);
+            ELSE
+                v_plain := v_plain || v_product_id;
+                CONTINUE;
+            END IF;
+        END IF;
+        IF v_available IS NULL THEN
+            v_sharded := v_sharded || v_product_id;
+        ELSE
+            v_short_ids := v_short_ids || v_product_id;
+            v_short_requested := v_short_requested || v_quantity;
+            v_short_available := v_short_available || v_available;
+        END IF;
+    END LOOP;
+
+    SELECT jsonb_agg(jsonb_build_object(
+               'productid', s.productid,
+               'name', p.Name,
+               'requested', s.requested,
+               'available', s.available
+           ) ORDER BY s.productid)
+    INTO v_shortage
+    FROM (
+        SELECT r.productid, r.quantity AS requested, p.StockQuantity AS available
+        FROM unnest(v_ids, v_quantities) AS r(productid, quantity)
+        JOIN Products p ON p.ProductID = r.productid
+        WHERE r.productid = ANY(v_plain) AND p.StockQuantity < r.quantity
+        UNION ALL
+        SELECT * FROM unnest(v_short_ids, v_short_requested, v_short_available)
+    ) s(productid, requested, available)
+    LEFT JOIN Products p ON p.ProductID = s.productid;
+
+    IF v_shortage IS NOT NULL THEN
+        RAISE EXCEPTION 'Недостаточно товара на складе'
+            USING ERRCODE = 'check_violation', DETAIL = v_shortage::TEXT;
+    END IF;
+
+    SELECT SUM(p.Price * r.quantity)
+    INTO v_total
+    FROM unnest(v_ids, v_quantities) AS r(productid, quantity)
+    JOIN Products p ON p.ProductID = r.productid;
+
+    INSERT INTO Orders (UserID, OrderDate, TotalAmount, OrderStatus)
+    VALUES (p_user_id, NOW(), v_total, 'обрабатывается')
+    RETURNING Orders.OrderID, Orders.OrderDate INTO v_order_id, v_order_date;
+
+    INSERT INTO OrderDetails (OrderID, OrderDate, ProductID, Quantity, Price)
+    SELECT v_order_id, v_order_date, r.productid, r.quantity, p.Price
+    FROM unnest(v_ids, v_quantities) AS r(productid, quantity)
+    JOIN Products p ON p.ProductID = r.productid
+    ORDER BY r.productid;
+
+    UPDATE Products p
+    SET StockQuantity = p.StockQuantity - r.quantity
+    FROM unnest(v_ids, v_quantities) AS r(productid, quantity)
+    WHERE p.ProductID = r.productid AND p.ProductID = ANY(v_plain);
+
+    -- Показываемый остаток товаров с секциями обновляет тот, кто первым взял строку
+    -- Products; остальные её пропускают. NO KEY UPDATE не мешает проверке внешнего
+    -- ключа OrderDetails в параллельных заказах.
+    SELECT array_agg(p.ProductID) INTO v_refresh
+    FROM (
+        SELECT ProductID FROM Products WHERE ProductID = ANY(v_sharded)
+        ORDER BY ProductID
+        FOR NO KEY UPDATE SKIP LOCKED
+    ) p;
+    IF v_refresh IS NOT NULL THEN
+        UPDATE Products p
+        SET StockQuantity = b.quantity
+        FROM (
+            SELECT ProductID, SUM(Quantity)::INT AS quantity
+            FROM ProductStockBuckets
+            WHERE ProductID = ANY(v_refresh)
+            GROUP BY ProductID
+        ) b
+        WHERE p.ProductID = b.ProductID;
+    END IF;
+
+    RETURN QUERY SELECT v_order_id, v_total;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,37 @@
+-- Номера заказов и позиций выдаёт только последовательность: OrderID и OrderDetailID
+-- становятся столбцами идентификации GENERATED ALWAYS.
+--
+-- После секционирования (migrations/012_partition_orders.sql) первичные ключи —
+-- (OrderID, OrderDate) и (OrderDetailID, OrderDate), и уникальность одного OrderID
+-- база не проверяет. Заказ, вставленный с уже выданным номером (например, тестовые
+-- данные dml.sql без setval), принимался молча, и всё, что ищет заказ по одному
+-- OrderID — смена статусов, фильтр по номеру, API, — видело два заказа.
+-- Теперь INSERT с явным номером отклоняется, если в нём нет OVERRIDING SYSTEM VALUE.
+--
+-- Ограничение: COPY в Orders/OrderDetails и запись прямо в секции номера не проверяют.
+-- Так работают генератор данных (datagen.py: после загрузки он сдвигает
+-- последовательности setval), восстановление архива (archive.py: возвращает
+-- ранее выданные номера) и перенос строк из секции по умолчанию в create_order_partition.
+-- Кто загружает заказы с новыми номерами этими путями, сам сдвигает последовательность.
+DO $$
+DECLARE
+    v_orders BIGINT;
+    v_lines BIGINT;
+BEGIN
+    -- Следующий номер не меньше прежнего: номера архивированных месяцев и
+    -- откаченных заказов повторно не выдаются
+    SELECT GREATEST(s.last_value, (SELECT MAX(OrderID) FROM Orders)) INTO v_orders FROM orders_orderid_seq s;
+    SELECT GREATEST(s.last_value, (SELECT MAX(OrderDetailID) FROM OrderDetails)) INTO v_lines
+    FROM orderdetails_orderdetailid_seq s;
+
+    ALTER TABLE Orders ALTER COLUMN OrderID DROP DEFAULT;
+    DROP SEQUENCE orders_orderid_seq;
+    ALTER TABLE Orders ALTER COLUMN OrderID ADD GENERATED ALWAYS AS IDENTITY;
+    PERFORM setval(pg_get_serial_sequence('orders', 'orderid'), v_orders);
+
+    ALTER TABLE OrderDetails ALTER COLUMN OrderDetailID DROP DEFAULT;
+    DROP SEQUENCE orderdetails_orderdetailid_seq;
+    ALTER TABLE OrderDetails ALTER COLUMN OrderDetailID ADD GENERATED ALWAYS AS IDENTITY;
+    PERFORM setval(pg_get_serial_sequence('orderdetails', 'orderdetailid'), v_lines);
+END;
+$$;
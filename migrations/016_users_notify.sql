@@ -0,0 +1,8 @@
+-- Уведомления об изменении пользователей: по ним JSON API (api.py) сбрасывает
+-- кэш проверенных логинов и паролей. Без них после смены пароля или роли прежние
+-- данные входа действовали бы до истечения срока записи в кэше.
+DROP TRIGGER IF EXISTS users_notify ON Users;
+CREATE TRIGGER users_notify
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON Users
+FOR EACH STATEMENT
+EXECUTE FUNCTION notify_catalog_changed();
@@ -128,28 +128,28 @@ $$ LANGUAGE plpgsql;
 
 CREATE VIEW OrderDetailsView AS
 SELECT
-o. OrderID,
-o. UserID,
-o. OrderDate,
-o. OrderStatus,
-o. TotalAmount,
-od. ProductID,
-p. ProductName,
-od. Quantity,
-od. Price
+    o.OrderID,
+    o.UserID,
+    o.OrderDate,
+    o.OrderStatus,
+    o.TotalAmount,
+    od.ProductID,
+    p.Name AS ProductName,
+    od.Quantity,
+    od.Price
 FROM Orders o
-JOIN OrderDetails od ON o. OrderID = od. OrderID
-JOIN Products p ON od. ProductID = p. Prod J TD;
+JOIN OrderDetails od ON o.OrderID = od.OrderID
+JOIN Products p ON od.ProductID = p.ProductID;
 
 
 CREATE OR REPLACE FUNCTION check_stock() RETURNS TRIGGER AS $$
 BEGIN
-IF (SELECT stockquantity FROM products WHERE productid = NEW. productid) ‹ NEW. quantity
-RAISE EXCEPTION 'Недостаточное количество товара на складе' ;
-END IF;
-RETURN NEW;
+    IF (SELECT stockquantity FROM products WHERE productid = NEW.productid) < NEW.quantity THEN
+        RAISE EXCEPTION 'Недостаточное количество товара на складе';
+    END IF;
+    RETURN NEW;
 END;
-$$ LANGUAGE plpgsq;
+$$ LANGUAGE plpgsql;
 CREATE TRIGGER check_stock_trigger
 BEFORE INSERT ON orderdetails
 FOR EACH ROW
@@ -22,17 +22,25 @@ INSERT INTO Users (Username, Email, PasswordHash, RoleID, RegistrationDate, Last
     ('jane_smith', 'jane@example.com', 'hash2', 3, '2024-02-01', '2024-12-02', true),
     ('admin_user', 'admin@example.com', 'hash3', 1, '2024-03-01', '2024-12-03', true);
 
-INSERT INTO Orders (OrderID, UserID, OrderDate, TotalAmount, OrderStatus) VALUES
+INSERT INTO Orders (OrderID, UserID, OrderDate, TotalAmount, OrderStatus) OVERRIDING SYSTEM VALUE VALUES
     (1, 1, '2024-11-01', 15500, 'Обрабатывается'),
     (2, 2, '2024-11-02', 2000, 'Доставлено'),
     (3, 1, '2024-11-03', 500, 'Отменено');
 
-INSERT INTO OrderDetails (OrderDetailID, OrderID, ProductID, Quantity, Price) VALUES
-    (1, 1, 1, 2, 1500),
-    (2, 1, 3, 1, 500),
-    (3, 2, 5, 4, 500);
+INSERT INTO OrderDetails (OrderDetailID, OrderID, OrderDate, ProductID, Quantity, Price) OVERRIDING SYSTEM VALUE VALUES
+    (1, 1, '2024-11-01', 1, 2, 1500),
+    (2, 1, '2024-11-01', 3, 1, 500),
+    (3, 2, '2024-11-02', 5, 4, 500);
 
 INSERT INTO Reviews (ReviewID, ProductID, UserID, Rating, Comment, ReviewDate) VALUES
     (1, 1, 1, 5, 'Отличное качество!', '2024-12-01'),
     (2, 2, 2, 4, 'Очень понравилось', '2024-12-02'),
     (3, 3, 3, 3, 'Среднее качество', '2024-12-03');
+
+-- Строки выше вставлены с явными номерами; последовательности сдвигаются за них,
+-- иначе первый новый заказ или отзыв получил бы уже занятый номер
+SELECT setval(pg_get_serial_sequence('orders', 'orderid'), (SELECT MAX(OrderID) FROM Orders));
+SELECT setval(pg_get_serial_sequence('orderdetails', 'orderdetailid'), (SELECT MAX(OrderDetailID) FROM OrderDetails));
+SELECT setval(pg_get_serial_sequence('categories', 'categoryid'), (SELECT MAX(CategoryID) FROM Categories));
+SELECT setval(pg_get_serial_sequence('roles', 'roleid'), (SELECT MAX(RoleID) FROM Roles));
+SELECT setval(pg_get_serial_sequence('reviews', 'reviewid'), (SELECT MAX(ReviewID) FROM Reviews));
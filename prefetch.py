@@ -0,0 +1,59 @@
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Параллельная загрузка независимых данных страницы. Страница заранее перечисляет
+# нужные ей чтения, каждое выполняется в общем пуле потоков на своём соединении
+# из пула БД, и результаты возвращаются вместе — время страницы определяется самым
+# медленным запросом, а не их суммой. Ошибка одного чтения не мешает остальным.
+#
+# Загрузчики не должны вызывать st.*: у потоков пула нет контекста скрипта Streamlit.
+# Контекстные переменные (страница для querylog) копируются в поток загрузчика.
+PREFETCH_WORKERS = int(os.environ.get("PREFETCH_WORKERS", "8"))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class Result:
+    def __init__(self, value=None, error=None):
+        self.value = value
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    # Значение или исключение, с которым завершился загрузчик
+    def get(self):
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(PREFETCH_WORKERS, thread_name_prefix="prefetch")
+    return _executor
+
+
+def _run(loader):
+    try:
+        return Result(loader())
+    except Exception as e:
+        return Result(error=e)
+
+
+# prefetch(categories=fetch_categories, products=lambda: ...) ->
+# {"categories": Result, "products": Result}
+def prefetch(**loaders):
+    if len(loaders) <= 1:
+        return {name: _run(loader) for name, loader in loaders.items()}
+    executor = _get_executor()
+    futures = {name: executor.submit(contextvars.copy_context().run, _run, loader)
+               for name, loader in loaders.items()}
+    return {name: future.result() for name, future in futures.items()}
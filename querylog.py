@@ -0,0 +1,226 @@
+import ctypes
+import ctypes.util
+import glob
+import hashlib
+import os
+import random
+import re
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+
+import psycopg2
+from psycopg2 import extensions
+
+# Журнал запросов приложения. Курсоры соединений из пула (db.py) сообщают сюда о каждом
+# выполненном запросе: отпечаток (текст с параметрами и константами, заменёнными на ?),
+# длительность, число строк, размер результата и страницу, с которой он выполнен.
+# События хранятся в кольцевых буферах фиксированного размера: запись — одно
+# добавление в deque без блокировок, агрегаты считаются только при просмотре.
+# Для запросов дольше QUERY_SLOW_MS с вероятностью QUERY_EXPLAIN_SAMPLE сохраняется план.
+# Под EXPLAIN (ANALYZE, BUFFERS), то есть с повторным выполнением, идут только чтения
+# на соединениях get_connection(read_only=True); для остальных — EXPLAIN без выполнения:
+# повтор оформления заказа удвоил бы его время и удержание блокировок строк.
+ENABLED = os.environ.get("QUERY_LOG_ENABLED", "1") != "0"
+LOG_SIZE = int(os.environ.get("QUERY_LOG_SIZE", "10000"))
+SLOW_SECONDS = float(os.environ.get("QUERY_SLOW_MS", "200")) / 1000
+EXPLAIN_SAMPLE = float(os.environ.get("QUERY_EXPLAIN_SAMPLE", "0.1"))
+SLOW_LOG_SIZE = 50
+
+_statements = deque(maxlen=LOG_SIZE)
+_page_runs = deque(maxlen=LOG_SIZE)
+_slow = deque(maxlen=SLOW_LOG_SIZE)
+
+current_page = ContextVar("querylog_page", default=None)
+_current_run = ContextVar("querylog_run", default=None)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%(?:\(\w+\))?s")
+_TUPLE = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_TUPLES = re.compile(r"\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+")
+_SPACES = re.compile(r"\s+")
+_EXPLAINABLE = re.compile(r"\s*(SELECT|WITH|INSERT|UPDATE|DELETE|VALUES|EXECUTE)\b", re.IGNORECASE)
+# Признаки записи или блокировки строк в тексте запроса (в том числе FOR UPDATE/SHARE)
+_WRITES = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE|SHARE|nextval|setval)\b", re.IGNORECASE)
+
+
+# Отпечаток запроса: одинаков для запросов, отличающихся только значениями
+@lru_cache(maxsize=1024)
+def fingerprint(query):
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    text = _STRING.sub("?", query)
+    text = _PLACEHOLDER.sub("?", text)
+    text = _NUMBER.sub("?", text)
+    text = _TUPLE.sub("(...)", text)
+    text = _TUPLES.sub("(...), ...", text)
+    text = _SPACES.sub(" ", text).strip()
+    return hashlib.md5(text.encode("utf-8")).hexdigest()[:12], text
+
+
+# Размер результата в памяти libpq (PQresultMemorySize, libpq 12+): один вызов
+# вместо обхода всех значений. Берётся та же libpq, с которой собран psycopg2.
+def _load_libpq():
+    package_dir = os.path.dirname(os.path.dirname(psycopg2.__file__))
+    candidates = glob.glob(os.path.join(package_dir, "psycopg2_binary.libs", "libpq*.so*"))
+    candidates.append(ctypes.util.find_library("pq"))
+    for path in candidates:
+        if not path:
+            continue
+        try:
+            libpq = ctypes.CDLL(path)
+            function = libpq.PQresultMemorySize
+        except (OSError, AttributeError):
+            continue
+        function.argtypes = [ctypes.c_void_p]
+        function.restype = ctypes.c_size_t
+        return function
+    return None
+
+
+_result_memory_size = _load_libpq()
+
+
+def _result_size(cur):
+    if _result_memory_size is None:
+        return None
+    pointer = cur.pgresult_ptr
+    return _result_memory_size(pointer) if pointer else None
+
+
+# Запись о выполненном запросе; вызывается курсором сразу после execute
+def record(cur, query, vars, duration):
+    if not ENABLED:
+        return
+    key, text = fingerprint(query)
+    page = current_page.get()
+    _statements.append((time.time(), key, text, duration, cur.rowcount, _result_size(cur), page))
+    run = _current_run.get()
+    if run is not None:
+        run[0] += 1
+        run[1] += duration
+    if duration >= SLOW_SECONDS and random.random() < EXPLAIN_SAMPLE:
+        _slow.append({
+            "time": time.time(),
+            "page": page,
+            "fingerprint": key,
+            "duration": duration,
+            "rows": cur.rowcount,
+            "plan": _explain(cur.connection, query, vars),
+        })
+
+
+# План запроса. EXPLAIN ANALYZE выполняет запрос ещё раз, поэтому он только для чтений
+# на соединениях только для чтения; ошибка EXPLAIN откатывается до точки сохранения.
+# Строковые константы из плана убираются (в них бывают пароли).
+def _explain(conn, query, vars):
+    text = query.decode("utf-8", "replace") if isinstance(query, bytes) else query
+    if conn.autocommit or not _EXPLAINABLE.match(text):
+        return None
+    analyze = getattr(conn, "read_only", False) and not _WRITES.search(text)
+    prefix = "EXPLAIN (ANALYZE, BUFFERS) " if analyze else "EXPLAIN "
+    with extensions.cursor(conn) as cur:
+        try:
+            cur.execute("SAVEPOINT querylog_explain")
+        except psycopg2.Error:
+            return None
+        try:
+            cur.execute(prefix.encode() + query if isinstance(query, bytes) else prefix + query, vars)
+            plan = "\n".join(row[0] for row in cur.fetchall())
+            plan = _STRING.sub("'?'", plan)
+        except psycopg2.Error as e:
+            plan = f"EXPLAIN не выполнен: {e.pgerror or e}"
+        cur.execute("ROLLBACK TO SAVEPOINT querylog_explain")
+        cur.execute("RELEASE SAVEPOINT querylog_explain")
+    return plan
+
+
+# Выполнение страницы: время скрипта и сколько в нём заняли запросы к БД
+@contextmanager
+def page_run(page):
+    run = [0, 0.0]
+    page_token = current_page.set(page)
+    run_token = _current_run.set(run)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _current_run.reset(run_token)
+        current_page.reset(page_token)
+        if ENABLED:
+            _page_runs.append((time.time(), page, time.perf_counter() - started, run[0], run[1]))
+
+
+# Перезапуск фрагмента Streamlit (st.fragment) без остального скрипта: выполняется
+# вне page_run и записывается отдельной строкой под именем name. При полном запуске
+# страницы фрагмент — её часть, и его запросы входят в запуск страницы.
+# Применяется и как декоратор функции фрагмента.
+@contextmanager
+def fragment_run(name):
+    if _current_run.get() is not None:
+        yield
+        return
+    with page_run(name):
+        yield
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+# Запросы из буфера, сгруппированные по отпечатку, по убыванию суммарного времени
+def top_queries(limit=20):
+    groups = {}
+    for _, key, text, duration, rows, size, page in list(_statements):
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {"fingerprint": key, "query": text, "calls": 0,
+                                   "total": 0.0, "max": 0.0, "rows": 0, "bytes": 0, "pages": set()}
+        group["calls"] += 1
+        group["total"] += duration
+        group["max"] = max(group["max"], duration)
+        group["rows"] += max(rows, 0)
+        group["bytes"] += size or 0
+        group["pages"].add(page or "—")
+    result = sorted(groups.values(), key=lambda group: group["total"], reverse=True)[:limit]
+    for group in result:
+        group["mean"] = group["total"] / group["calls"]
+        group["pages"] = ", ".join(sorted(group["pages"]))
+    return result
+
+
+def page_timings():
+    groups = {}
+    for _, page, duration, statements, db_time in list(_page_runs):
+        groups.setdefault(page, []).append((duration, statements, db_time))
+    result = []
+    for page, runs in groups.items():
+        durations = [run[0] for run in runs]
+        total = sum(durations)
+        result.append({
+            "page": page,
+            "runs": len(runs),
+            "mean": total / len(runs),
+            "p95": _percentile(durations, 0.95),
+            "statements": sum(run[1] for run in runs) / len(runs),
+            "db_share": sum(run[2] for run in runs) / total if total else 0.0,
+        })
+    return sorted(result, key=lambda row: row["mean"] * row["runs"], reverse=True)
+
+
+def slow_queries():
+    return list(reversed(_slow))
+
+
+def window():
+    return len(_statements), LOG_SIZE
+
+
+def reset():
+    _statements.clear()
+    _page_runs.clear()
+    _slow.clear()